@@ -0,0 +1,530 @@
+import asyncio
+import socket
+from collections import deque
+from request import Request
+from protocol import HEADER, MAX_FRAME_SIZE, pack_frame
+from codec import encode_request, decode_response
+from compression import Compressor
+from partition import shard_of
+
+
+class AsyncClient():
+    """
+    This is a class for connecting to the server's database from asyncio code, with the same API as Client.
+    Every call sends its request at once and waits for its response, so many calls can be in flight on one connection.
+    A reader task receives the responses and matches them to the waiting calls by their request ids.
+    With routing, the requests about a single key are sent straight to the shard owning it, like Client's.
+
+    Attributes:
+        reader (StreamReader): The stream the responses are read from.
+        writer (StreamWriter): The stream the requests are written to.
+        timeout (float): The number of seconds a response is waited for, or None to wait forever.
+        last_request_id (int): The id of the last sent request.
+        pending (dict): The futures of the requests waiting for a response, by request id.
+        reader_task (Task): The task receiving the responses.
+        compressor (Compressor): The compressor of the requests, as negotiated with the server, or None.
+        subscriptions (dict): The queues of the subscriptions' notifications, by subscribe request id.
+        shards (List): The clients connected to the shards, by shard index, if the requests are routed to a ShardedServer's shards, else empty.
+
+    Note: In order for tests to work the server should be running on 127.0.0.1:65534
+    Tests:
+        >>> async def example():
+        ...     client = await AsyncClient.connect("127.0.0.1", 65534, timeout=5)
+        ...     responses = await asyncio.gather(*(client.add(40 + number, "async") for number in range(3)))
+        ...     print(responses[0])
+        ...     print(sorted(response.data[0][1] for response in await asyncio.gather(*(client.incr("counter") for _ in range(5)))))
+        ...     print(await client.delete("counter"))
+        ...     print(await client.query("read key >= int ( 40 ) limit 2"))
+        ...     cursor = await client.query("read key >= int ( 40 )", page_size=2)
+        ...     print([entry async for entry in cursor])
+        ...     print(await client.delete_many([40, 41, 42]))
+        ...     async with await client.subscribe(keys=[44]) as subscription:
+        ...         await client.add(44, "watched")
+        ...         await client.delete(44)
+        ...         print(await subscription.__anext__(), await subscription.__anext__())
+        ...     await client.close()
+        ...     client = await AsyncClient.connect("127.0.0.1", 65534, timeout=5, compression="lzma")
+        ...     print((await client.add(43, "lzma " * 1000)).data == [(43, "lzma " * 1000)], client.compressor.algorithm)
+        ...     print(await client.delete(43))
+        ...     await client.close()
+        ...     client = await AsyncClient.connect("127.0.0.1", 65534, timeout=5, routing=True)
+        ...     print(client.shards, (await client.read(40)).success)  # the server is not sharded
+        ...     await client.close()
+        >>> asyncio.run(example())
+        Response(success=True, message=None, data=[(40, 'async')])
+        [1, 2, 3, 4, 5]
+        Response(success=True, message=None, data=[])
+        Response(success=True, message=None, data=[(40, 'async'), (41, 'async')])
+        [(40, 'async'), (41, 'async'), (42, 'async')]
+        Response(success=True, message=None, data=[[(40, 'async')], [(41, 'async')], [(42, 'async')]])
+        ('set', 44, 'watched') ('delete', 44, 'watched')
+        True lzma
+        Response(success=True, message=None, data=[])
+        [] False
+    """
+
+    def __init__(self, reader, writer, timeout=None):
+        """
+        The constructor for the asyncio client class. Use AsyncClient.connect() to open a connection.
+
+        Parameters:
+            reader (StreamReader): The stream the responses are read from.
+            writer (StreamWriter): The stream the requests are written to.
+            timeout (float): The number of seconds a response is waited for, or None to wait forever.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.last_request_id = 0
+        self.pending = {}
+        self.compressor = None
+        self.subscriptions = {}
+        self.shards = []
+        self.reader_task = asyncio.get_running_loop().create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host, port, timeout=None, compression=None, routing=False):
+        """
+        The method connects to the server using the given host and port.
+
+        Parameters:
+           host (String): The host of the server.
+           port (int): The port on which the server is bound.
+           timeout (float): The number of seconds the connection attempt or a response is waited for, or None to wait forever.
+           compression (String): The compression negotiated with the server, "zlib" or "lzma", or None to compress nothing.
+                                 If the server refuses it, nothing is compressed.
+           routing (bool): Whether the requests about a single key are sent straight to the owning shard, if the server is sharded.
+                           See Client.
+
+        Returns:
+            AsyncClient: The connected client.
+
+        Raises:
+            ConnectionRefusedError: Connection to the server was refused.
+        """
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise ConnectionRefusedError(
+                "Connection to the server was refused.")
+        writer.get_extra_info("socket").setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client = cls(reader, writer, timeout)
+        if compression is not None:
+            await client.set_compression(compression)
+        if routing:
+            await client._connect_to_shards(host, timeout, compression)
+        return client
+
+    async def read(self, key):
+        """
+        The method reads an entry. See Client.read().
+        """
+        return await self._send_to_owner(Request(0, key, None, None))
+
+    async def add(self, key, value, ttl=None):
+        """
+        The method adds an entry. See Client.add().
+        """
+        return await self._send_to_owner(Request(1, key, value, None, None if ttl is None else {"ttl": ttl}))
+
+    async def delete(self, key):
+        """
+        The method deletes an entry. See Client.delete().
+        """
+        return await self._send_to_owner(Request(2, key, None, None))
+
+    async def query(self, query, page_size=None, timeout=None):
+        """
+        The method queries the database. See Client.query().
+
+        Returns:
+            Response: If no page size was given.
+            AsyncQueryCursor: If a page size was given. It iterates, with async for, over the (key, value) tuples of the matching entries.
+
+        Raises:
+            ValueError: If a page size was given and the query action was not succesful.
+        """
+        options = None
+        if page_size is not None:
+            options = {"page_size": page_size, "timeout": timeout}
+        response = await self._request(Request(3, None, None, query, options))
+        if page_size is None:
+            return response
+        if not response.success:
+            raise ValueError(response.message)
+        return AsyncQueryCursor(self, response, page_size)
+
+    async def read_many(self, keys):
+        """
+        The method reads many entries with a single request. See Client.read_many().
+        """
+        return await self._request(Request(4, list(keys), None, None))
+
+    async def add_many(self, entries, ttl=None):
+        """
+        The method adds many entries with a single request. See Client.add_many().
+        """
+        if isinstance(entries, dict):
+            entries = entries.items()
+        return await self._request(Request(5, None, [tuple(entry) for entry in entries], None,
+                                           None if ttl is None else {"ttl": ttl}))
+
+    async def delete_many(self, keys):
+        """
+        The method deletes many entries with a single request. See Client.delete_many().
+        """
+        return await self._request(Request(6, list(keys), None, None))
+
+    async def expire(self, key, seconds):
+        """
+        The method sets the time to live of an entry. See Client.expire().
+        """
+        return await self._send_to_owner(Request(13, key, seconds, None))
+
+    async def ttl(self, key):
+        """
+        The method reads the remaining time to live of an entry. See Client.ttl().
+        """
+        return await self._send_to_owner(Request(14, key, None, None))
+
+    async def persist(self, key):
+        """
+        The method removes the time to live of an entry. See Client.persist().
+        """
+        return await self._send_to_owner(Request(15, key, None, None))
+
+    async def incr(self, key, delta=1):
+        """
+        The method atomically adds a number to the value of an entry. See Client.incr().
+        """
+        return await self._send_to_owner(Request(19, key, delta, None))
+
+    async def decr(self, key, delta=1):
+        """
+        The method atomically subtracts a number from the value of an entry. See Client.decr().
+        """
+        return await self.incr(key, -delta)
+
+    async def append(self, key, value):
+        """
+        The method atomically appends to the value of an entry. See Client.append().
+        """
+        return await self._send_to_owner(Request(20, key, value, None))
+
+    async def setnx(self, key, value, ttl=None):
+        """
+        The method adds an entry only if it does not exist. See Client.setnx().
+        """
+        return await self._send_to_owner(Request(21, key, value, None, None if ttl is None else {"ttl": ttl}))
+
+    async def compare_and_set(self, key, value, expected):
+        """
+        The method atomically replaces the value of an entry if it is the expected one. See Client.compare_and_set().
+        """
+        return await self._send_to_owner(Request(22, key, value, None, {"expected": expected}))
+
+    async def create_index(self, kind):
+        """
+        The method creates a value index. See Client.create_index().
+        """
+        return await self._request(Request(7, kind, None, None))
+
+    async def drop_index(self, kind):
+        """
+        The method drops a value index. See Client.drop_index().
+        """
+        return await self._request(Request(8, kind, None, None))
+
+    async def subscribe(self, keys=None, query=None):
+        """
+        The method subscribes to the changes of exact keys, or of the entries matching a read query. See Client.subscribe().
+
+        Returns:
+            AsyncSubscription: The subscription, iterating with async for over the (event, key, value) notifications.
+
+        Raises:
+            ValueError: If the subscription was refused.
+        """
+        notifications = asyncio.Queue()
+        response = await self._request(Request(23, None if keys is None else list(keys), None, query), notifications)
+        if not response.success:
+            self._forget(notifications)
+            raise ValueError(response.message)
+        return AsyncSubscription(self, response.data, notifications)
+
+    async def set_compression(self, algorithm):
+        """
+        The method negotiates the compression of the connection's messages. See Client.set_compression().
+        """
+        response = await self._request(Request(18, algorithm, None, None))
+        if response.success:
+            self.compressor = None if algorithm is None else Compressor(
+                algorithm, response.data["level"], response.data["threshold"])
+            for shard in self.shards:
+                await shard.set_compression(algorithm)
+        return response
+
+    async def close(self):
+        """
+        The method closes the connection, and the connections to the shards. The calls still waiting for a response raise ConnectionError.
+        """
+        self.reader_task.cancel()
+        self._fail_pending(ConnectionError("Connection closed by the client."))
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+        for shard in self.shards:
+            await shard.close()
+
+    async def _connect_to_shards(self, host, timeout=None, compression=None):
+        """
+        The method asks the server for the ports of its shards and connects to every shard on the server's host. See Client._connect_to_shards().
+
+        Parameters:
+           host (String): The host of the server.
+           timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+           compression (String): The compression negotiated with the shards, "zlib" or "lzma", or None to compress nothing.
+        """
+        response = await self._request(Request(25, None, None, None))
+        if not response.success:
+            return
+        try:
+            for port in response.data:
+                self.shards.append(await AsyncClient.connect(host, port, timeout, compression))
+        except ConnectionRefusedError:
+            for shard in self.shards:
+                await shard.close()
+            self.shards = []
+
+    async def _send_to_owner(self, request):
+        """
+        The method sends a request about a single key and waits for the response, from the shard owning the key if the requests are routed.
+
+        Parameters:
+            request (Request): The request, whose key is the entry's key.
+
+        Returns:
+            Response: The response to the request.
+        """
+        client = self.shards[shard_of(request.key, len(self.shards))] if self.shards else self
+        return await client._request(request)
+
+    async def _request(self, request, notifications=None):
+        """
+        The method sends a request and waits for its response.
+
+        Parameters:
+            request (Request): The request that will be sent.
+            notifications (Queue): For a subscribe request, the queue of the notifications following its response.
+
+        Returns:
+            Response: The server's response.
+
+        Raises:
+            asyncio.TimeoutError: If the response was not received in time. A late response is discarded.
+            ConnectionError: If the connection is closed.
+        """
+        if self.reader_task.done():
+            raise ConnectionError("Connection closed by the peer.")
+        self.last_request_id += 1
+        request_id = self.last_request_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        if notifications is not None:  # registered first, the notifications may be received right after the response
+            self.subscriptions[request_id] = notifications
+        try:
+            self.writer.write(pack_frame(request_id, encode_request(request, compressor=self.compressor)))
+            await self.writer.drain()
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _receive(self):
+        """
+        The method receives the responses and resolves the futures of their requests, until the connection is closed.
+        """
+        try:
+            while True:
+                length, request_id = HEADER.unpack(await self.reader.readexactly(HEADER.size))
+                if length > MAX_FRAME_SIZE:
+                    raise ConnectionError("Frame exceeds the maximum size.")
+                payload = await self.reader.readexactly(length)
+                future = self.pending.pop(request_id, None)
+                if future is not None:
+                    if not future.done():
+                        future.set_result(decode_response(payload))
+                elif request_id in self.subscriptions:
+                    self.subscriptions[request_id].put_nowait(decode_response(payload))
+        except asyncio.IncompleteReadError:
+            self._fail_pending(ConnectionError("Connection closed by the peer."))
+        except Exception as error:
+            self._fail_pending(ConnectionError(str(error)))
+
+    def _fail_pending(self, error):
+        """
+        The method makes every call waiting for a response, and every subscription waiting for a notification, raise the given error.
+
+        Parameters:
+            error (Exception): The error raised by the waiting calls.
+        """
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+        for notifications in self.subscriptions.values():
+            notifications.put_nowait(error)
+        self.subscriptions.clear()
+
+    def _forget(self, notifications):
+        """
+        The method stops queueing the notifications of a subscription.
+
+        Parameters:
+            notifications (Queue): The subscription's queue.
+        """
+        for request_id, queue in list(self.subscriptions.items()):
+            if queue is notifications:
+                del self.subscriptions[request_id]
+
+
+class AsyncQueryCursor():
+    """
+    This is a class for lazily iterating, with async for, over the results of a query streamed by the server in pages.
+    See QueryCursor.
+
+    Attributes:
+        client (AsyncClient): The client whose connection is used.
+        cursor (int): The id of the cursor on the server, or None if there are no more pages.
+        page_size (int): The number of entries fetched at once.
+        entries (deque): The fetched entries that were not consumed yet.
+    """
+
+    def __init__(self, client, response, page_size):
+        """
+        The constructor for the asyncio query cursor class.
+
+        Parameters:
+           client (AsyncClient): The client whose connection is used.
+           response (Response): The response holding the first page and the cursor's id.
+           page_size (int): The number of entries fetched at once.
+        """
+        self.client = client
+        self.cursor = response.cursor
+        self.page_size = page_size
+        self.entries = deque(response.data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """
+        The method returns the next matching entry, fetching the next page if needed.
+
+        Returns:
+            (key, value): The next matching entry.
+
+        Raises:
+            StopAsyncIteration: If there are no more entries.
+            LookupError: If the cursor expired on the server.
+        """
+        while not self.entries:
+            if self.cursor is None:
+                raise StopAsyncIteration
+            response = await self.client._request(Request(9, self.cursor, None, None,
+                                                          {"page_size": self.page_size}))
+            if not response.success:
+                self.cursor = None
+                raise LookupError(response.message)
+            self.cursor = response.cursor
+            self.entries.extend(response.data)
+        return self.entries.popleft()
+
+    async def close(self):
+        """
+        The method closes the cursor on the server, if it still has pages.
+        """
+        if self.cursor is not None:
+            cursor, self.cursor = self.cursor, None
+            await self.client._request(Request(10, cursor, None, None))
+        self.entries.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+
+class AsyncSubscription():
+    """
+    This is a class for iterating, with async for, over the notifications of a subscription. See client.Subscription.
+
+    Attributes:
+        client (AsyncClient): The client whose connection is used.
+        subscription_id (int): The id of the subscription on the server, or None once it is closed.
+        notifications (Queue): The received notifications (Response objects) that were not consumed yet.
+    """
+
+    def __init__(self, client, subscription_id, notifications):
+        """
+        The constructor for the asyncio subscription class.
+
+        Parameters:
+           client (AsyncClient): The client whose connection is used.
+           subscription_id (int): The id of the subscription on the server.
+           notifications (Queue): The queue of the received notifications.
+        """
+        self.client = client
+        self.subscription_id = subscription_id
+        self.notifications = notifications
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        """
+        The method returns the next notification, waiting for it if none was received yet.
+
+        Returns:
+            (event, key, value): The next notification.
+
+        Raises:
+            StopAsyncIteration: If the subscription is closed.
+            ConnectionError: If the connection is closed.
+        """
+        if self.subscription_id is None and self.notifications.empty():
+            raise StopAsyncIteration
+        response = await self.notifications.get()
+        if isinstance(response, Exception):
+            self.subscription_id = None
+            raise response
+        if not response.success:
+            return ("dropped", None, response.data)
+        key, value = response.data[0]
+        return (response.message, key, value)
+
+    async def close(self):
+        """
+        The method removes the subscription on the server. The notifications received before are dropped.
+        """
+        if self.subscription_id is not None:
+            subscription_id, self.subscription_id = self.subscription_id, None
+            if not self.client.reader_task.done():
+                await self.client._request(Request(24, subscription_id, None, None))
+        self.client._forget(self.notifications)
+        while not self.notifications.empty():
+            self.notifications.get_nowait()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exception):
+        await self.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark comparing the binary codec with the pickle encoding of Request and Response objects.
+
+Usage (from the repository's root):
+    python -m benchmarks.codec_benchmark [--number 100000]
+"""
+import argparse
+import pickle
+import timeit
+from request import Request
+from response import Response
+from codec import encode_request, decode_request, encode_response, decode_response
+
+MESSAGES = {
+    "read int key": Request(0, 10, None, None),
+    "add str key/value": Request(1, "1a2b3c", "Radu-Mihai", None),
+    "add float value": Request(1, 15, 3.14, None),
+    "query": Request(3, None, None, "read key > int ( 5 )"),
+    "entry response": Response(True, None, [(10, "Radu-Mihai")]),
+    "error response": Response(False, "Entry does not exist.", []),
+    "100 entries response": Response(True, None, [(i, f"value-{i}") for i in range(100)]),
+}
+
+
+def benchmark(message, number):
+    """
+    The function measures the encoding and decoding cost of a message with both encodings.
+
+    Parameters:
+        message (Request or Response): The message.
+        number (int): The number of times every operation is repeated.
+
+    Returns:
+        rows (List): A (name, size, encode microseconds, decode microseconds) tuple per encoding.
+    """
+    if isinstance(message, Request):
+        encode, decode = encode_request, decode_request
+    else:
+        encode, decode = encode_response, decode_response
+    encodings = {
+        "pickle": (pickle.dumps, pickle.loads),
+        "codec": (encode, decode),
+    }
+    rows = []
+    for name, (dumps, loads) in encodings.items():
+        payload = dumps(message)
+        encode_time = timeit.timeit(lambda: dumps(message), number=number)
+        decode_time = timeit.timeit(lambda: loads(payload), number=number)
+        rows.append((name, len(payload), encode_time / number * 1e6,
+                    decode_time / number * 1e6))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=100000,
+                        help="repetitions per operation (default: 100000)")
+    args = parser.parse_args()
+
+    print(f"{'message':<22}{'encoding':<10}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for label, message in MESSAGES.items():
+        for name, size, encode_time, decode_time in benchmark(message, args.number):
+            print(f"{label:<22}{name:<10}{size:>8}{encode_time:>12.2f}{decode_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
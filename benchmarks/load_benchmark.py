@@ -0,0 +1,443 @@
+"""
+Load benchmark driving a local server with concurrent clients, reporting the throughput and the latency percentiles.
+
+It starts a Server (or a ShardedServer) in a temporary directory, fills it with '--keys' entries, then runs '--clients'
+client processes for '--duration' seconds. Every client sends one request at a time, picking the operation from the '--mix'
+and the key from the '--distribution'. The results can be saved as a baseline and compared with it, to catch regressions.
+
+Usage (from the repository's root):
+    python -m benchmarks.load_benchmark [--clients 8] [--duration 10] [--mix read=80,add=15,delete=3,query=2]
+                                        [--keys 10000] [--distribution zipf] [--zipf-exponent 1.0] [--value-size 16-256]
+                                        [--engine snapshot] [--shards 0] [--port 65500] [--compression none]
+                                        [--save-baseline baseline.json] [--baseline baseline.json] [--tolerance 10]
+The exit status is 1 if a regression beyond the tolerance was found against the baseline.
+With '--compression', the clients negotiate the compression of their connections and the server's compression ratio
+and CPU time are reported.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import tempfile
+import multiprocessing
+from bisect import bisect
+from itertools import accumulate
+
+OPERATIONS = ("read", "add", "delete", "query")
+PERCENTILES = (("p50", 50), ("p95", 95), ("p99", 99), ("p999", 99.9))
+
+
+def parse_mix(text):
+    """
+    The function parses an operation mix.
+
+    Parameters:
+        text (String): The comma separated "operation=weight" pairs.
+
+    Returns:
+        dict: The weight of every operation.
+
+    Raises:
+        ValueError: If an operation does not exist or a weight is not a positive number.
+
+    Tests:
+        >>> parse_mix("read=80, add=20")
+        {'read': 80.0, 'add': 20.0}
+        >>> parse_mix("scan=1")
+        Traceback (most recent call last):
+        ...
+        ValueError: Operation scan does not exist.
+    """
+    mix = {}
+    for pair in text.split(","):
+        operation, _, weight = pair.strip().partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Operation {operation} does not exist.")
+        mix[operation] = float(weight)
+        if mix[operation] <= 0:
+            raise ValueError(f"Weight of {operation} must be positive.")
+    return mix
+
+
+def parse_size(text):
+    """
+    The function parses a value size, a number of bytes or a "minimum-maximum" range.
+
+    Returns:
+        (minimum, maximum): The bounds of the value sizes.
+
+    Tests:
+        >>> parse_size("100"), parse_size("16-256")
+        ((100, 100), (16, 256))
+    """
+    minimum, _, maximum = text.partition("-")
+    return int(minimum), int(maximum or minimum)
+
+
+class KeySampler():
+    """
+    This is a class for drawing keys among 0 .. count - 1, uniformly or following a Zipf distribution.
+    With the Zipf distribution the key of rank r (from 0) is drawn with a probability proportional to 1 / (r + 1) ** exponent,
+    so a few keys get most of the requests.
+
+    Attributes:
+        count (int): The number of keys.
+        random (Random): The random number generator.
+        cumulative (List): The cumulative weights of the keys, or None for the uniform distribution.
+
+    Tests:
+        >>> sampler = KeySampler(1000, "zipf", 1.2, seed=1)
+        >>> keys = [sampler.next() for _ in range(10000)]
+        >>> keys.count(0) > keys.count(10) > keys.count(500)
+        True
+        >>> all(0 <= key < 1000 for key in keys)
+        True
+    """
+
+    def __init__(self, count, distribution="uniform", exponent=1.0, seed=None):
+        """
+        The constructor for the key sampler class.
+
+        Parameters:
+            count (int): The number of keys.
+            distribution (String): The distribution, "uniform" or "zipf".
+            exponent (float): The exponent of the Zipf distribution.
+            seed: The seed of the random number generator.
+
+        Raises:
+            ValueError: The distribution does not exist.
+        """
+        if distribution not in ("uniform", "zipf"):
+            raise ValueError(f"Distribution {distribution} does not exist.")
+        self.count = count
+        self.random = random.Random(seed)
+        self.cumulative = None
+        if distribution == "zipf":
+            self.cumulative = list(accumulate(
+                1 / (rank + 1) ** exponent for rank in range(count)))
+
+    def next(self):
+        """
+        The method draws a key.
+        """
+        if self.cumulative is None:
+            return self.random.randrange(self.count)
+        return min(bisect(self.cumulative, self.random.random() * self.cumulative[-1]), self.count - 1)
+
+
+def percentile(ordered, rank):
+    """
+    The function reads a percentile of sorted values, by the nearest-rank method.
+
+    Parameters:
+        ordered (List): The sorted values.
+        rank (float): The percentile, between 0 and 100.
+
+    Returns:
+        float: The value, or None if there are no values.
+
+    Tests:
+        >>> percentile(list(range(1, 101)), 99), percentile(list(range(1, 1001)), 99.9), percentile([5], 50), percentile([], 50)
+        (99, 999, 5, None)
+    """
+    if not ordered:
+        return None
+    position = math.ceil(round(len(ordered) * rank / 100, 9)) - 1
+    return ordered[max(0, min(len(ordered) - 1, position))]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    The function summarizes the clients' latencies.
+
+    Parameters:
+        latencies (dict): The latencies, in seconds, of every operation.
+        errors (dict): The number of failed requests of every operation.
+        elapsed (float): The duration of the measurement, in seconds.
+
+    Returns:
+        dict: The total and per operation "ops" (requests per second), "count", "errors" and latency percentiles (milliseconds).
+    """
+    def describe(values, failed):
+        ordered = sorted(values)
+        summary = {"count": len(ordered), "errors": failed,
+                   "ops": len(ordered) / elapsed if elapsed else 0.0}
+        for name, rank in PERCENTILES:
+            value = percentile(ordered, rank)
+            summary[name] = None if value is None else value * 1000
+        return summary
+
+    results = {"total": describe([value for values in latencies.values() for value in values],
+                                 sum(errors.values()))}
+    for operation in OPERATIONS:
+        if operation in latencies:
+            results[operation] = describe(
+                latencies[operation], errors[operation])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    The function compares results with a baseline.
+    A regression is a throughput lower, or a p99 latency higher, than the baseline's by more than the tolerance.
+
+    Parameters:
+        results (dict): The summarized results.
+        baseline (dict): The summarized results of the baseline.
+        tolerance (float): The allowed difference, in percent.
+
+    Returns:
+        (rows, regressions): The (name, metric, baseline, current, change in percent) rows and the regressed rows.
+
+    Tests:
+        >>> rows, regressions = compare({"total": {"ops": 80.0, "p99": 1.0}}, {"total": {"ops": 100.0, "p99": 1.0}}, 10)
+        >>> [row[:2] for row in regressions]
+        [('total', 'ops')]
+    """
+    rows, regressions = [], []
+    for name, summary in results.items():
+        for metric in ("ops",) + tuple(metric for metric, _ in PERCENTILES):
+            before, after = baseline.get(name, {}).get(metric), summary.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            row = (name, metric, before, after, change)
+            rows.append(row)
+            if (metric == "ops" and change < -tolerance) or (metric == "p99" and change > tolerance):
+                regressions.append(row)
+    return rows, regressions
+
+
+def _run_server(directory, sharded, settings):
+    """
+    The function runs the benchmarked server in its own process, in an empty directory so no config file is read.
+    """
+    os.chdir(directory)
+    sys.stdout = open(os.devnull, "w")
+    if sharded:
+        from shard import ShardedServer
+        ShardedServer(**settings)
+    else:
+        from server import Server
+        Server(**settings)
+
+
+def start_server(args, directory):
+    """
+    The function starts the benchmarked server and waits until it accepts connections.
+
+    Parameters:
+        args (Namespace): The parsed command line arguments.
+        directory (String): The directory of the server's files.
+
+    Returns:
+        Process: The server's process.
+
+    Raises:
+        ConnectionError: Server could not be started.
+    """
+    settings = {"host": "127.0.0.1", "port": args.port, "filename": "benchmark",
+                "wal_filename": "benchmark.wal", "storage_engine": args.engine}
+    if args.shards:
+        settings.update(workers=args.shards, shard_port=args.port + 1)
+    process = multiprocessing.Process(target=_run_server, args=(
+        directory, bool(args.shards), settings))
+    process.start()
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", args.port)).close()
+            return process
+        except OSError:
+            if not process.is_alive():
+                raise ConnectionError("Server could not be started.")
+            time.sleep(0.05)
+
+
+def fill(port, keys, sizes):
+    """
+    The function adds the entries of all the keys, so the reads find them.
+    """
+    from client import Client
+    client = Client("127.0.0.1", port)
+    generator = random.Random(0)
+    for start in range(0, keys, 1000):
+        client.add_many([(key, "x" * generator.randint(*sizes))
+                         for key in range(start, min(keys, start + 1000))])
+    client.close()
+
+
+def _run_client(number, args, start, queue):
+    """
+    The function runs a benchmark client: it sends requests from the start event until the duration elapsed,
+    and puts its latencies and errors in the queue. The latencies of the first '--warmup' seconds are not recorded.
+    """
+    from client import Client
+    client = Client("127.0.0.1", args.port,
+                    compression=None if args.compression == "none" else args.compression)
+    mix = parse_mix(args.mix)
+    operations = list(mix)
+    cumulative = list(accumulate(mix.values()))
+    keys = KeySampler(args.keys, args.distribution,
+                      args.zipf_exponent, seed=number)
+    generator = random.Random(number)
+    sizes = parse_size(args.value_size)
+    latencies = {operation: [] for operation in operations}
+    errors = dict.fromkeys(operations, 0)
+    requests = {
+        "read": lambda key: client.read(key),
+        "add": lambda key: client.add(key, "x" * generator.randint(*sizes)),
+        "delete": lambda key: client.delete(key),
+        "query": lambda key: client.query(f"read key >= int ( {key} ) limit 10"),
+    }
+
+    start.wait()
+    began = time.perf_counter()
+    measured = began + args.warmup
+    deadline = measured + args.duration
+    clock = time.perf_counter
+    while True:
+        operation = operations[bisect(
+            cumulative, generator.random() * cumulative[-1])]
+        key = keys.next()
+        sent = clock()
+        if sent >= deadline:
+            break
+        try:
+            response = requests[operation](key)
+            failed = not response.success and operation in ("add", "query")  # the key may be missing
+        except Exception:
+            failed = True
+        if sent >= measured:
+            latencies[operation].append(clock() - sent)
+            errors[operation] += failed
+    client.close()
+    queue.put((latencies, errors))
+
+
+def report_compression(port):
+    """
+    The function prints the compression ratio of the server's responses and requests, and the CPU time it spent on them.
+    """
+    from client import Client
+    client = Client("127.0.0.1", port)
+    stats = client.stats().data["compression"]
+    client.close()
+    ratio = "n/a" if stats["ratio"] is None else f"{stats['ratio']:.2f}"
+    print(f"compression: ratio {ratio} over {stats['values']} values ({stats['incompressible']} incompressible), "
+          f"{stats['compress_seconds'] * 1000:.1f} ms compressing, "
+          f"{stats['decompress_seconds'] * 1000:.1f} ms decompressing {stats['decompressed_values']} values")
+
+
+def run(args):
+    """
+    The function runs the benchmark.
+
+    Parameters:
+        args (Namespace): The parsed command line arguments.
+
+    Returns:
+        dict: The summarized results.
+    """
+    parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as directory:
+        server = None if args.external else start_server(args, directory)
+        try:
+            if not args.external:
+                fill(args.port, args.keys, parse_size(args.value_size))
+            start = multiprocessing.Event()
+            queue = multiprocessing.Queue()
+            clients = [multiprocessing.Process(target=_run_client, args=(number, args, start, queue))
+                       for number in range(args.clients)]
+            for process in clients:
+                process.start()
+            time.sleep(0.5)  # lets the clients connect
+            start.set()
+            reports = [queue.get() for _ in clients]
+            for process in clients:
+                process.join()
+            if args.compression != "none":
+                report_compression(args.port)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.join()
+
+    latencies = {operation: [] for operation in OPERATIONS}
+    errors = dict.fromkeys(OPERATIONS, 0)
+    for client_latencies, client_errors in reports:
+        for operation, values in client_latencies.items():
+            latencies[operation].extend(values)
+            errors[operation] += client_errors[operation]
+    latencies = {operation: values for operation,
+                 values in latencies.items() if values}
+    return summarize(latencies, errors, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8,
+                        help="concurrent client processes (default: 8)")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="measured seconds (default: 10)")
+    parser.add_argument("--warmup", type=float, default=1,
+                        help="seconds run before measuring (default: 1)")
+    parser.add_argument("--mix", default="read=80,add=15,delete=3,query=2",
+                        help="weights of the read, add, delete and query operations (default: read=80,add=15,delete=3,query=2)")
+    parser.add_argument("--keys", type=int, default=10000,
+                        help="number of distinct keys, all added before the run (default: 10000)")
+    parser.add_argument("--distribution", choices=("uniform", "zipf"), default="zipf",
+                        help="key distribution (default: zipf)")
+    parser.add_argument("--zipf-exponent", type=float, default=1.0,
+                        help="exponent of the Zipf distribution (default: 1.0)")
+    parser.add_argument("--value-size", default="16-256",
+                        help="value size in bytes, or a minimum-maximum range (default: 16-256)")
+    parser.add_argument("--engine", choices=("snapshot", "segment"), default="snapshot",
+                        help="storage engine of the server (default: snapshot)")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="run a sharded server with this many workers (default: 0, a single server)")
+    parser.add_argument("--port", type=int, default=65500,
+                        help="port of the server; the shards use the next ports (default: 65500)")
+    parser.add_argument("--compression", choices=("none", "zlib", "lzma"), default="none",
+                        help="compression negotiated by the clients' connections (default: none)")
+    parser.add_argument("--external", action="store_true",
+                        help="benchmark a server already running on 127.0.0.1:PORT, without filling it")
+    parser.add_argument("--save-baseline", metavar="FILE",
+                        help="save the results as a baseline JSON file")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare the results with a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=10,
+                        help="allowed throughput drop or p99 latency growth against the baseline, in percent (default: 10)")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    print(f"{'operation':<10}{'count':>10}{'errors':>8}{'ops/s':>11}"
+          + "".join(f"{name + ' ms':>10}" for name, _ in PERCENTILES))
+    for name, summary in results.items():
+        print(f"{name:<10}{summary['count']:>10}{summary['errors']:>8}{summary['ops']:>11.0f}"
+              + "".join(f"{summary[metric]:>10.3f}" for metric, _ in PERCENTILES))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as handle:
+            json.dump({"settings": {key: value for key, value in vars(args).items()
+                                    if key not in ("save_baseline", "baseline")},
+                       "results": results}, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)
+        rows, regressions = compare(
+            results, baseline["results"], args.tolerance)
+        print(f"\n{'operation':<10}{'metric':<8}{'baseline':>12}{'current':>12}{'change':>9}")
+        for name, metric, before, after, change in rows:
+            flag = " <- regression" if (name, metric, before, after, change) in regressions else ""
+            print(f"{name:<10}{metric:<8}{before:>12.3f}{after:>12.3f}{change:>+8.1f}%{flag}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,11 @@
 import socket
-import pickle
+from collections import deque
 from request import Request
 from response import Response
+from protocol import pack_frame, recv_frame
+from codec import encode_request, decode_response
+from compression import Compressor
+from partition import shard_of
 
 
 class Client:
@@ -9,6 +13,13 @@ class Client:
     This is a class for connecting to the server's database and to read, add, delete or query entries (key-value pairs).
     It establishes a TCP connection with the server.
     It communicates with the server using Request and Response objects sent and received via TCP Sockets.
+    Every request is sent in a frame carrying a request id, and responses are matched to requests by that id.
+    Several requests can be sent at once, without waiting for the previous responses, through a Pipeline.
+    The connection's large values can be compressed, in both directions, once the compression is negotiated with the server.
+    Changes of keys or of the entries matching a query can be watched through a subscription, whose notifications the server pushes.
+    With routing, if the server is a ShardedServer, the client also connects to its shards and sends the requests about a single key
+    straight to the shard owning it. The other requests are sent to the server. The routed requests bypass the front-end:
+    it does not count them in its statistics, and every client opens one more connection per shard.
 
     Note: In order for tests to work the server should be running on 127.0.0.1:65534
     Tests:
@@ -36,7 +47,7 @@ class Client:
         >>> client.query("read value = John")
         Response(success=True, message=None, data=[('1a2b3c', 'John')])
         >>> client.query("read key > int ( 5 )")
-        Response(success=True, message=None, data=[(15, 'Onescu'), (10, 'Radu-Mihai')])
+        Response(success=True, message=None, data=[(10, 'Radu-Mihai'), (15, 'Onescu')])
         >>> client.query("read value contains Mihai")
         Response(success=True, message=None, data=[(10, 'Radu-Mihai')])
         >>> client.query("delete value contains Mihai")
@@ -45,17 +56,110 @@ class Client:
         Response(success=True, message=None, data=[])
         >>> client.query("read something > int ( 5 )")
         Response(success=False, message=Invalid query syntax., data=[])
+        >>> client.query("count key > int ( 0 ) or value = John")
+        Response(success=True, message=None, data=2)
+        >>> client.query("keys not value = John")
+        Response(success=True, message=None, data=[15])
+        >>> client.query("sum value = John")
+        Response(success=False, message=Values cannot be aggregated., data=[])
+        >>> list(client.query("read key > int ( 0 )", page_size=1))
+        [(15, 'Onescu')]
+        >>> client.create_index("ngram")
+        Response(success=True, message=None, data=[])
+        >>> client.query("read value contains Onesc")
+        Response(success=True, message=None, data=[(15, 'Onescu')])
+        >>> client.drop_index("ngram")
+        Response(success=True, message=None, data=[])
+        >>> client.drop_index("ngram")
+        Response(success=False, message=Index does not exist., data=[])
+        >>> client.add_many({20: "a", 21: "b"})
+        Response(success=True, message=None, data=[[(20, 'a')], [(21, 'b')]])
+        >>> client.read_many([20, 22])
+        Response(success=True, message=None, data=[[(20, 'a')], []])
+        >>> client.delete_many([20, 21, 22])
+        Response(success=True, message=None, data=[[(20, 'a')], [(21, 'b')], []])
+        >>> client.add(25, "cached", ttl=60).success
+        True
+        >>> 59 < client.ttl(25).data[0][1] <= 60
+        True
+        >>> client.persist(25)
+        Response(success=True, message=None, data=[])
+        >>> client.ttl(25)
+        Response(success=True, message=None, data=[(25, None)])
+        >>> client.expire(25, 0)
+        Response(success=True, message=None, data=[])
+        >>> client.read(25)
+        Response(success=False, message=Entry does not exist., data=[])
+        >>> client.incr("hits", 5), client.decr("hits")
+        (Response(success=True, message=None, data=[('hits', 5)]), Response(success=True, message=None, data=[('hits', 4)]))
+        >>> client.append("hits", "x")
+        Response(success=False, message=Value cannot be appended to., data=[])
+        >>> client.append("log", "a"), client.append("log", "b")
+        (Response(success=True, message=None, data=[('log', 'a')]), Response(success=True, message=None, data=[('log', 'ab')]))
+        >>> client.setnx("hits", 0)
+        Response(success=False, message=Entry already exists., data=[])
+        >>> client.compare_and_set("hits", 10, expected=5)
+        Response(success=False, message=Value does not match., data=[('hits', 4)])
+        >>> client.compare_and_set("hits", 10, expected=4)
+        Response(success=True, message=None, data=[('hits', 10)])
+        >>> client.delete_many(["hits", "log"]).success
+        True
+        >>> with client.subscribe(keys=["watched"]) as keys, client.subscribe(query="read value contains news") as matches:
+        ...     _ = client.add("watched", 1), client.add("other", "news!"), client.delete_many(["watched", "other"])
+        ...     next(keys), next(keys), next(matches), next(matches)
+        (('set', 'watched', 1), ('delete', 'watched', 1), ('set', 'other', 'news!'), ('delete', 'other', 'news!'))
+        >>> with client.subscribe(query="read value > int ( 10 )") as large:
+        ...     _ = client.add("n", 20), client.incr("n", -15), client.delete("n")
+        ...     next(large), next(large)
+        (('set', 'n', 20), ('unmatched', 'n', 5))
+        >>> client.subscribe(query="count key = a")
+        Traceback (most recent call last):
+        ...
+        ValueError: Invalid query syntax.
+        >>> client.replication_status().data["role"]
+        'primary'
+        >>> client.memory_status().data["evictions"]
+        0
+        >>> stats = client.stats().data
+        >>> stats["requests"]["add"]["count"] > 0, stats["connections"]["active"] > 0
+        (True, True)
+        >>> client.pipeline().add(2, "a").add(3, "b").read(2).delete(3).execute()
+        [Response(success=True, message=None, data=[(2, 'a')]), Response(success=True, message=None, data=[(3, 'b')]), Response(success=True, message=None, data=[(2, 'a')]), Response(success=True, message=None, data=[])]
+        >>> compressed = Client("127.0.0.1", 65534, compression="zlib")
+        >>> compressed.add(30, "text " * 1000).data == [(30, "text " * 1000)]
+        True
+        >>> compressed.stats().data["compression"]["decompressed_values"] > 0
+        True
+        >>> compressed.set_compression("gzip")
+        Response(success=False, message=Compression algorithm does not exist., data=[])
+        >>> compressed.delete(30).success
+        True
+        >>> compressed.close()
+        >>> routed = Client("127.0.0.1", 65534, routing=True)
+        >>> routed.shards, routed.read(15).success  # the server is not sharded, every request is sent to it
+        ([], True)
+        >>> routed.close()
     """
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, timeout=None, compression=None, routing=False):
         """
         The constructor for the database's client class.
 
         Parameters:
            host (String): The host of the server that is trying to establish a connection to.
            port (int): The port on which the server is bound.
+           timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+                            When a response times out, socket.timeout (TimeoutError) is raised and the client should be closed.
+           compression (String): The compression negotiated with the server, "zlib" or "lzma", or None to compress nothing.
+                                 If the server refuses it, nothing is compressed.
+           routing (bool): Whether the requests about a single key are sent straight to the owning shard, if the server is sharded.
+                           It costs one more request when connecting.
         """
-        self._connect_to_server(host, port)
+        self._connect_to_server(host, port, timeout)
+        if compression is not None:
+            self.set_compression(compression)
+        if routing:
+            self._connect_to_shards(host, timeout, compression)
 
     def read(self, key):
         """
@@ -70,11 +174,9 @@ class Client:
             Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
         """
         request = Request(0, key, None, None)
-        request = pickle.dumps(request)
-        self.client_socket.send(request)
-        return self._listen_for_response()
+        return self._send_to_owner(request)
 
-    def add(self, key, value):
+    def add(self, key, value, ttl=None):
         """
         The method adds an entry (Key-Value pair) to the database.
         It sends a request to the server and waits for the response.
@@ -82,15 +184,15 @@ class Client:
         Parameters:
             key (Any hashable data type): The key of the entry.
             value (Any data type): The value of the entry.
+            ttl (int or float): The number of seconds after which the entry expires, or None if it does not expire.
 
         Returns:
             Response(success=True, message=None, data=[(...)]): If the add action was succesful. Note: The data list will contain the added entry.
             Response(success=False, message=Entry could not be added., data=[]): If the add action was not succesful.
         """
-        request = Request(1, key, value, None)
-        request = pickle.dumps(request)
-        self.client_socket.send(request)
-        return self._listen_for_response()
+        request = Request(1, key, value, None,
+                          None if ttl is None else {"ttl": ttl})
+        return self._send_to_owner(request)
 
     def delete(self, key):
         """
@@ -105,68 +207,711 @@ class Client:
             Response(success=False, message=Entry could not be deleted., data=[]): If the delete action was not succesful.
         """
         request = Request(2, key, None, None)
-        request = pickle.dumps(request)
-        self.client_socket.send(request)
-        return self._listen_for_response()
+        return self._send_to_owner(request)
 
-    def query(self, query):
+    def query(self, query, page_size=None, timeout=None):
         """
         The method queries the database based on the given query.
         It sends a request to the server and waits for the response.
+        If a page size is given for a read query, the matching entries are streamed: a lazy iterator is returned, which fetches the next page from the server when the current one is consumed.
 
         Parameters:
             query (String): The query string.
-                            Accepted formats: "[ACTION] [ELEMENT] [OPERATOR] [VALUE]" or "[ACTION] [ELEMENT] [OPERATOR] [DATATYPE] ( [VALUE] )"
-                            [ACTION] can be "read" or "delete"
+                            Accepted formats: "[ACTION] [CONDITION]" followed by the optional clauses "limit [COUNT]" and "reverse"
+                            [CONDITION] is a predicate, "[ELEMENT] [OPERATOR] [VALUE]" or "[ELEMENT] [OPERATOR] [DATATYPE] ( [VALUE] )",
+                                        or predicates combined with "and", "or", "not" and parentheses.
+                            [ACTION] can be "read" or "delete", or a projection of the matching entries: "count", "min", "max", "sum" (of their values) or "keys"
                             [ELEMENT] can be "value" or "key"
                             [OPERATOR] can be "<", ">", "=", "<=", ">=", "contains"
                             [DATATYPE] can be "int", "float", "complex", "str".
-                            [VALUE] is the value on which the query will be done.
+                            [VALUE] is the value on which the query will be done. It can be written between double quotes,
+                                    to contain spaces and parentheses or not be read as a clause, e.g. "read value = \\"limit\\" limit 5".
+                            [COUNT] is the maximum number of matching entries that are read, deleted or projected.
+                            "reverse" returns the matching entries in reverse order. Key range queries return the entries ordered by key.
                             Examples: "read key > 1234"
                                       "read value < int ( 4 )"
+                                      "delete key >= int ( 10 ) limit 100 reverse"
+                                      "count key >= int ( 10 ) and not ( value = a or value = b )"
                             Note: If no datatype is provided, the value will have the String data type by default.
+                            See query.compile_query().
+            page_size (int): The number of entries fetched at once, or None to read all the matching entries in one response.
+            timeout (int): The number of seconds the server keeps the cursor between two pages, or None for the server's default.
 
         Returns:
             Response(success=True, message=None, data=[(...)]): If the query action was succesful. Note: The data list will contain the entries matching the query.
+            Response(success=True, message=None, data=...): If the projection was succesful. Note: The data will be the projection's result.
             Response(success=False, message=Invalid query syntax., data=[]): If the query action was not succesful.
+            QueryCursor: If a page size was given. It iterates over the (key, value) tuples of the matching entries.
+
+        Raises:
+            ValueError: If a page size was given and the query action was not succesful.
+        """
+        options = None
+        if page_size is not None:
+            options = {"page_size": page_size, "timeout": timeout}
+        request = Request(3, None, None, query, options)
+        request_id = self._send_requests([request])[0]
+        response = self._listen_for_response(request_id)
+        if page_size is None:
+            return response
+        if not response.success:
+            raise ValueError(response.message)
+        return QueryCursor(self, response, page_size)
+
+    def read_many(self, keys):
+        """
+        The method reads many entries (Key-Value pairs), from the database, with a single request.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            keys (List): The keys of the entries.
+
+        Returns:
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the read action was succesful. Note: The data list will contain, for every key, a list with the read entry or an empty list if the entry does not exist.
+            Response(success=False, message=Entries could not be read., data=[]): If the read action was not succesful.
+        """
+        request = Request(4, list(keys), None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def add_many(self, entries, ttl=None):
+        """
+        The method adds many entries (Key-Value pairs) to the database with a single request.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            entries (Dict or List): The entries, as a dictionary or as a list of (key, value) tuples.
+            ttl (int or float): The number of seconds after which the entries expire, or None if they do not expire.
+
+        Returns:
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the add action was succesful. Note: The data list will contain, for every entry, a list with the added entry or an empty list if the entry could not be added.
+            Response(success=False, message=Entries could not be added., data=[]): If the add action was not succesful.
+        """
+        if isinstance(entries, dict):
+            entries = entries.items()
+        request = Request(5, None, [tuple(entry) for entry in entries], None,
+                          None if ttl is None else {"ttl": ttl})
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def delete_many(self, keys):
+        """
+        The method deletes many entries (Key-Value pairs), from the database, with a single request.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            keys (List): The keys of the entries that will be deleted.
+
+        Returns:
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the delete action was succesful. Note: The data list will contain, for every key, a list with the deleted entry or an empty list if the entry could not be deleted.
+            Response(success=False, message=Entries could not be deleted., data=[]): If the delete action was not succesful.
+        """
+        request = Request(6, list(keys), None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def create_index(self, kind):
+        """
+        The method creates a value index on the server, used by the value queries.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            kind (String): The kind of the index.
+                           "hash" answers the "=" value queries.
+                           "sorted" answers the "<", ">", "<=", ">=" and "=" value queries.
+                           "ngram" answers the "contains" value queries.
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the index was created or already exists.
+            Response(success=False, message=Index kind does not exist., data=[]): If the index kind does not exist.
+        """
+        request = Request(7, kind, None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def drop_index(self, kind):
+        """
+        The method drops a value index on the server.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            kind (String): The kind of the index, "hash", "sorted" or "ngram".
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the index was dropped.
+            Response(success=False, message=Index does not exist., data=[]): If there is no index of the given kind.
+        """
+        request = Request(8, kind, None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def expire(self, key, seconds):
+        """
+        The method sets the time to live of an entry (Key-Value pair).
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            seconds (int or float): The number of seconds after which the entry expires.
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the time to live was set.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
+        """
+        request = Request(13, key, seconds, None)
+        return self._send_to_owner(request)
+
+    def ttl(self, key):
+        """
+        The method reads the remaining time to live of an entry (Key-Value pair).
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+
+        Returns:
+            Response(success=True, message=None, data=[(key, seconds)]): If the entry exists. Note: The number of seconds is None if the entry does not expire.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
+        """
+        request = Request(14, key, None, None)
+        return self._send_to_owner(request)
+
+    def persist(self, key):
+        """
+        The method removes the time to live of an entry (Key-Value pair), so it no longer expires.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the entry exists.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
+        """
+        request = Request(15, key, None, None)
+        return self._send_to_owner(request)
+
+    def incr(self, key, delta=1):
         """
-        request = Request(3, None, None, query)
-        request = pickle.dumps(request)
-        self.client_socket.send(request)
-        return self._listen_for_response()
+        The method atomically adds a number to the value of an entry (Key-Value pair). A missing entry is created with the number.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            delta (int or float): The number added to the value.
 
-    def _listen_for_response(self):
+        Returns:
+            Response(success=True, message=None, data=[(key, value)]): If the value was changed. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value is not a number., data=[]): If the value or the number is not an int or a float.
+        """
+        request = Request(19, key, delta, None)
+        return self._send_to_owner(request)
+
+    def decr(self, key, delta=1):
+        """
+        The method atomically subtracts a number from the value of an entry (Key-Value pair). See incr().
+        """
+        return self.incr(key, -delta)
+
+    def append(self, key, value):
+        """
+        The method atomically appends a string to a string value, or an item to a list value, of an entry (Key-Value pair).
+        A missing entry is created with the string, or with a list holding the item.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The string or item that is appended.
+
+        Returns:
+            Response(success=True, message=None, data=[(key, value)]): If the value was changed. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value cannot be appended to., data=[]): If the value is not a list, or a string of the appended type.
+        """
+        request = Request(20, key, value, None)
+        return self._send_to_owner(request)
+
+    def setnx(self, key, value, ttl=None):
+        """
+        The method adds an entry (Key-Value pair) to the database only if it does not exist.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+            ttl (int or float): The number of seconds after which the entry expires, or None if it does not expire.
+
+        Returns:
+            Response(success=True, message=None, data=[(...)]): If the entry was added. Note: The data list will contain the added entry.
+            Response(success=False, message=Entry already exists., data=[]): If the entry exists.
+        """
+        request = Request(21, key, value, None,
+                          None if ttl is None else {"ttl": ttl})
+        return self._send_to_owner(request)
+
+    def compare_and_set(self, key, value, expected):
+        """
+        The method atomically replaces the value of an entry (Key-Value pair) if it is equal to, and of the same type as, the expected value.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The new value of the entry.
+            expected (Any data type): The value the entry must have.
+
+        Returns:
+            Response(success=True, message=None, data=[(key, value)]): If the value was replaced. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value does not match., data=[(key, current value)]): If the value is not the expected one.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
+        """
+        request = Request(22, key, value, None, {"expected": expected})
+        return self._send_to_owner(request)
+
+    def replication_status(self):
+        """
+        The method reads the server's replication status.
+        It sends a request to the server and waits for the response.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The status, holding the server's "role" ("primary" or "replica"),
+                its replication "offset", its replication "lag" in seconds, whether it is "synchronized" and "connected" to its primary,
+                and the number of its "replicas".
+        """
+        request = Request(12, None, None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def memory_status(self):
+        """
+        The method reads the memory used by the server's entries and its evictions.
+        It sends a request to the server and waits for the response.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The status, holding the memory "limit" in bytes (0 if there is none),
+                the approximate bytes "used" by the entries kept in memory, the eviction "policy", the number of "entries" kept in memory,
+                of "spilled" entries, of "evictions" and of spilled entries moved back to memory ("loads").
+        """
+        request = Request(16, None, None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def stats(self):
+        """
+        The method reads the server's runtime statistics.
+        It sends a request to the server and waits for the response.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The statistics, holding the "count", "errors" and latency estimates (seconds) of every request type
+                in "requests", the "connections", the "traffic" in bytes, the number of "keys", the "memory" used, the last "snapshot",
+                the "queries" answered by a scan or an index and the last "slow_queries". See Server._stats().
+                A sharded server reports its front-end's and every shard's statistics ("shards").
         """
-        The method waits and listens for a response from the server.
+        request = Request(17, None, None, None)
+        request_id = self._send_requests([request])[0]
+        return self._listen_for_response(request_id)
+
+    def subscribe(self, keys=None, query=None):
+        """
+        The method subscribes to the changes of exact keys, or of the entries matching a read query, instead of polling for them.
+        The server pushes a notification whenever a watched entry is added, changed, deleted, expires or is evicted.
+        The notifications are read by iterating over the returned subscription, and are kept by the client while other requests are answered.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            keys (List): The watched keys, or None if a query is watched.
+            query (String): The read query whose matching entries are watched (see query()), or None if keys are watched.
+                            Its limit and order are ignored.
+
+        Returns:
+            Subscription: The subscription, iterating over the (event, key, value) notifications. See Subscription.
+
+        Raises:
+            ValueError: If the subscription was refused, e.g. "Invalid query syntax.".
+        """
+        request = Request(23, None if keys is None else list(keys), None, query)
+        request_id = self._send_requests([request])[0]
+        response = self._listen_for_response(request_id)
+        if not response.success:
+            raise ValueError(response.message)
+        self.subscriptions[request_id] = deque()
+        return Subscription(self, request_id, response.data)
+
+    def set_compression(self, algorithm):
+        """
+        The method negotiates the compression of the connection's messages with the server.
+        The request and response fields whose encoding reaches the server's threshold are then compressed at the server's level.
+        It sends a request to the server and waits for the response.
+
+        Parameters:
+            algorithm (String): The compression algorithm, "zlib" or "lzma", or None to stop compressing.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The "compression" algorithm, its "level" and "threshold".
+            Response(success=False, message=Compression is disabled., data=[]): If the server does not compress its connections.
+            Response(success=False, message=Compression algorithm does not exist., data=[]): If the algorithm does not exist.
+        """
+        request = Request(18, algorithm, None, None)
+        request_id = self._send_requests([request])[0]
+        response = self._listen_for_response(request_id)
+        if response.success:
+            self.compressor = None if algorithm is None else Compressor(
+                algorithm, response.data["level"], response.data["threshold"])
+            for shard in self.shards:
+                shard.set_compression(algorithm)
+        return response
+
+    def pipeline(self):
+        """
+        The method creates a pipeline that sends many requests at once over this client's connection.
+
+        Returns:
+            Pipeline: The pipeline bound to this client.
+        """
+        return Pipeline(self)
+
+    def _send_requests(self, requests):
+        """
+        The method assigns an id to every given request and sends all of them to the server at once.
+
+        Parameters:
+            requests (List): The Request objects that will be sent.
+
+        Returns:
+            request_ids (List): The ids assigned to the requests, in the same order.
+        """
+        request_ids = []
+        frames = []
+        for request in requests:
+            self.last_request_id += 1
+            request_ids.append(self.last_request_id)
+            frames.append(pack_frame(self.last_request_id,
+                          encode_request(request, compressor=self.compressor)))
+        self.client_socket.sendall(b"".join(frames))
+        self.sent_requests += len(requests)
+        return request_ids
+
+    def _send_to_owner(self, request):
+        """
+        The method sends a request about a single key and waits for the response.
+        If the server is sharded, the request is sent to the shard owning the key, else to the server.
+
+        Parameters:
+            request (Request): The request, whose key is the entry's key.
+
+        Returns:
+            Response: The response to the request.
+        """
+        client = self.shards[shard_of(request.key, len(self.shards))] if self.shards else self
+        request_id = client._send_requests([request])[0]
+        if client is not self:
+            self.sent_requests += 1
+        return client._listen_for_response(request_id)
+
+    def _listen_for_response(self, request_id):
+        """
+        The method waits and listens for the response to the given request.
+        Responses to other requests received in the meantime are kept until they are asked for.
+
+        Parameters:
+            request_id (int): The id of the request.
 
         Returns: 
             Response: When the response has been received from the server. 
         """
-        while True:
-            response = self.client_socket.recv(1024)
-            if response:
-                response = pickle.loads(response)
-                return response
+        while request_id not in self.responses:
+            self._receive()
+        return self.responses.pop(request_id)
+
+    def _receive(self):
+        """
+        The method receives one frame: a response, kept until it is asked for, or a notification, queued in its subscription.
+        """
+        received_id, response = recv_frame(self.client_socket)
+        response = decode_response(response)
+        if received_id in self.subscriptions:
+            self.subscriptions[received_id].append(response)
+        else:
+            self.responses[received_id] = response
 
-    def _connect_to_server(self, host, port):
+    def close(self):
+        """
+        The method closes the connection to the server, and to its shards.
+        """
+        self.client_socket.close()
+        for shard in self.shards:
+            shard.close()
+
+    def _connect_to_server(self, host, port, timeout=None):
         """
         The method connects to the server using the given host and port. 
 
         Parameters: 
            host (String): The host of the server that is trying to establish a connection to.
            port (int): The port on which the server is bound. 
+           timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
 
         Raises:
             ConnectionRefusedError: Connection to the server was refused.
         """
+        self.last_request_id = 0
+        self.responses = {}
+        self.subscriptions = {}
+        self.compressor = None
+        self.shards = []
+        self.sent_requests = 0
         try:
             self.client_socket = socket.socket(
                 socket.AF_INET, socket.SOCK_STREAM)
+            self.client_socket.settimeout(timeout)
             self.client_socket.connect((host, port))
+            self.client_socket.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         except:
             raise ConnectionRefusedError(
                 "Connection to the server was refused.")
 
+    def _connect_to_shards(self, host, timeout=None, compression=None):
+        """
+        The method asks the server for the ports of its shards and connects to every shard on the server's host.
+        A server that is not sharded has no shards, and neither has a sharded server whose shards cannot be reached:
+        all the requests are then sent to the server.
+
+        Parameters:
+           host (String): The host of the server.
+           timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+           compression (String): The compression negotiated with the shards, "zlib" or "lzma", or None to compress nothing.
+        """
+        request_id = self._send_requests([Request(25, None, None, None)])[0]
+        response = self._listen_for_response(request_id)
+        if not response.success:
+            return
+        try:
+            for port in response.data:
+                self.shards.append(Client(host, port, timeout, compression))
+        except ConnectionRefusedError:
+            for shard in self.shards:
+                shard.close()
+            self.shards = []
+
+
+class QueryCursor():
+    """
+    This is a class for lazily iterating over the results of a query streamed by the server in pages.
+    The next page is fetched when the current one is consumed. The server closes the cursor once the last page is read.
+    If the iteration is abandoned, close() frees the cursor on the server (else it expires).
+
+    Attributes:
+        client (Client): The client whose connection is used.
+        cursor (int): The id of the cursor on the server, or None if there are no more pages.
+        page_size (int): The number of entries fetched at once.
+        entries (deque): The fetched entries that were not consumed yet.
+    """
+
+    def __init__(self, client, response, page_size):
+        """
+        The constructor for the query cursor class.
+
+        Parameters:
+           client (Client): The client whose connection is used.
+           response (Response): The response holding the first page and the cursor's id.
+           page_size (int): The number of entries fetched at once.
+        """
+        self.client = client
+        self.cursor = response.cursor
+        self.page_size = page_size
+        self.entries = deque(response.data)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        The method returns the next matching entry, fetching the next page if needed.
+
+        Returns:
+            (key, value): The next matching entry.
+
+        Raises:
+            StopIteration: If there are no more entries.
+            LookupError: If the cursor expired on the server.
+        """
+        while not self.entries:
+            if self.cursor is None:
+                raise StopIteration
+            request = Request(9, self.cursor, None, None,
+                              {"page_size": self.page_size})
+            request_id = self.client._send_requests([request])[0]
+            response = self.client._listen_for_response(request_id)
+            if not response.success:
+                self.cursor = None
+                raise LookupError(response.message)
+            self.cursor = response.cursor
+            self.entries.extend(response.data)
+        return self.entries.popleft()
+
+    def close(self):
+        """
+        The method closes the cursor on the server, if it still has pages.
+        """
+        if self.cursor is not None:
+            request = Request(10, self.cursor, None, None)
+            request_id = self.client._send_requests([request])[0]
+            self.client._listen_for_response(request_id)
+            self.cursor = None
+        self.entries.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class Subscription():
+    """
+    This is a class for iterating over the notifications of a subscription, pushed by the server.
+    Iterating waits for the next notification. The client's timeout, if any, applies to that wait.
+    Every notification is an (event, key, value) tuple:
+        ("set", key, value): The entry was added or changed, the value is its new value.
+        ("delete", key, value): The entry was deleted, expired or evicted, the value is its last value.
+        ("unmatched", key, value): The entry was changed and no longer matches the subscribed query, the value is its new value.
+        ("dropped", None, count): The server dropped 'count' notifications while the subscriber was too slow to read them.
+
+    Attributes:
+        client (Client): The client whose connection is used.
+        request_id (int): The id of the subscribe request, carried by the notifications' frames.
+        subscription_id (int): The id of the subscription on the server, or None once it is closed.
+        notifications (deque): The received notifications (Response objects) that were not consumed yet.
+    """
+
+    def __init__(self, client, request_id, subscription_id):
+        """
+        The constructor for the subscription class.
+
+        Parameters:
+           client (Client): The client whose connection is used.
+           request_id (int): The id of the subscribe request.
+           subscription_id (int): The id of the subscription on the server.
+        """
+        self.client = client
+        self.request_id = request_id
+        self.subscription_id = subscription_id
+        self.notifications = client.subscriptions[request_id]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        The method returns the next notification, waiting for it if none was received yet.
+
+        Returns:
+            (event, key, value): The next notification.
+
+        Raises:
+            StopIteration: If the subscription is closed.
+            ConnectionError: If the server closed the connection, e.g. since the subscriber was too slow.
+        """
+        while not self.notifications:
+            if self.subscription_id is None:
+                raise StopIteration
+            self.client._receive()
+        response = self.notifications.popleft()
+        if not response.success:
+            return ("dropped", None, response.data)
+        key, value = response.data[0]
+        return (response.message, key, value)
+
+    def close(self):
+        """
+        The method removes the subscription on the server. The notifications received before are dropped.
+        """
+        if self.subscription_id is not None:
+            request = Request(24, self.subscription_id, None, None)
+            request_id = self.client._send_requests([request])[0]
+            self.client._listen_for_response(request_id)
+            self.subscription_id = None
+            self.client.subscriptions.pop(self.request_id, None)
+        self.notifications.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+class Pipeline():
+    """
+    This is a class for queueing requests and sending them to the server in one write.
+    The responses are collected afterwards and matched to the requests by their ids, saving a round trip per request.
+
+    Attributes:
+        client (Client): The client whose connection is used.
+        requests (List): The queued Request objects.
+    """
+
+    def __init__(self, client):
+        """
+        The constructor for the pipeline class.
+
+        Parameters:
+           client (Client): The client whose connection is used.
+        """
+        self.client = client
+        self.requests = []
+
+    def read(self, key):
+        """
+        The method queues a read request. See Client.read().
+
+        Returns:
+            Pipeline: The pipeline itself, so the calls can be chained.
+        """
+        self.requests.append(Request(0, key, None, None))
+        return self
+
+    def add(self, key, value, ttl=None):
+        """
+        The method queues an add request. See Client.add().
+
+        Returns:
+            Pipeline: The pipeline itself, so the calls can be chained.
+        """
+        self.requests.append(Request(1, key, value, None,
+                                     None if ttl is None else {"ttl": ttl}))
+        return self
+
+    def delete(self, key):
+        """
+        The method queues a delete request. See Client.delete().
+
+        Returns:
+            Pipeline: The pipeline itself, so the calls can be chained.
+        """
+        self.requests.append(Request(2, key, None, None))
+        return self
+
+    def query(self, query):
+        """
+        The method queues a query request. See Client.query().
+
+        Returns:
+            Pipeline: The pipeline itself, so the calls can be chained.
+        """
+        self.requests.append(Request(3, None, None, query))
+        return self
+
+    def execute(self):
+        """
+        The method sends all the queued requests and waits for their responses.
+
+        Returns:
+            responses (List): The Response objects, in the order the requests were queued.
+        """
+        requests, self.requests = self.requests, []
+        request_ids = self.client._send_requests(requests)
+        return [self.client._listen_for_response(request_id) for request_id in request_ids]
+
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,616 @@
+import pickle
+import struct
+from request import Request
+from response import Response
+from compression import decompress
+
+# The first byte of every encoded message. It is increased whenever the encoding changes.
+# Version 2 added the request's options and the response's cursor. Version 1 messages are still decoded.
+VERSION = 2
+
+_DOUBLE = struct.Struct("!d")
+_DOUBLE_PAIR = struct.Struct("!dd")
+
+# One byte tag in front of every encoded value.
+_NONE = 0x00
+_TRUE = 0x01
+_FALSE = 0x02
+_INT = 0x03
+_FLOAT = 0x04
+_COMPLEX = 0x05
+_STR = 0x06
+_BYTES = 0x07
+_LIST = 0x08
+_TUPLE = 0x09
+_DICT = 0x0A
+_PICKLE = 0x0B
+_COMPRESSED = 0x0C
+
+# The types whose encoding is never large enough to be compressed.
+_SMALL_TYPES = (type(None), bool, int, float, complex)
+
+# The errors raised while decoding truncated or corrupted bytes.
+_MALFORMED = (IndexError, TypeError, struct.error,
+              UnicodeDecodeError, RecursionError)
+
+
+def encode_request(request, allow_pickle=True, compressor=None):
+    """
+    The function encodes a Request object.
+    With a compressor, each of its fields (key, value, query and options) is compressed if its encoding is large enough.
+
+    Parameters:
+        request (Request): The request.
+        allow_pickle (bool): Whether values that have no binary encoding are pickled or rejected.
+        compressor (Compressor): The compressor of the large fields, or None to compress nothing.
+
+    Returns:
+        bytes: The encoded request.
+
+    Raises:
+        TypeError: If a value cannot be encoded.
+
+    Tests:
+        >>> encode_request(Request(1, 10, "John", None))
+        b'\\x02\\x01\\x03\\x14\\x06\\x04John\\x00\\x00'
+        >>> decode_request(encode_request(Request(3, None, None, "read key > 5", {"page_size": 10}))).options
+        {'page_size': 10}
+        >>> decode_request(b'\\x01\\x00\\x03\\x14\\x00\\x00').key
+        10
+        >>> from compression import Compressor
+        >>> payload = encode_request(Request(1, "a", "text " * 1000, None), compressor=Compressor("zlib", 6, 1024))
+        >>> len(payload) < 100, decode_request(payload, allow_compressed=True).value == "text " * 1000
+        (True, True)
+        >>> decode_request(payload)
+        Traceback (most recent call last):
+        ...
+        ValueError: Compressed values are not allowed.
+    """
+    encoded = bytearray((VERSION, request.request_type))
+    if compressor is None:
+        _encode(request.key, encoded, allow_pickle)
+        _encode(request.value, encoded, allow_pickle)
+        _encode(request.query, encoded, allow_pickle)
+        _encode(request.options, encoded, allow_pickle)
+    else:
+        _encode_compressed(request.key, encoded, allow_pickle, compressor)
+        _encode_compressed(request.value, encoded, allow_pickle, compressor)
+        _encode_compressed(request.query, encoded, allow_pickle, compressor)
+        _encode_compressed(request.options, encoded, allow_pickle, compressor)
+    return bytes(encoded)
+
+
+def decode_request(payload, allow_pickle=True, allow_compressed=False):
+    """
+    The function decodes a Request object.
+    Compressed fields are only accepted from a client that negotiated compression, since they can be inflated many times.
+
+    Parameters:
+        payload (bytes): The encoded request.
+        allow_pickle (bool): Whether pickled values are accepted or rejected.
+        allow_compressed (bool): Whether compressed fields are accepted or rejected.
+
+    Returns:
+        Request: The decoded request.
+
+    Raises:
+        ValueError: If the payload is not a valid encoded request.
+    """
+    view = _check_version(payload)
+    request_type = view[1]
+    options = None
+    try:
+        key, offset = _decode(view, 2, allow_pickle, allow_compressed)
+        value, offset = _decode(view, offset, allow_pickle, allow_compressed)
+        query, offset = _decode(view, offset, allow_pickle, allow_compressed)
+        if view[0] >= 2:
+            options, offset = _decode(view, offset, allow_pickle, allow_compressed)
+    except _MALFORMED:
+        raise ValueError("Malformed request.")
+    _check_end(view, offset)
+    return Request(request_type, key, value, query, options)
+
+
+def peek_request(payload, allow_pickle=True, allow_compressed=False):
+    """
+    The function decodes only the type and the key of an encoded request, so it can be routed without decoding its value.
+
+    Parameters:
+        payload (bytes): The encoded request.
+        allow_pickle (bool): Whether pickled keys are accepted or rejected.
+        allow_compressed (bool): Whether a compressed key is accepted or rejected.
+
+    Returns:
+        (request_type, key): The type and the key of the request.
+
+    Raises:
+        ValueError: If the payload is not a valid encoded request.
+
+    Tests:
+        >>> peek_request(encode_request(Request(1, "a", list(range(1000)), None)))
+        (1, 'a')
+    """
+    view = _check_version(payload)
+    try:
+        key, offset = _decode(view, 2, allow_pickle, allow_compressed)
+    except _MALFORMED:
+        raise ValueError("Malformed request.")
+    return view[1], key
+
+
+def encode_response(response, allow_pickle=True, compressor=None):
+    """
+    The function encodes a Response object.
+    With a compressor, its data is compressed if its encoding is large enough.
+
+    Parameters:
+        response (Response): The response.
+        allow_pickle (bool): Whether values that have no binary encoding are pickled or rejected.
+        compressor (Compressor): The compressor of the large data, or None to compress nothing.
+
+    Returns:
+        bytes: The encoded response.
+
+    Raises:
+        TypeError: If a value cannot be encoded.
+
+    Tests:
+        >>> decode_response(encode_response(Response(True, None, [(1, 1.5), ("a", 2j)])))
+        Response(success=True, message=None, data=[(1, 1.5), ('a', 2j)])
+        >>> decode_response(encode_response(Response(False, "Entry does not exist.", [])))
+        Response(success=False, message=Entry does not exist., data=[])
+        >>> decode_response(encode_response(Response(True, None, [(1, 2)], 7)))
+        Response(success=True, message=None, data=[(1, 2)], cursor=7)
+    """
+    encoded = bytearray((VERSION, 1 if response.success else 0))
+    _encode(response.message, encoded, allow_pickle)
+    if compressor is None:
+        _encode(response.data, encoded, allow_pickle)
+    else:
+        _encode_compressed(response.data, encoded, allow_pickle, compressor)
+    _encode(response.cursor, encoded, allow_pickle)
+    return bytes(encoded)
+
+
+def decode_response(payload, allow_pickle=True, allow_compressed=True):
+    """
+    The function decodes a Response object.
+
+    Parameters:
+        payload (bytes): The encoded response.
+        allow_pickle (bool): Whether pickled values are accepted or rejected.
+        allow_compressed (bool): Whether compressed values are accepted or rejected.
+
+    Returns:
+        Response: The decoded response.
+
+    Raises:
+        ValueError: If the payload is not a valid encoded response.
+    """
+    view = _check_version(payload)
+    success = view[1] == 1
+    cursor = None
+    try:
+        message, offset = _decode(view, 2, allow_pickle, allow_compressed)
+        data, offset = _decode(view, offset, allow_pickle, allow_compressed)
+        if view[0] >= 2:
+            cursor, offset = _decode(view, offset, allow_pickle, allow_compressed)
+    except _MALFORMED:
+        raise ValueError("Malformed response.")
+    _check_end(view, offset)
+    return Response(success, message, data, cursor)
+
+
+def encode_value(value, allow_pickle=True, compressor=None):
+    """
+    The function encodes a single value.
+
+    Parameters:
+        value (Any data type): The value.
+        allow_pickle (bool): Whether values that have no binary encoding are pickled or rejected.
+        compressor (Compressor): The compressor of the value, if its encoding is large enough, or None to compress nothing.
+
+    Returns:
+        bytes: The encoded value.
+
+    Raises:
+        TypeError: If the value cannot be encoded.
+
+    Tests:
+        >>> encode_value([-1, "a"])
+        b'\\x08\\x02\\x03\\x01\\x06\\x01a'
+        >>> decode_value(encode_value({"a": [1, (2, b"x", None)]}))
+        {'a': [1, (2, b'x', None)]}
+        >>> decode_value(encode_value(2 ** 100))
+        1267650600228229401496703205376
+        >>> encode_value({1, 2}, allow_pickle=False)
+        Traceback (most recent call last):
+        ...
+        TypeError: Value of type set cannot be encoded.
+        >>> import zlib
+        >>> from compression import Compressor
+        >>> inner = zlib.compress(encode_value("text " * 1000, compressor=Compressor("zlib", 6, 1024)))
+        >>> nested = bytearray((_COMPRESSED, 1))
+        >>> _encode_length(len(inner), nested)
+        >>> decode_value(nested + inner)  # a compressed value inside a compressed value
+        Traceback (most recent call last):
+        ...
+        ValueError: Compressed values are not allowed.
+        >>> field = encode_value("text " * 1000, compressor=Compressor("zlib", 6, 1024))
+        >>> decode_value(b"\\x08\\x02" + field + field)  # compressed values inside a list
+        Traceback (most recent call last):
+        ...
+        ValueError: Compressed values are not allowed.
+    """
+    encoded = bytearray()
+    if compressor is None:
+        _encode(value, encoded, allow_pickle)
+    else:
+        _encode_compressed(value, encoded, allow_pickle, compressor)
+    return bytes(encoded)
+
+
+def decode_value(payload, allow_pickle=True, allow_compressed=True):
+    """
+    The function decodes a single value.
+
+    Parameters:
+        payload (bytes): The encoded value.
+        allow_pickle (bool): Whether pickled values are accepted or rejected.
+        allow_compressed (bool): Whether compressed values are accepted or rejected.
+
+    Returns:
+        The decoded value.
+
+    Raises:
+        ValueError: If the payload is not a valid encoded value.
+    """
+    view = bytes(payload)
+    try:
+        value, offset = _decode(view, 0, allow_pickle, allow_compressed)
+    except _MALFORMED:
+        raise ValueError("Malformed value.")
+    _check_end(view, offset)
+    return value
+
+
+def _check_version(payload):
+    """
+    The function checks the version byte of an encoded message.
+
+    Parameters:
+        payload (bytes): The encoded message.
+
+    Returns:
+        bytes: The payload.
+
+    Raises:
+        ValueError: If the payload is empty or was encoded by an unsupported version.
+    """
+    if len(payload) < 2 or not 1 <= payload[0] <= VERSION:
+        raise ValueError("Unsupported message version.")
+    return bytes(payload)
+
+
+def _check_end(view, offset):
+    """
+    The function checks that the whole payload was decoded.
+
+    Raises:
+        ValueError: If there are bytes left after the decoded message.
+    """
+    if offset != len(view):
+        raise ValueError("Malformed message.")
+
+
+def _encode_length(length, encoded):
+    """
+    The function appends an unsigned integer as a variable length integer (7 bits per byte).
+    """
+    while length >= 0x80:
+        encoded.append((length & 0x7F) | 0x80)
+        length >>= 7
+    encoded.append(length)
+
+
+def _decode_length(view, offset):
+    """
+    The function reads an unsigned variable length integer.
+
+    Returns:
+        (length, offset): The length and the offset after it.
+    """
+    byte = view[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    length = 0
+    shift = 0
+    while True:
+        byte = view[offset]
+        offset += 1
+        length |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return length, offset
+        shift += 7
+
+
+def _encode(value, encoded, allow_pickle):
+    """
+    The function appends the encoding of the given value.
+
+    Parameters:
+        value (Any data type): The value.
+        encoded (bytearray): The encoded message.
+        allow_pickle (bool): Whether values that have no binary encoding are pickled or rejected.
+
+    Raises:
+        TypeError: If the value cannot be encoded.
+    """
+    encoder = _ENCODERS.get(type(value))
+    if encoder is not None:
+        encoder(value, encoded, allow_pickle)
+    elif allow_pickle:
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        encoded.append(_PICKLE)
+        _encode_length(len(pickled), encoded)
+        encoded += pickled
+    else:
+        raise TypeError(
+            f"Value of type {type(value).__name__} cannot be encoded.")
+
+
+def _encode_compressed(value, encoded, allow_pickle, compressor):
+    """
+    The function appends the encoding of the given value, compressed if the compressor accepts it.
+    A compressed value is tagged, followed by the algorithm's id, the compressed length and the compressed encoding.
+
+    Parameters:
+        value (Any data type): The value.
+        encoded (bytearray): The encoded message.
+        allow_pickle (bool): Whether values that have no binary encoding are pickled or rejected.
+        compressor (Compressor): The compressor.
+
+    Raises:
+        TypeError: If the value cannot be encoded.
+    """
+    start = len(encoded)
+    _encode(value, encoded, allow_pickle)
+    if type(value) in _SMALL_TYPES or len(encoded) - start < compressor.threshold:
+        return
+    compressed = compressor.compress(encoded[start:])
+    if compressed is not None:
+        del encoded[start:]
+        encoded.append(_COMPRESSED)
+        encoded.append(compressor.algorithm_id)
+        _encode_length(len(compressed), encoded)
+        encoded += compressed
+
+
+def _encode_none(value, encoded, allow_pickle):
+    encoded.append(_NONE)
+
+
+def _encode_bool(value, encoded, allow_pickle):
+    encoded.append(_TRUE if value else _FALSE)
+
+
+def _encode_int(value, encoded, allow_pickle):
+    # zig-zag encoding keeps small negative integers short
+    encoded.append(_INT)
+    _encode_length(value << 1 if value >= 0 else (-value << 1) - 1, encoded)
+
+
+def _encode_float(value, encoded, allow_pickle):
+    encoded.append(_FLOAT)
+    encoded += _DOUBLE.pack(value)
+
+
+def _encode_complex(value, encoded, allow_pickle):
+    encoded.append(_COMPLEX)
+    encoded += _DOUBLE_PAIR.pack(value.real, value.imag)
+
+
+def _encode_str(value, encoded, allow_pickle):
+    value = value.encode("utf-8")
+    encoded.append(_STR)
+    _encode_length(len(value), encoded)
+    encoded += value
+
+
+def _encode_bytes(value, encoded, allow_pickle):
+    encoded.append(_BYTES)
+    _encode_length(len(value), encoded)
+    encoded += value
+
+
+def _encode_list(value, encoded, allow_pickle):
+    encoded.append(_LIST if type(value) is list else _TUPLE)
+    _encode_length(len(value), encoded)
+    for item in value:
+        encoder = _ENCODERS.get(type(item))
+        if encoder is not None:
+            encoder(item, encoded, allow_pickle)
+        else:
+            _encode(item, encoded, allow_pickle)
+
+
+def _encode_dict(value, encoded, allow_pickle):
+    encoded.append(_DICT)
+    _encode_length(len(value), encoded)
+    for key, item in value.items():
+        _encode(key, encoded, allow_pickle)
+        _encode(item, encoded, allow_pickle)
+
+
+_ENCODERS = {
+    type(None): _encode_none,
+    bool: _encode_bool,
+    int: _encode_int,
+    float: _encode_float,
+    complex: _encode_complex,
+    str: _encode_str,
+    bytes: _encode_bytes,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+}
+
+
+def _decode(view, offset, allow_pickle, allow_compressed):
+    """
+    The function decodes the value starting at the given offset.
+    Only a whole message field is ever compressed: the items of a list, tuple or dict never are,
+    so a message inflates at most one compressed value per field.
+
+    Parameters:
+        view (bytes): The encoded message.
+        offset (int): The offset of the value's tag.
+        allow_pickle (bool): Whether pickled values are accepted or rejected.
+        allow_compressed (bool): Whether compressed values are accepted or rejected.
+
+    Returns:
+        (value, offset): The decoded value and the offset after it.
+
+    Raises:
+        ValueError: If the value is malformed, is pickled while pickle is not allowed, or is compressed while compression is not allowed.
+    """
+    tag = view[offset]
+    if tag >= len(_DECODERS):
+        raise ValueError(f"Unknown value tag {tag}.")
+    return _DECODERS[tag](view, offset + 1, allow_pickle, allow_compressed)
+
+
+def _decode_none(view, offset, allow_pickle, allow_compressed):
+    return None, offset
+
+
+def _decode_true(view, offset, allow_pickle, allow_compressed):
+    return True, offset
+
+
+def _decode_false(view, offset, allow_pickle, allow_compressed):
+    return False, offset
+
+
+def _decode_int(view, offset, allow_pickle, allow_compressed):
+    encoded, offset = _decode_length(view, offset)
+    return (encoded >> 1) ^ -(encoded & 1), offset
+
+
+def _decode_float(view, offset, allow_pickle, allow_compressed):
+    return _DOUBLE.unpack_from(view, offset)[0], offset + _DOUBLE.size
+
+
+def _decode_complex(view, offset, allow_pickle, allow_compressed):
+    real, imag = _DOUBLE_PAIR.unpack_from(view, offset)
+    return complex(real, imag), offset + _DOUBLE_PAIR.size
+
+
+def _decode_str(view, offset, allow_pickle, allow_compressed):
+    length, offset = _decode_length(view, offset)
+    end = offset + length
+    _check_bounds(view, end)
+    return view[offset:end].decode("utf-8"), end
+
+
+def _decode_bytes(view, offset, allow_pickle, allow_compressed):
+    length, offset = _decode_length(view, offset)
+    end = offset + length
+    _check_bounds(view, end)
+    return bytes(view[offset:end]), end
+
+
+def _decode_list(view, offset, allow_pickle, allow_compressed):
+    length, offset = _decode_length(view, offset)
+    items = []
+    append = items.append
+    for _ in range(length):
+        tag = view[offset]
+        # short strings and small integers are decoded inline, they are the most common items
+        if tag == _STR and view[offset + 1] < 0x80:
+            end = offset + 2 + view[offset + 1]
+            if end > len(view):
+                raise ValueError("Truncated value.")
+            append(view[offset + 2:end].decode("utf-8"))
+            offset = end
+        elif tag == _INT and view[offset + 1] < 0x80:
+            encoded = view[offset + 1]
+            append((encoded >> 1) ^ -(encoded & 1))
+            offset += 2
+        elif tag == _TUPLE and view[offset + 1] < 0x80:
+            item, offset = _decode_list(view, offset + 1, allow_pickle, False)
+            append(tuple(item))
+        else:
+            item, offset = _DECODERS[tag](view, offset + 1, allow_pickle, False)
+            append(item)
+    return items, offset
+
+
+def _decode_tuple(view, offset, allow_pickle, allow_compressed):
+    items, offset = _decode_list(view, offset, allow_pickle, allow_compressed)
+    return tuple(items), offset
+
+
+def _decode_dict(view, offset, allow_pickle, allow_compressed):
+    length, offset = _decode_length(view, offset)
+    items = {}
+    for _ in range(length):
+        key, offset = _decode(view, offset, allow_pickle, False)
+        items[key], offset = _decode(view, offset, allow_pickle, False)
+    return items, offset
+
+
+def _decode_pickle(view, offset, allow_pickle, allow_compressed):
+    if not allow_pickle:
+        raise ValueError("Pickled values are not allowed.")
+    length, offset = _decode_length(view, offset)
+    end = offset + length
+    _check_bounds(view, end)
+    return pickle.loads(view[offset:end]), end
+
+
+def _decode_compressed(view, offset, allow_pickle, allow_compressed):
+    if not allow_compressed:
+        raise ValueError("Compressed values are not allowed.")
+    algorithm_id = view[offset]
+    length, offset = _decode_length(view, offset + 1)
+    end = offset + length
+    _check_bounds(view, end)
+    raw = decompress(algorithm_id, view[offset:end])
+    value, raw_end = _decode(raw, 0, allow_pickle, False)  # a compressed value never holds another one
+    _check_end(raw, raw_end)
+    return value, end
+
+
+# Indexed by the value's tag.
+_DECODERS = (
+    _decode_none,
+    _decode_true,
+    _decode_false,
+    _decode_int,
+    _decode_float,
+    _decode_complex,
+    _decode_str,
+    _decode_bytes,
+    _decode_list,
+    _decode_tuple,
+    _decode_dict,
+    _decode_pickle,
+    _decode_compressed,
+)
+
+
+def _check_bounds(view, end):
+    """
+    The function checks that a value does not extend past the end of the message.
+
+    Raises:
+        ValueError: If the value is truncated.
+    """
+    if end > len(view):
+        raise ValueError("Truncated value.")
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,170 @@
+import time
+import zlib
+import lzma
+from protocol import MAX_FRAME_SIZE
+
+# The id of every compression algorithm, written in front of the values it compressed.
+ALGORITHMS = {"zlib": 1, "lzma": 2}
+
+# The default number of bytes from which an encoded value is compressed, and the default compression level (0 to 9).
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+# The largest size a value may be decompressed to, so a small corrupted or hostile value cannot exhaust the memory.
+# A value is compressed before it is framed, so it never decompresses to more than a frame holds.
+MAX_DECOMPRESSED_SIZE = MAX_FRAME_SIZE
+
+
+class CompressionStats():
+    """
+    This is a class for counting the compressions and decompressions of a process, and the time they take.
+
+    Attributes:
+        values (int): The number of compressed values.
+        raw_bytes (int): The size of the compressed values before compression.
+        compressed_bytes (int): The size of the compressed values after compression.
+        incompressible (int): The number of values above the threshold that were left uncompressed, since compression did not shrink them.
+        compress_seconds (float): The CPU time spent compressing, incompressible values included.
+        decompressed_values (int): The number of decompressed values.
+        decompress_seconds (float): The CPU time spent decompressing.
+    """
+
+    def __init__(self):
+        """
+        The constructor for the compression stats class.
+        """
+        self.values = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.incompressible = 0
+        self.compress_seconds = 0.0
+        self.decompressed_values = 0
+        self.decompress_seconds = 0.0
+
+    def report(self):
+        """
+        The method reports the counters and the compression ratio (the size before compression divided by the size after, None if nothing was compressed).
+
+        Returns:
+            dict: The counters, by attribute name, and the "ratio".
+        """
+        report = dict(vars(self))
+        report["ratio"] = self.raw_bytes / self.compressed_bytes if self.compressed_bytes else None
+        return report
+
+
+# The compressions and decompressions of this process.
+STATS = CompressionStats()
+
+
+class Compressor():
+    """
+    This is a class for compressing the encoded values of at least 'threshold' bytes with zlib or lzma.
+    A value is kept uncompressed if compression does not make it smaller.
+
+    Attributes:
+        algorithm (String): The compression algorithm, "zlib" or "lzma".
+        algorithm_id (int): The algorithm's id, written in front of the compressed values.
+        level (int): The compression level, from 0 (fastest) to 9 (smallest).
+        threshold (int): The number of bytes from which a value is compressed.
+
+    Tests:
+        >>> compressor = Compressor("zlib", 6, 100)
+        >>> compressed = compressor.compress(b"abc" * 100)
+        >>> len(compressed) < 300, decompress(compressor.algorithm_id, compressed) == b"abc" * 100
+        (True, True)
+        >>> compressor.compress(b"abc")  # below the threshold
+        >>> decompress(2, Compressor("lzma", 1, 0).compress(b"xyz" * 50))[:6]
+        b'xyzxyz'
+        >>> Compressor("gzip", 6, 100)
+        Traceback (most recent call last):
+        ...
+        ValueError: Compression algorithm gzip does not exist.
+    """
+
+    def __init__(self, algorithm, level=COMPRESSION_LEVEL, threshold=COMPRESSION_THRESHOLD):
+        """
+        The constructor for the compressor class.
+
+        Parameters:
+            algorithm (String): The compression algorithm, "zlib" or "lzma".
+            level (int): The compression level, from 0 (fastest) to 9 (smallest).
+            threshold (int): The number of bytes from which a value is compressed.
+
+        Raises:
+            ValueError: The compression algorithm does not exist or the level is not between 0 and 9.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Compression algorithm {algorithm} does not exist.")
+        if not 0 <= level <= 9:
+            raise ValueError("Compression level must be between 0 and 9.")
+        self.algorithm = algorithm
+        self.algorithm_id = ALGORITHMS[algorithm]
+        self.level = level
+        self.threshold = threshold
+
+    def compress(self, data):
+        """
+        The method compresses an encoded value, if it is large enough and compression makes it smaller.
+
+        Parameters:
+            data (bytes): The encoded value.
+
+        Returns:
+            bytes: The compressed value, or None if it is kept uncompressed.
+        """
+        if len(data) < self.threshold:
+            return None
+        started = time.process_time()
+        if self.algorithm == "zlib":
+            compressed = zlib.compress(data, self.level)
+        else:
+            compressed = lzma.compress(data, preset=self.level)
+        STATS.compress_seconds += time.process_time() - started
+        if len(compressed) >= len(data):
+            STATS.incompressible += 1
+            return None
+        STATS.values += 1
+        STATS.raw_bytes += len(data)
+        STATS.compressed_bytes += len(compressed)
+        return compressed
+
+
+def decompress(algorithm_id, data):
+    """
+    The function decompresses a value compressed by a Compressor.
+
+    Parameters:
+        algorithm_id (int): The id of the algorithm that compressed the value.
+        data (bytes): The compressed value.
+
+    Returns:
+        bytes: The encoded value.
+
+    Raises:
+        ValueError: If the algorithm does not exist, or the value is corrupted, truncated or larger than MAX_DECOMPRESSED_SIZE.
+    """
+    started = time.process_time()
+    try:
+        if algorithm_id == ALGORITHMS["zlib"]:
+            decompressor = zlib.decompressobj()
+            raw = decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+            complete = decompressor.eof and not decompressor.unconsumed_tail
+        elif algorithm_id == ALGORITHMS["lzma"]:
+            decompressor = lzma.LZMADecompressor()
+            raw = decompressor.decompress(data, MAX_DECOMPRESSED_SIZE)
+            complete = decompressor.eof
+        else:
+            raise ValueError(f"Unknown compression algorithm {algorithm_id}.")
+    except (zlib.error, lzma.LZMAError):
+        raise ValueError("Corrupted compressed value.")
+    if not complete:
+        raise ValueError("Truncated or oversized compressed value.")
+    STATS.decompress_seconds += time.process_time() - started
+    STATS.decompressed_values += 1
+    return raw
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,781 @@
+import numbers
+from bisect import bisect_left, bisect_right, insort
+from itertools import chain, islice
+
+
+class SortedList():
+    """
+    This is a class for a sorted list split into chunks of bounded size.
+    Adding and removing a value costs O(log N) plus a move of at most one chunk, and iterating a range of k values costs O(log N + k).
+
+    Attributes:
+        chunks (List): The sorted chunks. Every value of a chunk is smaller or equal to the values of the next chunk.
+        maxes (List): The last (greatest) value of every chunk.
+        chunk_size (int): The size a chunk is split at, in halves.
+        size (int): The number of values.
+
+    Tests:
+        >>> values = SortedList(chunk_size=4)
+        >>> for value in [5, 1, 9, 3, 7, 2, 8, 6, 4, 0]:
+        ...     values.add(value)
+        >>> list(values)
+        [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+        >>> list(values.irange(3, 6))
+        [3, 4, 5, 6]
+        >>> list(values.irange(3, 6, inclusive=(False, False), reverse=True))
+        [5, 4]
+        >>> list(values.irange(minimum=7))
+        [7, 8, 9]
+        >>> values.remove(5)
+        >>> values.remove(5)
+        Traceback (most recent call last):
+        ...
+        ValueError: 5 is not in the list.
+        >>> len(values), 5 in values, 6 in values
+        (9, False, True)
+    """
+
+    def __init__(self, values=(), chunk_size=1000):
+        """
+        The constructor for the sorted list class.
+
+        Parameters:
+            values (Iterable): The initial values, in any order.
+            chunk_size (int): The size a chunk is split at, in halves.
+        """
+        self.chunk_size = chunk_size
+        values = sorted(values)
+        self.chunks = [values[start:start + chunk_size]
+                       for start in range(0, len(values), chunk_size)]
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.size = len(values)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def __contains__(self, value):
+        position = bisect_left(self.maxes, value)
+        if position == len(self.maxes):
+            return False
+        chunk = self.chunks[position]
+        index = bisect_left(chunk, value)
+        return chunk[index] == value
+
+    def add(self, value):
+        """
+        The method inserts a value at its sorted position.
+
+        Parameters:
+            value: The value. It must be comparable to the other values.
+        """
+        if not self.maxes:
+            self.chunks.append([value])
+            self.maxes.append(value)
+        else:
+            position = bisect_right(self.maxes, value)
+            if position == len(self.maxes):
+                position -= 1
+                self.chunks[position].append(value)
+                self.maxes[position] = value
+            else:
+                insort(self.chunks[position], value)
+            chunk = self.chunks[position]
+            if len(chunk) > 2 * self.chunk_size:
+                self.chunks.insert(position + 1, chunk[self.chunk_size:])
+                del chunk[self.chunk_size:]
+                self.maxes.insert(position, chunk[-1])
+        self.size += 1
+
+    def remove(self, value):
+        """
+        The method removes a value.
+
+        Parameters:
+            value: The value.
+
+        Raises:
+            ValueError: If the value is not in the list.
+        """
+        position = bisect_left(self.maxes, value)
+        if position < len(self.maxes):
+            chunk = self.chunks[position]
+            index = bisect_left(chunk, value)
+            if chunk[index] == value:
+                del chunk[index]
+                if chunk:
+                    self.maxes[position] = chunk[-1]
+                else:
+                    del self.chunks[position]
+                    del self.maxes[position]
+                self.size -= 1
+                return
+        raise ValueError(f"{value!r} is not in the list.")
+
+    def irange(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False):
+        """
+        The method iterates over the values between the given bounds.
+
+        Parameters:
+            minimum: The lower bound, or None if the range has no lower bound.
+            maximum: The upper bound, or None if the range has no upper bound.
+            inclusive (tuple): Whether the lower and the upper bound are part of the range.
+            reverse (bool): Whether the values are iterated from the greatest to the smallest.
+
+        Returns:
+            Generator: The values in the range.
+        """
+        if minimum is None:
+            start = (0, 0)
+        else:
+            start = self._position(minimum, not inclusive[0])
+        if maximum is None:
+            end = (len(self.chunks), 0)
+        else:
+            end = self._position(maximum, inclusive[1])
+        return self._iterate(start, end, reverse)
+
+    def scan_range(self, minimum=None, maximum=None, inclusive=(True, True), reverse=False, batch=256):
+        """
+        The method iterates over the values between the given bounds, like irange(), in batches.
+        Every batch is searched again from the last value of the previous one, so the list can be changed between two values.
+
+        Parameters:
+            minimum: The lower bound, or None if the range has no lower bound.
+            maximum: The upper bound, or None if the range has no upper bound.
+            inclusive (tuple): Whether the lower and the upper bound are part of the range.
+            reverse (bool): Whether the values are iterated from the greatest to the smallest.
+            batch (int): The number of values read at once.
+
+        Returns:
+            Generator: The values in the range.
+
+        Tests:
+            >>> values = SortedList(range(10), chunk_size=2)
+            >>> scan = values.scan_range(2, None, batch=3)
+            >>> [next(scan) for _ in range(3)]
+            [2, 3, 4]
+            >>> values.remove(5)
+            >>> values.add(4.5)
+            >>> list(scan)
+            [4.5, 6, 7, 8, 9]
+        """
+        while True:
+            values = list(islice(self.irange(
+                minimum, maximum, inclusive, reverse), batch))
+            yield from values
+            if len(values) < batch:
+                return
+            if reverse:
+                maximum, inclusive = values[-1], (inclusive[0], False)
+            else:
+                minimum, inclusive = values[-1], (False, inclusive[1])
+
+    def _position(self, value, after):
+        """
+        The method finds where a value is or would be inserted.
+
+        Parameters:
+            value: The value.
+            after (bool): Whether the position is after the values equal to the given value.
+
+        Returns:
+            (chunk, index): The chunk's position and the index inside the chunk.
+        """
+        search = bisect_right if after else bisect_left
+        position = search(self.maxes, value)
+        if position == len(self.maxes):
+            return (position, 0)
+        return (position, search(self.chunks[position], value))
+
+    def _iterate(self, start, end, reverse):
+        """
+        The method iterates over the values from the start position (inclusive) to the end position (exclusive).
+        """
+        last_position = min(end[0], len(self.chunks) - 1)
+        positions = range(start[0], last_position + 1)
+        for position in (reversed(positions) if reverse else positions):
+            chunk = self.chunks[position]
+            first = start[1] if position == start[0] else 0
+            last = end[1] if position == end[0] else len(chunk)
+            if first < last:
+                yield from (reversed(chunk[first:last]) if reverse else chunk[first:last])
+
+
+def _key_bucket(value):
+    """
+    The function returns the bucket of the values comparable to the given value, or None if the value is not ordered by the indexes.
+    Integers, floats (except NaN) and the other real numbers share the "number" bucket, since they are comparable to each other.
+
+    Parameters:
+        value: The value.
+
+    Returns:
+        String: "number", "str", "bytes" or None.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return "str"
+    if value_type is int:
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, numbers.Real):
+        return "number" if value == value else None
+    if isinstance(value, bytes):
+        return "bytes"
+    return None
+
+
+class KeyIndex():
+    """
+    This is a class for an ordered index over the database's keys, so the key range queries avoid full scans.
+    Since keys of different types cannot be compared, the keys are kept in one SortedList per bucket of comparable types.
+    The keys that belong to no bucket never match a range over a number, a string or bytes, so they are only kept in an unordered set.
+    The iterations read the keys in batches, so the index can be changed while it is iterated (e.g. between two pages of a cursor).
+
+    Attributes:
+        buckets (Dict): The SortedList of keys of every bucket.
+        others (Set): The keys that belong to no bucket.
+
+    Tests:
+        >>> index = KeyIndex([3, "b", 1.5, "a", (1, 2), 10])
+        >>> list(index.range(">", 1))
+        [1.5, 3, 10]
+        >>> list(index.range("<=", "b", reverse=True))
+        ['b', 'a']
+        >>> index.discard(3)
+        >>> list(index.range(">=", 0))
+        [1.5, 10]
+        >>> index.range("contains", 1) is None
+        True
+        >>> list(index.keys())
+        [1.5, 10, 'a', 'b', (1, 2)]
+    """
+
+    def __init__(self, keys=()):
+        """
+        The constructor for the key index class.
+
+        Parameters:
+            keys (Iterable): The keys that are initially indexed.
+        """
+        grouped = {"number": [], "str": [], "bytes": []}
+        self.others = set()
+        for key in keys:
+            bucket = _key_bucket(key)
+            if bucket:
+                grouped[bucket].append(key)
+            else:
+                self.others.add(key)
+        self.buckets = {bucket: SortedList(keys)
+                        for bucket, keys in grouped.items()}
+
+    def add(self, key):
+        """
+        The method indexes a new key.
+
+        Parameters:
+            key (Any hashable data type): The key.
+        """
+        bucket = _key_bucket(key)
+        if bucket:
+            self.buckets[bucket].add(key)
+        else:
+            self.others.add(key)
+
+    def discard(self, key):
+        """
+        The method removes a key from the index, if it is indexed.
+
+        Parameters:
+            key (Any hashable data type): The key.
+        """
+        bucket = _key_bucket(key)
+        if bucket:
+            try:
+                self.buckets[bucket].remove(key)
+            except ValueError:
+                pass
+        else:
+            self.others.discard(key)
+
+    def range(self, operator_name, value, reverse=False):
+        """
+        The method iterates, in order, over the keys that satisfy the comparison "key [OPERATOR] value".
+
+        Parameters:
+            operator_name (String): The query operator, "<", ">", "<=" or ">=".
+            value: The value the keys are compared to.
+            reverse (bool): Whether the keys are iterated from the greatest to the smallest.
+
+        Returns:
+            Generator: The matching keys, or None if the index cannot answer the comparison.
+        """
+        bucket = _key_bucket(value)
+        if bucket is None:
+            return None
+        keys = self.buckets[bucket]
+        if operator_name == ">":
+            return keys.scan_range(value, None, (False, True), reverse)
+        if operator_name == ">=":
+            return keys.scan_range(value, None, (True, True), reverse)
+        if operator_name == "<":
+            return keys.scan_range(None, value, (True, False), reverse)
+        if operator_name == "<=":
+            return keys.scan_range(None, value, (True, True), reverse)
+        return None
+
+    def keys(self, reverse=False):
+        """
+        The method iterates over all the keys: the numbers, the strings and the bytes in order, then the other keys.
+        Note: The other keys are copied when their turn comes, since a set cannot be iterated while it is changed.
+
+        Parameters:
+            reverse (bool): Whether the order is reversed.
+
+        Returns:
+            Generator: The keys.
+        """
+        buckets = [self.buckets[bucket].scan_range(reverse=reverse)
+                   for bucket in ("number", "str", "bytes")]
+        buckets.append(_copied(self.others))
+        for keys in (reversed(buckets) if reverse else buckets):
+            yield from keys
+
+
+def _copied(keys):
+    """
+    The function iterates over a copy of the given set, taken when the iteration starts.
+    """
+    yield from list(keys)
+
+
+def _iterated(keys):
+    """
+    The function lazily iterates over the given KeySet, or over nothing if there is no KeySet (an empty tuple).
+    """
+    if keys:
+        yield from keys.iterate()
+
+
+class KeySet():
+    """
+    This is a class for a set of keys that can be changed while it is lazily iterated over.
+    A set cannot be iterated while it is changed, so the set is copied on write: while iterations are suspended,
+    the first change copies it, and the iterations go on over the previous set, which is never changed again.
+    An iteration therefore returns the keys of the set when it started, without keeping the keys it already returned.
+
+    Attributes:
+        keys (Set): The keys.
+        readers (int): The number of iterations suspended over the current set of keys.
+
+    Tests:
+        >>> keys = KeySet([1, 2])
+        >>> iteration = keys.iterate()
+        >>> first = next(iteration)
+        >>> keys.add(3)  # copies the set, the iteration goes on over the previous one
+        >>> keys.discard(first)
+        >>> sorted([first] + list(iteration)), len(keys), first in keys, keys.readers
+        ([1, 2], 2, False, 0)
+        >>> list(keys.iterate()) and keys.readers
+        0
+    """
+
+    def __init__(self, keys=()):
+        """
+        The constructor for the key set class.
+
+        Parameters:
+            keys (Iterable): The initial keys.
+        """
+        self.keys = set(keys)
+        self.readers = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __iter__(self):
+        return iter(self.keys)
+
+    def add(self, key):
+        """
+        The method adds a key, copying the set first if it is being iterated over.
+
+        Parameters:
+            key (Any hashable data type): The key.
+        """
+        if key not in self.keys:
+            self._writable().add(key)
+
+    def discard(self, key):
+        """
+        The method removes a key, if it is in the set, copying the set first if it is being iterated over.
+
+        Parameters:
+            key (Any hashable data type): The key.
+        """
+        if key in self.keys:
+            self._writable().discard(key)
+
+    def iterate(self):
+        """
+        The method lazily iterates over the keys in the set when the iteration starts.
+
+        Returns:
+            Generator: The keys.
+        """
+        keys = self.keys
+        self.readers += 1
+        try:
+            yield from keys
+        finally:
+            if self.keys is keys:  # else the set was copied, and the copy has its own readers
+                self.readers -= 1
+
+    def _writable(self):
+        """
+        The method returns the set of keys that can be changed, a copy of it if it is being iterated over.
+        """
+        if self.readers:
+            self.keys = set(self.keys)
+            self.readers = 0
+        return self.keys
+
+
+class ValueHashIndex():
+    """
+    This is a class for a hash index mapping the database's values to their keys, used by the "=" value queries.
+    Unhashable values are not indexed, since they are never equal to a query value.
+
+    Attributes:
+        keys_by_value (Dict): The KeySet of keys of every indexed value.
+        exact (bool): Whether the candidate keys always match the query. Always True.
+
+    Tests:
+        >>> index = ValueHashIndex({1: "John", 2: "Mary", 3: "John", 4: ["John"]}.items())
+        >>> sorted(index.candidates("=", "John"))
+        [1, 3]
+        >>> index.discard(1, "John")
+        >>> sorted(index.candidates("=", "John"))
+        [3]
+        >>> candidates = index.candidates("=", "John")
+        >>> first = next(candidates)
+        >>> index.add(5, "John")  # the index can be changed while the candidates are suspended, they are those when they started
+        >>> sorted([first] + list(candidates)), sorted(index.candidates("=", "John"))
+        ([3], [3, 5])
+        >>> index.candidates(">", "John") is None
+        True
+    """
+    exact = True
+
+    def __init__(self, entries=()):
+        """
+        The constructor for the value hash index class.
+
+        Parameters:
+            entries (Iterable): The (key, value) tuples that are initially indexed.
+        """
+        self.keys_by_value = {}
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key, value):
+        """
+        The method indexes an entry.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        try:
+            self.keys_by_value.setdefault(value, KeySet()).add(key)
+        except TypeError:  # unhashable value
+            pass
+
+    def discard(self, key, value):
+        """
+        The method removes an entry from the index, if it is indexed.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value the entry was indexed with.
+        """
+        try:
+            keys = self.keys_by_value[value]
+        except (KeyError, TypeError):
+            return
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_value[value]
+
+    def candidates(self, operator_name, value, reverse=False):
+        """
+        The method returns the keys of the entries whose value satisfies "value [OPERATOR] query value".
+
+        Parameters:
+            operator_name (String): The query operator. Only "=" is answered.
+            value: The query value.
+            reverse (bool): Unused, the keys are not ordered.
+
+        Returns:
+            Generator: The matching keys, or None if the index cannot answer the query.
+        """
+        if operator_name != "=":
+            return None
+        try:
+            keys = self.keys_by_value.get(value, ())
+        except TypeError:
+            return None
+        return _iterated(keys)
+
+
+class ValueSortedIndex():
+    """
+    This is a class for an ordered index over the database's values, used by the "<", ">", "<=", ">=" and "=" value queries.
+    As in the KeyIndex, the distinct values are kept in one SortedList per bucket of comparable types, and the values that belong to no bucket are not indexed.
+
+    Attributes:
+        keys_by_value (Dict): The KeySet of keys of every indexed value.
+        buckets (Dict): The SortedList of distinct values of every bucket.
+        exact (bool): Whether the candidate keys always match the query. Always True.
+
+    Tests:
+        >>> index = ValueSortedIndex({1: 10, 2: 5, 3: 10, 4: "a", 5: 7.5}.items())
+        >>> list(index.candidates(">", 6))
+        [5, 1, 3]
+        >>> list(index.candidates("<=", 10, reverse=True))
+        [1, 3, 5, 2]
+        >>> index.discard(2, 5)
+        >>> list(index.candidates("<", 10))
+        [5]
+        >>> candidates = index.candidates(">", 0)
+        >>> next(candidates)
+        5
+        >>> index.discard(3, 10)  # the index can be changed while the candidates are suspended
+        >>> list(candidates)
+        [1]
+    """
+    exact = True
+
+    def __init__(self, entries=()):
+        """
+        The constructor for the value sorted index class.
+
+        Parameters:
+            entries (Iterable): The (key, value) tuples that are initially indexed.
+        """
+        self.keys_by_value = {}
+        grouped = {"number": [], "str": [], "bytes": []}
+        for key, value in entries:
+            bucket = _key_bucket(value)
+            if bucket:
+                keys = self.keys_by_value.get(value)
+                if keys is None:
+                    keys = self.keys_by_value[value] = KeySet()
+                    grouped[bucket].append(value)
+                keys.add(key)
+        self.buckets = {bucket: SortedList(values)
+                        for bucket, values in grouped.items()}
+
+    def add(self, key, value):
+        """
+        The method indexes an entry.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        bucket = _key_bucket(value)
+        if bucket:
+            keys = self.keys_by_value.get(value)
+            if keys is None:
+                keys = self.keys_by_value[value] = KeySet()
+                self.buckets[bucket].add(value)
+            keys.add(key)
+
+    def discard(self, key, value):
+        """
+        The method removes an entry from the index, if it is indexed.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value the entry was indexed with.
+        """
+        bucket = _key_bucket(value)
+        if bucket is None or value not in self.keys_by_value:
+            return
+        keys = self.keys_by_value[value]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_value[value]
+            self.buckets[bucket].remove(value)
+
+    def candidates(self, operator_name, value, reverse=False):
+        """
+        The method returns, ordered by value, the keys of the entries whose value satisfies "value [OPERATOR] query value".
+
+        Parameters:
+            operator_name (String): The query operator, "<", ">", "<=", ">=" or "=".
+            value: The query value.
+            reverse (bool): Whether the keys are ordered from the greatest to the smallest value.
+
+        Returns:
+            Generator: The matching keys, or None if the index cannot answer the query.
+        """
+        bucket = _key_bucket(value)
+        if bucket is None:
+            return None
+        if operator_name == "=":
+            return _iterated(self.keys_by_value.get(value, ()))
+        bounds = {
+            ">": (value, None, (False, True)),
+            ">=": (value, None, (True, True)),
+            "<": (None, value, (True, False)),
+            "<=": (None, value, (True, True)),
+        }
+        if operator_name not in bounds:
+            return None
+        minimum, maximum, inclusive = bounds[operator_name]
+        values = self.buckets[bucket].scan_range(
+            minimum, maximum, inclusive, reverse)
+        return (key for matching in values
+                for key in _iterated(self.keys_by_value.get(matching, ())))
+
+
+class NgramIndex():
+    """
+    This is a class for an n-gram index over the database's string values, used by the "contains" value queries.
+    Every string value is indexed under each of its n-grams (substrings of length n).
+    The candidates of a query are the keys indexed under all the n-grams of the query value, which must then be checked.
+    The keys of values that are not strings (lists, dictionaries, ...) are always candidates, since they may contain the query value too.
+
+    Attributes:
+        n (int): The length of the n-grams.
+        keys_by_ngram (Dict): The KeySet of keys of every n-gram.
+        string_keys (KeySet): The keys of the string values, the candidates of a query value shorter than n.
+        other_keys (KeySet): The keys of the values that are not strings.
+        exact (bool): Whether the candidate keys always match the query. Always False.
+
+    Tests:
+        >>> index = NgramIndex({1: "Radu-Mihai", 2: "Onescu", 3: ["Mihai"], 4: "Mihaela"}.items())
+        >>> sorted(index.candidates("contains", "Mihai"))
+        [1, 3]
+        >>> sorted(index.candidates("contains", "Mi"))
+        [1, 2, 3, 4]
+        >>> index.discard(1, "Radu-Mihai")
+        >>> sorted(index.candidates("contains", "Mihai"))
+        [3]
+    """
+    exact = False
+
+    def __init__(self, entries=(), n=3):
+        """
+        The constructor for the n-gram index class.
+
+        Parameters:
+            entries (Iterable): The (key, value) tuples that are initially indexed.
+            n (int): The length of the n-grams.
+        """
+        self.n = n
+        self.keys_by_ngram = {}
+        self.string_keys = KeySet()
+        self.other_keys = KeySet()
+        for key, value in entries:
+            self.add(key, value)
+
+    def _ngrams(self, value):
+        """
+        The method returns the distinct n-grams of a string.
+        """
+        return {value[start:start + self.n] for start in range(len(value) - self.n + 1)}
+
+    def add(self, key, value):
+        """
+        The method indexes an entry.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        if not isinstance(value, str):
+            self.other_keys.add(key)
+            return
+        self.string_keys.add(key)
+        for ngram in self._ngrams(value):
+            self.keys_by_ngram.setdefault(ngram, KeySet()).add(key)
+
+    def discard(self, key, value):
+        """
+        The method removes an entry from the index, if it is indexed.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value the entry was indexed with.
+        """
+        if not isinstance(value, str):
+            self.other_keys.discard(key)
+            return
+        self.string_keys.discard(key)
+        for ngram in self._ngrams(value):
+            keys = self.keys_by_ngram.get(ngram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_ngram[ngram]
+
+    def candidates(self, operator_name, value, reverse=False):
+        """
+        The method returns the keys of the entries whose value may satisfy "value contains query value".
+
+        Parameters:
+            operator_name (String): The query operator. Only "contains" is answered.
+            value: The query value.
+            reverse (bool): Unused, the keys are not ordered.
+
+        Returns:
+            Generator: The candidate keys, or None if the index cannot answer the query.
+        """
+        if operator_name != "contains":
+            return None
+        if not isinstance(value, str):
+            return _iterated(self.other_keys)
+        if len(value) < self.n:
+            return chain(_iterated(self.string_keys), _iterated(self.other_keys))
+        postings = sorted((self.keys_by_ngram.get(ngram, KeySet())
+                          for ngram in self._ngrams(value)), key=len)
+        return chain(self._intersection(postings), _iterated(self.other_keys))
+
+    def _intersection(self, postings):
+        """
+        The method lazily iterates over the keys indexed under all the given n-grams,
+        going through the smallest set and checking the other ones when a key is reached.
+
+        Parameters:
+            postings (List): The sets of keys of the n-grams, from the smallest to the largest.
+
+        Returns:
+            Generator: The keys in all the sets.
+        """
+        for key in _iterated(postings[0]):
+            if all(key in keys for keys in postings[1:]):
+                yield key
+
+
+# The value index classes, by the name used in the config file and in the index requests.
+VALUE_INDEXES = {
+    "hash": ValueHashIndex,
+    "sorted": ValueSortedIndex,
+    "ngram": NgramIndex,
+}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,698 @@
+import os
+import sys
+import pickle
+import random
+from collections import OrderedDict
+from collections.abc import MutableMapping, ItemsView
+from itertools import chain
+
+# The approximate number of bytes an entry costs besides its key and value: its slot in the dictionary,
+# in the key index and in the eviction policy.
+ENTRY_OVERHEAD = 120
+
+# The number of unreachable bytes of a spill file above which it is compacted, once they outweigh the reachable ones.
+SPILL_COMPACTION_THRESHOLD = 1024 * 1024
+
+
+def sizeof(value):
+    """
+    The function approximates the memory used by a value, following the items of the lists, tuples, sets and dictionaries.
+    Objects shared between values, like small integers, are counted every time they are reached.
+
+    Parameters:
+        value (Any data type): The value.
+
+    Returns:
+        int: The approximate number of bytes.
+
+    Tests:
+        >>> sizeof([1, "a"]) == sys.getsizeof([1, "a"]) + sizeof(1) + sizeof("a")
+        True
+        >>> sizeof({"a": (1,)}) > sizeof({})
+        True
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    return size
+
+
+def entry_size(key, value):
+    """
+    The function approximates the memory used by an entry, its key, its value and ENTRY_OVERHEAD.
+
+    Parameters:
+        key (Any hashable data type): The key of the entry.
+        value (Any data type): The value of the entry.
+
+    Returns:
+        int: The approximate number of bytes.
+    """
+    return ENTRY_OVERHEAD + sizeof(key) + sizeof(value)
+
+
+class LRUPolicy():
+    """
+    This is a class for choosing the least recently used entry to evict.
+
+    Attributes:
+        order (OrderedDict): The keys, from the least to the most recently used.
+
+    Tests:
+        >>> policy = LRUPolicy()
+        >>> for key in "abc":
+        ...     policy.add(key)
+        >>> policy.touch("a")
+        >>> policy.victim()
+        'b'
+        >>> policy.discard("b")
+        >>> policy.victim()
+        'c'
+    """
+
+    def __init__(self):
+        """
+        The constructor for the LRU policy class.
+        """
+        self.order = OrderedDict()
+
+    def add(self, key):
+        """
+        The method records a new key, as the most recently used.
+        """
+        self.order[key] = None
+
+    def touch(self, key):
+        """
+        The method records an access to a key.
+        """
+        self.order.move_to_end(key)
+
+    def discard(self, key):
+        """
+        The method forgets a key, if it is recorded.
+        """
+        self.order.pop(key, None)
+
+    def victim(self):
+        """
+        The method returns the key to evict next.
+
+        Raises:
+            StopIteration: If no key is recorded.
+        """
+        return next(iter(self.order))
+
+
+class LFUPolicy():
+    """
+    This is a class for choosing the least frequently used entry to evict, the least recently added or used among equals.
+    The keys are kept in buckets by access count, so every operation takes constant time.
+
+    Attributes:
+        counts (dict): The access count of every key.
+        buckets (dict): The keys (as an insertion ordered dict) of every access count.
+        minimum (int): The smallest access count, possibly outdated after a key was discarded.
+
+    Tests:
+        >>> policy = LFUPolicy()
+        >>> for key in "abc":
+        ...     policy.add(key)
+        >>> policy.touch("a")
+        >>> policy.touch("a")
+        >>> policy.touch("b")
+        >>> policy.victim()
+        'c'
+        >>> policy.discard("c")
+        >>> policy.victim()
+        'b'
+    """
+
+    def __init__(self):
+        """
+        The constructor for the LFU policy class.
+        """
+        self.counts = {}
+        self.buckets = {}
+        self.minimum = 0
+
+    def add(self, key):
+        """
+        The method records a new key, used once.
+        """
+        self.counts[key] = 1
+        self.buckets.setdefault(1, {})[key] = None
+        self.minimum = 1
+
+    def touch(self, key):
+        """
+        The method records an access to a key.
+        """
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.minimum == count:
+                self.minimum = count + 1
+        self.counts[key] = count + 1
+        self.buckets.setdefault(count + 1, {})[key] = None
+
+    def discard(self, key):
+        """
+        The method forgets a key, if it is recorded.
+        """
+        count = self.counts.pop(key, None)
+        if count is not None:
+            bucket = self.buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self.buckets[count]
+
+    def victim(self):
+        """
+        The method returns the key to evict next.
+
+        Raises:
+            ValueError: If no key is recorded.
+        """
+        if self.minimum not in self.buckets:
+            self.minimum = min(self.buckets)
+        return next(iter(self.buckets[self.minimum]))
+
+
+class RandomPolicy():
+    """
+    This is a class for choosing a random entry to evict.
+
+    Attributes:
+        keys (List): The recorded keys.
+        positions (dict): The position of every key in the list.
+
+    Tests:
+        >>> policy = RandomPolicy()
+        >>> for key in "abc":
+        ...     policy.add(key)
+        >>> policy.discard("b")
+        >>> policy.touch("a")
+        >>> policy.victim() in ("a", "c")
+        True
+    """
+
+    def __init__(self):
+        """
+        The constructor for the random policy class.
+        """
+        self.keys = []
+        self.positions = {}
+
+    def add(self, key):
+        """
+        The method records a new key.
+        """
+        self.positions[key] = len(self.keys)
+        self.keys.append(key)
+
+    def touch(self, key):
+        """
+        The method records an access to a key, which does not change its chance of being evicted.
+        """
+
+    def discard(self, key):
+        """
+        The method forgets a key, if it is recorded, by moving the last key to its position.
+        """
+        position = self.positions.pop(key, None)
+        if position is not None:
+            last = self.keys.pop()
+            if position < len(self.keys):
+                self.keys[position] = last
+                self.positions[last] = position
+
+    def victim(self):
+        """
+        The method returns the key to evict next.
+
+        Raises:
+            IndexError: If no key is recorded.
+        """
+        return random.choice(self.keys)
+
+
+EVICTION_POLICIES = {
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "random": RandomPolicy,
+}
+
+
+class SpillStore():
+    """
+    This is a class for keeping the entries evicted from memory in an append-only file, where they can be read back.
+    Only the position of every value is kept in memory. The file is a cache of the memory, not a backup:
+    it is emptied when opened, the snapshots and the write-ahead log keep the spilled entries like the others.
+    The values are read at their position without moving the file's offset, so a forked process can read them too.
+    The file is rewritten with only the reachable values once more than half of it is unreachable.
+
+    Attributes:
+        filename (String): The spill file name.
+        descriptor (int): The file's descriptor.
+        positions (dict): The (offset, length) of every spilled value, by key.
+        size (int): The size of the file, in bytes.
+        garbage (int): The number of bytes of the values that were read back or deleted.
+
+    Tests:
+        >>> import tempfile
+        >>> store = SpillStore(os.path.join(tempfile.mkdtemp(), "data.spill"))
+        >>> store.put("a", [1, 2])
+        >>> store.put("b", "x")
+        >>> store.get("a"), "b" in store, len(store)
+        ([1, 2], True, 2)
+        >>> store.pop("b")
+        'x'
+        >>> list(store.items())
+        [('a', [1, 2])]
+        >>> store.put("c", 3)
+        >>> items = store.reversed_items()
+        >>> next(items)
+        ('c', 3)
+        >>> store.discard("a")
+        >>> list(items)  # a is no longer spilled when it is reached
+        []
+        >>> store.close()
+    """
+
+    def __init__(self, filename):
+        """
+        The constructor for the spill store class. It empties the file.
+
+        Parameters:
+            filename (String): The spill file name.
+        """
+        self.filename = filename
+        self.descriptor = os.open(
+            filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        self.positions = {}
+        self.size = 0
+        self.garbage = 0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(self.positions)
+
+    def put(self, key, value):
+        """
+        The method appends a value to the file, replacing the spilled value of the key if there is one.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        record = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._write_at(record, self.size)
+        self.discard(key)
+        self.positions[key] = (self.size, len(record))
+        self.size += len(record)
+
+    def get(self, key):
+        """
+        The method reads a spilled value.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+
+        Returns:
+            The value of the entry.
+
+        Raises:
+            KeyError: If the entry is not spilled.
+        """
+        offset, length = self.positions[key]
+        return pickle.loads(self._read_at(offset, length))
+
+    def pop(self, key):
+        """
+        The method reads a spilled value and removes it from the store.
+
+        Raises:
+            KeyError: If the entry is not spilled.
+        """
+        value = self.get(key)
+        self.discard(key)
+        return value
+
+    def discard(self, key):
+        """
+        The method removes a spilled value, if there is one, and compacts the file when it is mostly unreachable.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+        """
+        position = self.positions.pop(key, None)
+        if position is not None:
+            self.garbage += position[1]
+            if self.garbage > SPILL_COMPACTION_THRESHOLD and self.garbage * 2 > self.size:
+                self._compact()
+
+    def items(self):
+        """
+        The method iterates over the spilled entries, reading their values.
+
+        Returns:
+            Generator: The (key, value) tuples.
+        """
+        for key, (offset, length) in list(self.positions.items()):
+            yield key, pickle.loads(self._read_at(offset, length))
+
+    def reversed_items(self):
+        """
+        The method iterates over the spilled entries in reverse order, reading every value only when it is reached.
+        The entries removed from the store meanwhile are skipped.
+
+        Returns:
+            Generator: The (key, value) tuples.
+        """
+        for key in list(reversed(self.positions)):
+            position = self.positions.get(key)
+            if position is not None:
+                yield key, pickle.loads(self._read_at(*position))
+
+    def close(self):
+        """
+        The method closes and removes the file.
+        """
+        os.close(self.descriptor)
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def _compact(self):
+        """
+        The method writes the reachable values to a new file and renames it over the spill file.
+        A forked process still reading the previous file keeps its own descriptor of it.
+        """
+        temporary = f"{self.filename}.tmp"
+        descriptor = os.open(
+            temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+        positions, size = {}, 0
+        for key, (offset, length) in self.positions.items():
+            os.lseek(descriptor, size, os.SEEK_SET)
+            os.write(descriptor, self._read_at(offset, length))
+            positions[key] = (size, length)
+            size += length
+        os.close(self.descriptor)
+        os.replace(temporary, self.filename)
+        self.descriptor = descriptor
+        self.positions, self.size, self.garbage = positions, size, 0
+
+    def _read_at(self, offset, length):
+        if hasattr(os, "pread"):
+            return os.pread(self.descriptor, length, offset)
+        os.lseek(self.descriptor, offset, os.SEEK_SET)
+        return os.read(self.descriptor, length)
+
+    def _write_at(self, record, offset):
+        if hasattr(os, "pwrite"):
+            os.pwrite(self.descriptor, record, offset)
+        else:
+            os.lseek(self.descriptor, offset, os.SEEK_SET)
+            os.write(self.descriptor, record)
+
+
+class BoundedData(MutableMapping):
+    """
+    This is a class for a dictionary of entries whose approximate memory use is tracked against a limit.
+    It does not evict by itself: the server evicts the victims of the eviction policy while the memory used exceeds the limit,
+    by deleting them or, if there is a spill store, by spilling them to disk with spill().
+    A spilled entry is still part of the data: it can be read (from disk), iterated over, changed and deleted.
+    Reading it with load() moves it back to memory. Reading an entry with peek() does not count as an access to it, unlike indexing.
+
+    Attributes:
+        entries (dict): The entries kept in memory.
+        sizes (dict): The approximate memory use of every entry kept in memory, by key.
+        used (int): The approximate memory use of the entries kept in memory, in bytes.
+        limit (int): The number of bytes above which entries should be evicted.
+        policy_name (String): The eviction policy, "lru", "lfu" or "random".
+        policy: The eviction policy, choosing the entries to evict among the ones kept in memory.
+        spill (SpillStore): The store of the spilled entries, or None if the evicted entries are deleted.
+        evictions (int): The number of evicted entries, deleted or spilled.
+        loads (int): The number of spilled entries moved back to memory.
+
+    Tests:
+        >>> data = BoundedData({"a": 1, "b": 2}, 10 ** 6, "lru")
+        >>> data["c"] = 3
+        >>> data.policy.victim(), len(data), data.used == sum(data.sizes.values())
+        ('a', 3, True)
+        >>> data.peek("a"), data.policy.victim()  # peeking is not an access
+        (1, 'a')
+        >>> data["a"], data.policy.victim()
+        (1, 'b')
+        >>> data.pop("a"), sorted(data), data.copy()
+        (1, ['b', 'c'], {'b': 2, 'c': 3})
+        >>> import pickle
+        >>> pickle.loads(pickle.dumps(data))
+        {'b': 2, 'c': 3}
+        >>> BoundedData({}, 1, "mru")
+        Traceback (most recent call last):
+        ...
+        ValueError: Eviction policy mru does not exist.
+    """
+
+    def __init__(self, entries, limit, policy="lru", spill=None):
+        """
+        The constructor for the bounded data class. It takes over the given dictionary, without copying it.
+
+        Parameters:
+            entries (dict): The initial entries.
+            limit (int): The number of bytes above which entries should be evicted.
+            policy (String): The eviction policy, "lru", "lfu" or "random".
+            spill (SpillStore): The store the evicted entries are spilled to, or None if they are deleted.
+
+        Raises:
+            ValueError: The eviction policy does not exist.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Eviction policy {policy} does not exist.")
+        self.entries = entries
+        self.limit = limit
+        self.policy_name = policy
+        self.policy = EVICTION_POLICIES[policy]()
+        self.spill = spill
+        self.evictions = 0
+        self.loads = 0
+        self.sizes = {}
+        for key, value in entries.items():
+            self.sizes[key] = entry_size(key, value)
+            self.policy.add(key)
+        self.used = sum(self.sizes.values())
+
+    def __getitem__(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            if self.spill is None:
+                raise
+            return self.spill.get(key)
+        self.policy.touch(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = entry_size(key, value)
+        if key in self.entries:
+            self.used -= self.sizes[key]
+            self.policy.touch(key)
+        else:
+            if self.spill is not None:
+                self.spill.discard(key)
+            self.policy.add(key)
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.used += size
+
+    def __delitem__(self, key):
+        self.pop(key)
+
+    def __contains__(self, key):
+        return key in self.entries or (self.spill is not None and key in self.spill)
+
+    def __iter__(self):
+        if self.spill is None:
+            return iter(self.entries)
+        return chain(self.entries, self.spill)
+
+    def __len__(self):
+        return len(self.entries) + (len(self.spill) if self.spill is not None else 0)
+
+    def __reduce__(self):
+        return (dict, (), None, None, iter(self.items()))
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def items(self):
+        """
+        The method returns a view of the entries, those kept in memory first, which does not count as an access.
+        """
+        return BoundedItems(self)
+
+    def pop(self, key, *default):
+        """
+        The method removes an entry, kept in memory or spilled, and returns its value.
+
+        Raises:
+            KeyError: If the entry does not exist and no default is given.
+        """
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            if self.spill is not None and key in self.spill:
+                return self.spill.pop(key)
+            if default:
+                return default[0]
+            raise
+        self.used -= self.sizes.pop(key)
+        self.policy.discard(key)
+        return value
+
+    def copy(self):
+        """
+        The method returns a dictionary holding all the entries. The spilled values are read from disk.
+        """
+        return dict(self.items())
+
+    def snapshot(self):
+        """
+        The method returns a point-in-time view of the entries, without reading the spilled values. See BoundedSnapshot.
+        """
+        if self.spill is None or not self.spill.positions:
+            return BoundedSnapshot(self.entries.copy(), {}, None)
+        descriptor = os.open(self.spill.filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        return BoundedSnapshot(self.entries.copy(), self.spill.positions.copy(), descriptor)
+
+    def peek(self, key):
+        """
+        The method reads an entry, kept in memory or spilled, without counting it as an access to the entry.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        try:
+            return self.entries[key]
+        except KeyError:
+            if self.spill is None:
+                raise
+            return self.spill.get(key)
+
+    def load(self, key):
+        """
+        The method reads an entry, moving it back to memory if it was spilled.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        if key in self.entries or self.spill is None:
+            return self[key]
+        value = self.spill.pop(key)
+        self[key] = value
+        self.loads += 1
+        return value
+
+    def spill_entry(self, key):
+        """
+        The method moves an entry kept in memory to the spill store.
+        """
+        value = self.entries.pop(key)
+        self.used -= self.sizes.pop(key)
+        self.policy.discard(key)
+        self.spill.put(key, value)
+
+
+class BoundedSnapshot():
+    """
+    This is a class for a point-in-time view of a bounded data's entries, taken in one C level copy of the entries kept in memory
+    and of the positions of the spilled values. The spilled values are only read, one at a time, when the view is iterated.
+    The view has its own descriptor of the spill file: the values spilled later are appended after the viewed ones,
+    and a compaction writes a new file, so the viewed values are not changed. It is pickled as a dictionary and should be closed.
+
+    Attributes:
+        entries (dict): The entries kept in memory.
+        positions (dict): The (offset, length) of every spilled value, by key.
+        descriptor (int): The view's descriptor of the spill file, or None if no value was spilled.
+
+    Tests:
+        >>> import tempfile
+        >>> data = BoundedData({}, 10 ** 6, "lru", SpillStore(os.path.join(tempfile.mkdtemp(), "data.spill")))
+        >>> data["a"], data["b"] = 1, 2
+        >>> data.spill_entry("a")
+        >>> view = data.snapshot()
+        >>> data["a"], data["c"] = 3, 4
+        >>> import pickle
+        >>> pickle.loads(pickle.dumps(view))
+        {'b': 2, 'a': 1}
+        >>> view.close()
+        >>> data.spill.close()
+    """
+
+    def __init__(self, entries, positions, descriptor):
+        self.entries = entries
+        self.positions = positions
+        self.descriptor = descriptor
+
+    def __reduce__(self):
+        return (dict, (), None, None, self.items())
+
+    def items(self):
+        """
+        The method iterates over the viewed entries, those kept in memory first, reading the spilled values.
+
+        Returns:
+            Generator: The (key, value) tuples.
+        """
+        yield from self.entries.items()
+        for key, (offset, length) in self.positions.items():
+            if hasattr(os, "pread"):
+                record = os.pread(self.descriptor, length, offset)
+            else:
+                os.lseek(self.descriptor, offset, os.SEEK_SET)
+                record = os.read(self.descriptor, length)
+            yield key, pickle.loads(record)
+
+    def close(self):
+        """
+        The method closes the view's descriptor of the spill file.
+        """
+        if self.descriptor is not None:
+            os.close(self.descriptor)
+            self.descriptor = None
+
+
+class BoundedItems(ItemsView):
+    """
+    This is a class for the view of a bounded data's entries, those kept in memory first, then the spilled ones read from disk.
+    Iterating over it does not count as an access to the entries.
+    """
+
+    def __iter__(self):
+        data = self._mapping
+        if data.spill is None:
+            return iter(data.entries.items())
+        return chain(data.entries.items(), data.spill.items())
+
+    def __reversed__(self):
+        data = self._mapping
+        if data.spill is None:
+            return reversed(data.entries.items())
+        return chain(data.spill.reversed_items(), reversed(data.entries.items()))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
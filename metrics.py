@@ -0,0 +1,360 @@
+import os
+import sys
+import math
+import time
+from bisect import bisect_left
+from collections import deque
+
+# The names of the request types, used to report their metrics.
+REQUEST_TYPE_NAMES = {
+    0: "read",
+    1: "add",
+    2: "delete",
+    3: "query",
+    4: "read_many",
+    5: "add_many",
+    6: "delete_many",
+    7: "create_index",
+    8: "drop_index",
+    9: "fetch",
+    10: "close_cursor",
+    11: "sync",
+    12: "replication_status",
+    13: "expire",
+    14: "ttl",
+    15: "persist",
+    16: "memory_status",
+    17: "stats",
+    18: "compression",
+    19: "incr",
+    20: "append",
+    21: "setnx",
+    22: "compare_and_set",
+    23: "subscribe",
+    24: "unsubscribe",
+    25: "shards",
+}
+
+# The upper bounds, in seconds, of the latency histograms' buckets. A last bucket holds the latencies above them.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The number of slow queries kept in memory, the older ones are only in the slow-query log file.
+SLOW_QUERIES_KEPT = 32
+
+
+def resident_memory():
+    """
+    The function reads the resident memory of the process from /proc, where it exists,
+    else the peak resident memory reported by the resource module.
+
+    Returns:
+        int: The number of bytes, or None if it cannot be read.
+
+    Tests:
+        >>> resident_memory() is None or resident_memory() > 0
+        True
+    """
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, kilobytes elsewhere
+
+
+class Histogram():
+    """
+    This is a class for counting observations, e.g. latencies, in buckets of fixed upper bounds.
+    Recording an observation takes a binary search, and the memory used does not depend on the number of observations.
+
+    Attributes:
+        bounds (tuple): The upper bounds of the buckets, in increasing order.
+        counts (List): The number of observations of every bucket, the last one counting those above the last bound.
+        count (int): The number of observations.
+        sum (float): The sum of the observations.
+        maximum (float): The largest observation, or None if there is none.
+
+    Tests:
+        >>> histogram = Histogram((1, 2, 5))
+        >>> for value in (0.5, 1, 1.5, 3, 8):
+        ...     histogram.observe(value)
+        >>> histogram.counts, histogram.count, histogram.sum
+        ([2, 1, 1, 1], 5, 14.0)
+        >>> histogram.quantile(0.5), histogram.quantile(0.99), Histogram((1,)).quantile(0.5)
+        (2, 8, None)
+        >>> histogram.cumulative()
+        [(1, 2), (2, 3), (5, 4)]
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        """
+        The constructor for the histogram class.
+
+        Parameters:
+            bounds (tuple): The upper bounds of the buckets, in increasing order.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.maximum = None
+
+    def observe(self, value):
+        """
+        The method counts an observation in the first bucket whose bound is greater than or equal to it.
+
+        Parameters:
+            value (float): The observation.
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def quantile(self, fraction):
+        """
+        The method estimates a quantile as the upper bound of the bucket holding it, or the largest observation for the last bucket.
+
+        Parameters:
+            fraction (float): The quantile, between 0 and 1, e.g. 0.99.
+
+        Returns:
+            float: The estimate, or None if there is no observation.
+        """
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(round(fraction * self.count, 9)))
+        seen = 0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        if position == len(self.bounds):
+            return self.maximum
+        return min(self.bounds[position], self.maximum)
+
+    def cumulative(self):
+        """
+        The method returns the number of observations lower than or equal to every bound.
+
+        Returns:
+            List: The (bound, count) tuples.
+        """
+        result, seen = [], 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            result.append((bound, seen))
+        return result
+
+
+class Metrics():
+    """
+    This is a class for counting what a server does: its requests, their latencies and errors, the bytes exchanged with the clients,
+    the connections and how the queries are answered.
+    The queries lasting at least 'slow_query_threshold' seconds are kept, the last SLOW_QUERIES_KEPT of them in memory,
+    and all of them appended to the slow-query log file if one is given.
+
+    Attributes:
+        started (float): The time (epoch seconds) the counting started.
+        requests (dict): The number of handled requests, by request type.
+        errors (dict): The number of unsuccessful responses, by request type.
+        latencies (dict): The latency Histogram (seconds), by request type.
+        invalid_requests (int): The number of requests that could not be decoded.
+        bytes_in (int): The number of bytes received from the clients.
+        bytes_out (int): The number of bytes sent to the clients.
+        connections (int): The number of open client connections.
+        connections_total (int): The number of accepted client connections.
+        scans (int): The number of queries answered by scanning the database.
+        scanned_entries (int): The number of entries compared by those scans.
+        indexed_queries (int): The number of queries answered from the key or value indexes.
+        slow_query_threshold (float): The number of seconds from which a query is slow, or 0 to keep none.
+        slow_queries (deque): The last slow queries, as dictionaries with the "time", "duration", "query" and "matches" fields.
+        slow_query_count (int): The number of slow queries.
+        slow_log_filename (String): The slow-query log file name, or an empty string for no file.
+
+    Tests:
+        >>> metrics = Metrics(slow_query_threshold=0.5)
+        >>> metrics.record(0, 0.0002, True)
+        >>> metrics.record(1, 0.003, False)
+        >>> metrics.record_query("read value = int ( 1 )", 0.75, 3)
+        >>> metrics.record_query("read key = int ( 1 )", 0.01, 1)
+        >>> report = metrics.report_requests()
+        >>> report["add"]["count"], report["add"]["errors"], report["read"]["p99"]
+        (1, 1, 0.0002)
+        >>> metrics.slow_query_count, metrics.slow_queries[0]["query"]
+        (1, 'read value = int ( 1 )')
+    """
+
+    def __init__(self, slow_query_threshold=0, slow_log_filename=""):
+        """
+        The constructor for the metrics class.
+
+        Parameters:
+            slow_query_threshold (float): The number of seconds from which a query is slow, or 0 to keep none.
+            slow_log_filename (String): The slow-query log file name, or an empty string for no file.
+        """
+        self.started = time.time()
+        self.requests = {}
+        self.errors = {}
+        self.latencies = {}
+        self.invalid_requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections = 0
+        self.connections_total = 0
+        self.scans = 0
+        self.scanned_entries = 0
+        self.indexed_queries = 0
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_queries = deque(maxlen=SLOW_QUERIES_KEPT)
+        self.slow_query_count = 0
+        self.slow_log_filename = slow_log_filename
+
+    def record(self, request_type, duration, success):
+        """
+        The method counts a handled request.
+
+        Parameters:
+            request_type (int): The request's type.
+            duration (float): The number of seconds it took to handle the request.
+            success (bool): Whether the response was successful.
+        """
+        self.requests[request_type] = self.requests.get(request_type, 0) + 1
+        if not success:
+            self.errors[request_type] = self.errors.get(request_type, 0) + 1
+        histogram = self.latencies.get(request_type)
+        if histogram is None:
+            histogram = self.latencies[request_type] = Histogram()
+        histogram.observe(duration)
+
+    def record_query(self, query, duration, matches):
+        """
+        The method keeps a query if it is slow, and appends it to the slow-query log file.
+        A file that cannot be written is ignored, the query is still kept in memory.
+
+        Parameters:
+            query (String): The query string.
+            duration (float): The number of seconds it took to answer the query.
+            matches (int): The number of entries returned, only the first page's if a cursor was opened, or None for a projection's result.
+        """
+        if not self.slow_query_threshold or duration < self.slow_query_threshold:
+            return
+        entry = {"time": time.time(), "duration": duration,
+                 "query": query, "matches": matches}
+        self.slow_queries.append(entry)
+        self.slow_query_count += 1
+        if self.slow_log_filename:
+            try:
+                with open(self.slow_log_filename, "a") as handle:
+                    handle.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(entry['time']))} "
+                                 f"{duration * 1000:.3f}ms matches={matches} {query}\n")
+            except OSError:
+                pass
+
+    def report_requests(self):
+        """
+        The method reports the counters and the latency estimates (seconds) of every request type handled at least once.
+
+        Returns:
+            dict: The "count", "errors", "latency_sum", "p50", "p99", "max" and "buckets" ((bound, count) cumulative tuples)
+                  of every request type, by name.
+        """
+        report = {}
+        for request_type in sorted(self.requests):
+            histogram = self.latencies[request_type]
+            report[REQUEST_TYPE_NAMES.get(request_type, str(request_type))] = {
+                "count": self.requests[request_type],
+                "errors": self.errors.get(request_type, 0),
+                "latency_sum": histogram.sum,
+                "p50": histogram.quantile(0.5),
+                "p99": histogram.quantile(0.99),
+                "max": histogram.maximum,
+                "buckets": histogram.cumulative(),
+            }
+        return report
+
+
+def render_prometheus(stats, prefix="database"):
+    """
+    The function renders the statistics reported by a server in the Prometheus text exposition format.
+    The numbers of the nested sections are flattened into "prefix_section_name" metrics,
+    the requests into labeled counters and histograms, and the statistics of the shards, if any, are labeled by shard.
+
+    Parameters:
+        stats (dict): The statistics, as reported by the stats request.
+        prefix (String): The prefix of the metrics' names.
+
+    Returns:
+        String: The metrics, one per line.
+
+    Tests:
+        >>> metrics = Metrics()
+        >>> metrics.record(0, 0.0002, True)
+        >>> text = render_prometheus({"keys": 2, "snapshot": {"last_size": None, "last_duration": 0.5},
+        ...                           "requests": metrics.report_requests()})
+        >>> print("\\n".join(line for line in text.splitlines() if "bucket" not in line or 'le="0.00025"' in line))
+        # TYPE database_keys gauge
+        database_keys 2
+        # TYPE database_snapshot_last_duration gauge
+        database_snapshot_last_duration 0.5
+        # TYPE database_requests_total counter
+        database_requests_total{type="read"} 1
+        # TYPE database_request_errors_total counter
+        database_request_errors_total{type="read"} 0
+        # TYPE database_request_duration_seconds histogram
+        database_request_duration_seconds_bucket{type="read",le="0.00025"} 1
+        database_request_duration_seconds_sum{type="read"} 0.0002
+        database_request_duration_seconds_count{type="read"} 1
+    """
+    families = {}
+
+    def add(family, kind, labels, value, name=None):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            families.setdefault((f"{prefix}_{family}", kind), []).append(
+                (f"{prefix}_{name or family}", labels, value))
+
+    def collect(stats, labels):
+        for name, value in stats.items():
+            if name == "requests":
+                for request_name, request in value.items():
+                    request_labels = labels + (("type", request_name),)
+                    add("requests_total", "counter", request_labels, request["count"])
+                    add("request_errors_total", "counter", request_labels, request["errors"])
+                    family = "request_duration_seconds"
+                    for bound, count in request["buckets"]:
+                        add(family, "histogram", request_labels + (("le", repr(float(bound))),),
+                            count, f"{family}_bucket")
+                    add(family, "histogram", request_labels + (("le", "+Inf"),),
+                        request["count"], f"{family}_bucket")
+                    add(family, "histogram", request_labels, request["latency_sum"], f"{family}_sum")
+                    add(family, "histogram", request_labels, request["count"], f"{family}_count")
+            elif name == "shards":
+                for index, shard in enumerate(value):
+                    collect(shard, labels + (("shard", str(index)),))
+            elif isinstance(value, dict):
+                for field, number in value.items():
+                    add(f"{name}_{field}", "gauge", labels, number)
+            elif name != "slow_queries":
+                add(name, "counter" if name.endswith("_total") else "gauge", labels, value)
+
+    collect(stats, ())
+    lines = []
+    for (family, kind), samples in families.items():
+        lines.append(f"# TYPE {family} {kind}")
+        for name, labels, value in samples:
+            label_text = ",".join(f'{label}="{text}"' for label, text in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
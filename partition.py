@@ -0,0 +1,48 @@
+import zlib
+from codec import encode_value
+
+# Numbers equal to each other (1, 1.0, True) are the same dictionary key, so they must be owned by the same shard.
+NUMBERS = (bool, int, float, complex)
+
+
+def shard_of(key, count):
+    """
+    The function returns the index of the shard owning a key. It is stable across processes and restarts,
+    so the sharded server and the clients routing their requests straight to the shards agree on it.
+    Numbers are partitioned by their hash, which is equal for equal numbers and does not change between processes.
+    Other keys are partitioned by the CRC32 of their encoding, since the hash of a string changes between processes.
+    The numbers inside a tuple key are encoded as their hash, so equal tuples, e.g. (1, "a") and (1.0, "a"), are owned by the same shard.
+
+    Parameters:
+        key (Any hashable data type): The key of the entry.
+        count (int): The number of shards.
+
+    Returns:
+        int: The index of the shard.
+
+    Tests:
+        >>> shard_of(1, 4) == shard_of(1.0, 4) == shard_of(True, 4)
+        True
+        >>> [shard_of(key, 4) for key in ("a", "b", b"a", (1, "a"))]
+        [3, 1, 0, 0]
+        >>> len({shard_of(key, 1024) for key in [(1, "a", (2,)), (1.0, "a", (2.0,)), (True, "a", (2 + 0j,))]})
+        1
+    """
+    if isinstance(key, NUMBERS):
+        return hash(key) % count
+    if isinstance(key, tuple):
+        key = _hashed_numbers(key)
+    return zlib.crc32(encode_value(key)) % count
+
+
+def _hashed_numbers(key):
+    """
+    The function returns a tuple key whose numbers, in it and in its nested tuples, are replaced by their hash.
+    """
+    return tuple(hash(item) if isinstance(item, NUMBERS) else _hashed_numbers(item) if isinstance(item, tuple) else item
+                 for item in key)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
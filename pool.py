@@ -0,0 +1,590 @@
+import select
+import threading
+import itertools
+from collections import deque
+from client import Client
+from response import Response
+
+
+class ClientPool():
+    """
+    This is a class for sharing warm connections to the server's database between threads.
+    Every call borrows an idle connection (or opens a new one, up to 'max_size'), sends its request and gives the connection back.
+    A borrowed connection is checked first: if the server closed it, it is dropped and another one is used.
+    If a reused connection fails before the request is completely sent, the request is retried once on a new connection.
+    A request that was sent is never retried, since the server may have applied it: the error is raised to the caller.
+    A connection whose response timed out is closed, since its response may still arrive.
+    With routing and a ShardedServer, every connection sends the requests about a single key straight to the owning shard, see Client.
+
+    Attributes:
+        host (String): The host of the server.
+        port (int): The port on which the server is bound.
+        max_size (int): The maximum number of open connections.
+        timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+        acquire_timeout (float): The number of seconds a call waits for a free connection when 'max_size' connections are busy, or None to wait forever.
+        compression (String): The compression negotiated by every connection, "zlib" or "lzma", or None to compress nothing.
+        routing (bool): Whether every connection routes the requests about a single key to the owning shard.
+        idle (deque): The idle connections (Client objects).
+        size (int): The number of open connections, idle or borrowed.
+        condition (Condition): The condition guarding the idle connections and notified when one is given back.
+
+    Note: In order for tests to work the server should be running on 127.0.0.1:65534
+    Tests:
+        >>> pool = ClientPool("127.0.0.1", 65534, max_size=2, timeout=5)
+        >>> pool.add(30, "pooled")
+        Response(success=True, message=None, data=[(30, 'pooled')])
+        >>> pool.read(30)
+        Response(success=True, message=None, data=[(30, 'pooled')])
+        >>> with pool.query("read key = int ( 30 )", page_size=10) as cursor:
+        ...     list(cursor)
+        [(30, 'pooled')]
+        >>> pool.append(30, "!")
+        Response(success=True, message=None, data=[(30, 'pooled!')])
+        >>> pool.delete(30)
+        Response(success=True, message=None, data=[])
+        >>> pool.size
+        1
+        >>> pool.close()
+    """
+
+    def __init__(self, host, port, max_size=10, timeout=None, acquire_timeout=None, compression=None, routing=False):
+        """
+        The constructor for the client pool class. No connection is opened until the first call.
+
+        Parameters:
+            host (String): The host of the server.
+            port (int): The port on which the server is bound.
+            max_size (int): The maximum number of open connections.
+            timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+            acquire_timeout (float): The number of seconds a call waits for a free connection, or None to wait forever.
+            compression (String): The compression negotiated by every connection, "zlib" or "lzma", or None to compress nothing.
+            routing (bool): Whether every connection routes the requests about a single key to the owning shard, see Client.
+        """
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.compression = compression
+        self.routing = routing
+        self.idle = deque()
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def read(self, key):
+        """
+        The method reads an entry. See Client.read().
+        """
+        return self._call("read", key)
+
+    def add(self, key, value, ttl=None):
+        """
+        The method adds an entry. See Client.add().
+        """
+        return self._call("add", key, value, ttl)
+
+    def delete(self, key):
+        """
+        The method deletes an entry. See Client.delete().
+        """
+        return self._call("delete", key)
+
+    def query(self, query, page_size=None, timeout=None):
+        """
+        The method queries the database. See Client.query().
+        If a page size is given, the connection stays borrowed by the returned cursor until it is exhausted or closed.
+
+        Returns:
+            Response: If no page size was given.
+            PooledQueryCursor: If a page size was given. It should be closed, or used in a with statement, if it is not exhausted.
+        """
+        if page_size is None:
+            return self._call("query", query)
+        client, reused = self._acquire()
+        try:
+            cursor = client.query(query, page_size, timeout)
+        except BaseException as error:
+            self._release(client, broken=not isinstance(error, ValueError))
+            raise
+        return PooledQueryCursor(self, client, cursor)
+
+    def read_many(self, keys):
+        """
+        The method reads many entries. See Client.read_many().
+        """
+        return self._call("read_many", keys)
+
+    def add_many(self, entries, ttl=None):
+        """
+        The method adds many entries. See Client.add_many().
+        """
+        return self._call("add_many", entries, ttl)
+
+    def delete_many(self, keys):
+        """
+        The method deletes many entries. See Client.delete_many().
+        """
+        return self._call("delete_many", keys)
+
+    def create_index(self, kind):
+        """
+        The method creates a value index. See Client.create_index().
+        """
+        return self._call("create_index", kind)
+
+    def drop_index(self, kind):
+        """
+        The method drops a value index. See Client.drop_index().
+        """
+        return self._call("drop_index", kind)
+
+    def expire(self, key, seconds):
+        """
+        The method sets the time to live of an entry. See Client.expire().
+        """
+        return self._call("expire", key, seconds)
+
+    def ttl(self, key):
+        """
+        The method reads the remaining time to live of an entry. See Client.ttl().
+        """
+        return self._call("ttl", key)
+
+    def persist(self, key):
+        """
+        The method removes the time to live of an entry. See Client.persist().
+        """
+        return self._call("persist", key)
+
+    def incr(self, key, delta=1):
+        """
+        The method atomically adds a number to the value of an entry. See Client.incr().
+        """
+        return self._call("incr", key, delta)
+
+    def decr(self, key, delta=1):
+        """
+        The method atomically subtracts a number from the value of an entry. See Client.decr().
+        """
+        return self._call("decr", key, delta)
+
+    def append(self, key, value):
+        """
+        The method atomically appends to the value of an entry. See Client.append().
+        """
+        return self._call("append", key, value)
+
+    def setnx(self, key, value, ttl=None):
+        """
+        The method adds an entry only if it does not exist. See Client.setnx().
+        """
+        return self._call("setnx", key, value, ttl)
+
+    def compare_and_set(self, key, value, expected):
+        """
+        The method atomically replaces the value of an entry if it is the expected one. See Client.compare_and_set().
+        """
+        return self._call("compare_and_set", key, value, expected)
+
+    def replication_status(self):
+        """
+        The method reads the server's replication status. See Client.replication_status().
+        """
+        return self._call("replication_status")
+
+    def memory_status(self):
+        """
+        The method reads the server's memory status. See Client.memory_status().
+        """
+        return self._call("memory_status")
+
+    def stats(self):
+        """
+        The method reads the server's runtime statistics. See Client.stats().
+        """
+        return self._call("stats")
+
+    def close(self):
+        """
+        The method closes the idle connections. The borrowed ones are closed when they are given back.
+        """
+        with self.condition:
+            while self.idle:
+                self.idle.pop().close()
+                self.size -= 1
+            self.max_size = 0
+            self.condition.notify_all()
+
+    def _call(self, method, *args):
+        """
+        The method calls a Client method on a borrowed connection.
+
+        Parameters:
+            method (String): The name of the Client method.
+            args: The method's arguments.
+
+        Returns:
+            Response: The server's response.
+
+        Raises:
+            TimeoutError: If no connection was free in time, or the response timed out.
+            ConnectionError: If the request could not be sent or the connection was lost.
+        """
+        client, reused = self._acquire()
+        sent_requests = client.sent_requests
+        try:
+            return getattr(client, method)(*args)
+        except ConnectionError:
+            self._release(client, broken=True)
+            sent = client.sent_requests != sent_requests
+            client = None
+            if not reused or sent:
+                raise
+        except BaseException:
+            self._release(client, broken=True)
+            client = None
+            raise
+        finally:
+            if client is not None:
+                self._release(client)
+
+        # the reused connection was closed by the server before the request was sent, retry once on a new one
+        client, reused = self._acquire(fresh=True)
+        try:
+            return getattr(client, method)(*args)
+        except BaseException:
+            self._release(client, broken=True)
+            client = None
+            raise
+        finally:
+            if client is not None:
+                self._release(client)
+
+    def _acquire(self, fresh=False):
+        """
+        The method borrows a healthy idle connection or opens a new one.
+
+        Parameters:
+            fresh (bool): Whether a new connection must be opened instead of reusing an idle one.
+
+        Returns:
+            (client, reused): The borrowed Client and whether it was an idle connection.
+
+        Raises:
+            TimeoutError: If no connection was free in time.
+            ConnectionRefusedError: Connection to the server was refused.
+        """
+        with self.condition:
+            while True:
+                while self.idle and not fresh:
+                    client = self.idle.pop()
+                    if _is_healthy(client):
+                        return client, True
+                    client.close()
+                    self.size -= 1
+                if fresh and self.idle and self.size >= self.max_size:
+                    self.idle.popleft().close()
+                    self.size -= 1
+                if self.size < self.max_size:
+                    self.size += 1
+                    break
+                if not self.condition.wait(self.acquire_timeout):
+                    raise TimeoutError("No connection of the pool is free.")
+        try:
+            return Client(self.host, self.port, self.timeout, self.compression, self.routing), False
+        except BaseException:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+
+    def _release(self, client, broken=False):
+        """
+        The method gives a borrowed connection back to the pool, or closes it if it is broken.
+
+        Parameters:
+            client (Client): The borrowed connection.
+            broken (bool): Whether the connection cannot be reused.
+        """
+        with self.condition:
+            if broken or self.size > self.max_size:
+                client.close()
+                self.size -= 1
+            else:
+                self.idle.append(client)
+            self.condition.notify()
+
+
+class ReplicatedClientPool():
+    """
+    This is a class for sending the writes to a primary server and spreading the reads over its replicas.
+    Every server gets its own ClientPool. The reads take the replicas in turn; a read falls back to the primary when the
+    replica cannot be reached or is not synchronized yet. Read-your-writes is not guaranteed: a replica may lag behind.
+
+    Attributes:
+        primary (ClientPool): The pool of connections to the primary.
+        replicas (List): The pools of connections to the replicas.
+        rotation (Iterator): The endless iterator over the replicas' pools, in turn.
+
+    Note: In order for tests to work the server should be running on 127.0.0.1:65534
+    Tests:
+        >>> pool = ReplicatedClientPool(("127.0.0.1", 65534), [], timeout=5)
+        >>> pool.add(31, "primary")
+        Response(success=True, message=None, data=[(31, 'primary')])
+        >>> pool.query("read key = int ( 31 )")
+        Response(success=True, message=None, data=[(31, 'primary')])
+        >>> pool.query("delete key = int ( 31 )")
+        Response(success=True, message=None, data=[(31, 'primary')])
+        >>> pool.close()
+    """
+
+    def __init__(self, primary, replicas, max_size=10, timeout=None, acquire_timeout=None, compression=None):
+        """
+        The constructor for the replicated client pool class.
+
+        Parameters:
+            primary (tuple): The (host, port) of the primary.
+            replicas (List): The (host, port) of every replica.
+            max_size (int): The maximum number of open connections to each server.
+            timeout (float): The number of seconds a connection attempt or a response is waited for, or None to wait forever.
+            acquire_timeout (float): The number of seconds a call waits for a free connection, or None to wait forever.
+            compression (String): The compression negotiated by every connection, "zlib" or "lzma", or None to compress nothing.
+        """
+        self.primary = ClientPool(*primary, max_size, timeout, acquire_timeout, compression)
+        self.replicas = [ClientPool(*replica, max_size, timeout, acquire_timeout, compression)
+                         for replica in replicas]
+        self.rotation = itertools.cycle(self.replicas)
+
+    def read(self, key):
+        """
+        The method reads an entry from a replica. See Client.read().
+        """
+        return self._read("read", key)
+
+    def add(self, key, value, ttl=None):
+        """
+        The method adds an entry on the primary. See Client.add().
+        """
+        return self.primary.add(key, value, ttl)
+
+    def delete(self, key):
+        """
+        The method deletes an entry on the primary. See Client.delete().
+        """
+        return self.primary.delete(key)
+
+    def query(self, query, page_size=None, timeout=None):
+        """
+        The method sends a read query to a replica and a delete query to the primary. See ClientPool.query().
+        """
+        if query.lstrip().startswith("delete"):
+            return self.primary.query(query, page_size, timeout)
+        return self._read("query", query, page_size, timeout)
+
+    def read_many(self, keys):
+        """
+        The method reads many entries from a replica. See Client.read_many().
+        """
+        return self._read("read_many", keys)
+
+    def add_many(self, entries, ttl=None):
+        """
+        The method adds many entries on the primary. See Client.add_many().
+        """
+        return self.primary.add_many(entries, ttl)
+
+    def expire(self, key, seconds):
+        """
+        The method sets the time to live of an entry on the primary. See Client.expire().
+        """
+        return self.primary.expire(key, seconds)
+
+    def ttl(self, key):
+        """
+        The method reads the remaining time to live of an entry from a replica. See Client.ttl().
+        """
+        return self._read("ttl", key)
+
+    def persist(self, key):
+        """
+        The method removes the time to live of an entry on the primary. See Client.persist().
+        """
+        return self.primary.persist(key)
+
+    def incr(self, key, delta=1):
+        """
+        The method atomically adds a number to the value of an entry on the primary. See Client.incr().
+        """
+        return self.primary.incr(key, delta)
+
+    def decr(self, key, delta=1):
+        """
+        The method atomically subtracts a number from the value of an entry on the primary. See Client.decr().
+        """
+        return self.primary.decr(key, delta)
+
+    def append(self, key, value):
+        """
+        The method atomically appends to the value of an entry on the primary. See Client.append().
+        """
+        return self.primary.append(key, value)
+
+    def setnx(self, key, value, ttl=None):
+        """
+        The method adds an entry on the primary only if it does not exist. See Client.setnx().
+        """
+        return self.primary.setnx(key, value, ttl)
+
+    def compare_and_set(self, key, value, expected):
+        """
+        The method atomically replaces the value of an entry on the primary if it is the expected one. See Client.compare_and_set().
+        """
+        return self.primary.compare_and_set(key, value, expected)
+
+    def delete_many(self, keys):
+        """
+        The method deletes many entries on the primary. See Client.delete_many().
+        """
+        return self.primary.delete_many(keys)
+
+    def create_index(self, kind):
+        """
+        The method creates a value index on the primary and on every replica. See Client.create_index().
+
+        Returns:
+            Response: The primary's response.
+        """
+        for replica in self.replicas:
+            try:
+                replica.create_index(kind)
+            except (OSError, ConnectionError):
+                pass
+        return self.primary.create_index(kind)
+
+    def drop_index(self, kind):
+        """
+        The method drops a value index on the primary and on every replica. See Client.drop_index().
+
+        Returns:
+            Response: The primary's response.
+        """
+        for replica in self.replicas:
+            try:
+                replica.drop_index(kind)
+            except (OSError, ConnectionError):
+                pass
+        return self.primary.drop_index(kind)
+
+    def close(self):
+        """
+        The method closes the idle connections of every pool.
+        """
+        self.primary.close()
+        for replica in self.replicas:
+            replica.close()
+
+    def _read(self, method, *args):
+        """
+        The method calls a read method on the next replica's pool, or on the primary's if it fails.
+
+        Parameters:
+            method (String): The name of the ClientPool method.
+            args: The method's arguments.
+
+        Returns:
+            The result of the method.
+        """
+        if self.replicas:
+            try:
+                result = getattr(next(self.rotation), method)(*args)
+                if not isinstance(result, Response) or result.message != "Replica is not synchronized.":
+                    return result
+            except (OSError, ConnectionError):
+                pass
+        return getattr(self.primary, method)(*args)
+
+
+def _is_healthy(client):
+    """
+    The function checks whether an idle connection can still be used.
+    An idle connection has nothing to read, so a readable socket means the server closed it (or sent unexpected data).
+
+    Parameters:
+        client (Client): The idle connection.
+
+    Returns:
+        bool: Whether the connection can be used.
+    """
+    try:
+        readable, _, _ = select.select([client.client_socket], [], [], 0)
+        return not readable
+    except (OSError, ValueError):
+        return False
+
+
+class PooledQueryCursor():
+    """
+    This is a class for a query cursor holding a borrowed connection of a pool.
+    The connection is given back when the cursor is exhausted or closed.
+
+    Attributes:
+        pool (ClientPool): The pool the connection is borrowed from.
+        client (Client): The borrowed connection.
+        cursor (QueryCursor): The cursor iterating over the query's results.
+    """
+
+    def __init__(self, pool, client, cursor):
+        """
+        The constructor for the pooled query cursor class.
+
+        Parameters:
+            pool (ClientPool): The pool the connection is borrowed from.
+            client (Client): The borrowed connection.
+            cursor (QueryCursor): The cursor iterating over the query's results.
+        """
+        self.pool = pool
+        self.client = client
+        self.cursor = cursor
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.client is None:
+            raise StopIteration
+        try:
+            return next(self.cursor)
+        except StopIteration:
+            self._release(broken=False)
+            raise
+        except BaseException:
+            self._release(broken=True)
+            raise
+
+    def close(self):
+        """
+        The method closes the cursor and gives the connection back to the pool.
+        """
+        if self.client is not None:
+            try:
+                self.cursor.close()
+            except (OSError, ConnectionError):
+                self._release(broken=True)
+                return
+            self._release(broken=False)
+
+    def _release(self, broken):
+        if self.client is not None:
+            self.pool._release(self.client, broken)
+            self.client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
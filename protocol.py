@@ -0,0 +1,121 @@
+import struct
+
+# Every frame starts with the payload length and the id of the request it belongs to.
+HEADER = struct.Struct("!IQ")
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def pack_frame(request_id, payload):
+    """
+    The function wraps the given payload in a frame.
+
+    Parameters:
+        request_id (int): The id of the request the payload belongs to.
+        payload (bytes): The serialized request or response.
+
+    Returns:
+        bytes: The header followed by the payload.
+
+    Tests:
+        >>> pack_frame(7, b"abc")
+        b'\\x00\\x00\\x00\\x03\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x07abc'
+    """
+    return HEADER.pack(len(payload), request_id) + payload
+
+
+def recv_frame(sock):
+    """
+    The function reads exactly one frame from a blocking socket.
+
+    Parameters:
+        sock: The TCP Socket the frame is read from.
+
+    Returns:
+        (request_id, payload): The id of the request and the frame's payload.
+
+    Raises:
+        ConnectionError: Connection closed by the peer.
+    """
+    length, request_id = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError("Frame exceeds the maximum size.")
+    return request_id, _recv_exactly(sock, length)
+
+
+def _recv_exactly(sock, size):
+    """
+    The function reads exactly the given number of bytes from a blocking socket.
+
+    Parameters:
+        sock: The TCP Socket the bytes are read from.
+        size (int): The number of bytes.
+
+    Returns:
+        bytes: The read bytes.
+
+    Raises:
+        ConnectionError: Connection closed by the peer.
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError("Connection closed by the peer.")
+        received += count
+    return bytes(buffer)
+
+
+class FrameReader():
+    """
+    This is a class for splitting a stream of bytes received from a non-blocking socket into frames.
+
+    Tests:
+        >>> reader = FrameReader()
+        >>> data = pack_frame(1, b"first") + pack_frame(2, b"second")
+        >>> reader.feed(data[:15])
+        []
+        >>> reader.feed(data[15:])
+        [(1, b'first'), (2, b'second')]
+    """
+
+    def __init__(self):
+        """
+        The constructor for the frame reader class.
+        """
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        The method appends the received bytes to the buffer and extracts every complete frame.
+
+        Parameters:
+            data (bytes): The received bytes.
+
+        Returns:
+            frames (List): A list of (request_id, payload) tuples.
+
+        Raises:
+            ConnectionError: Frame exceeds the maximum size.
+        """
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= HEADER.size:
+            length, request_id = HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_SIZE:
+                raise ConnectionError("Frame exceeds the maximum size.")
+            end = offset + HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            frames.append(
+                (request_id, bytes(self.buffer[offset + HEADER.size:end])))
+            offset = end
+        del self.buffer[:offset]
+        return frames
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,453 @@
+import operator
+from collections import OrderedDict
+from pyparsing import CaselessKeyword, Group, Keyword, OpAssoc, Optional, QuotedString, Word, infix_notation, nums, printables
+
+# The query grammar, built once when the module is imported.
+ACTION = Keyword("read")("action") | Keyword("delete")("action")
+
+PROJECTION = (Keyword("count") | Keyword("min") | Keyword("max") |
+              Keyword("sum") | Keyword("keys"))("projection")
+
+ELEMENT = Keyword("key")("element") | Keyword("value")("element")
+
+OPERATOR = Keyword("<=")("operator") | Keyword(">=")("operator") | Keyword("<")("operator") | Keyword(">")("operator") | Keyword(
+    "=")("operator") | Keyword("contains")("operator")
+
+# A value between double quotes can contain spaces and parentheses, and is never read as a clause.
+QUOTED_VALUE = QuotedString('"', esc_char="\\")
+
+VALUE = (Word(printables)("value_type") +
+         "(" + (QUOTED_VALUE | Word(printables))("value") + ")") | QUOTED_VALUE("value") | Word(printables)("value")
+
+LIMIT = Keyword("limit") + Word(nums)("limit")
+
+REVERSE = Keyword("reverse")("reverse")
+
+PREDICATE = Group(ELEMENT + OPERATOR + VALUE)
+
+CONDITION = infix_notation(PREDICATE, [
+    (CaselessKeyword("not"), 1, OpAssoc.RIGHT),
+    (CaselessKeyword("and"), 2, OpAssoc.LEFT),
+    (CaselessKeyword("or"), 2, OpAssoc.LEFT),
+])("condition")
+
+SYNTAX = (ACTION | PROJECTION) + CONDITION + Optional(LIMIT) + Optional(REVERSE)
+
+OPERATORS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "contains": operator.contains,
+}
+
+TYPES = {
+    "int": int,
+    "float": float,
+    "complex": complex,
+    "str": str
+}
+
+
+class Condition():
+    """
+    This is a class for a compiled query condition: a predicate comparing the key or the value of an entry to a value,
+    or the "and", "or" or "not" of other conditions.
+    A predicate of a compound condition whose comparison raises an error (e.g. comparing a string to a number) is false.
+
+    Attributes:
+        kind (String): "predicate", "and", "or" or "not".
+        element (String): The compared element of a predicate, "key" or "value", else None.
+        operator_name (String): The operator of a predicate, "<", ">", "=", "<=", ">=" or "contains", else None.
+        operator (Function): The function comparing the element to the value, else None.
+        value: The value a predicate compares the element to, else None.
+        children (List): The combined conditions, empty for a predicate.
+        match (Function): The function called with the key and the value of an entry, returning whether the entry matches.
+
+    Tests:
+        >>> condition = Condition.both([Condition.predicate("key", ">", 1),
+        ...                             Condition.negation(Condition.predicate("value", "contains", "x"))])
+        >>> condition
+        (key > 1 and not value contains 'x')
+        >>> condition.match(2, "abc"), condition.match(2, "xyz"), condition.match("a", "abc")
+        (True, False, False)
+        >>> Condition.either([Condition.predicate("key", "=", 1), Condition.predicate("key", "=", 3)]).match(3, None)
+        True
+    """
+    __slots__ = ("kind", "element", "operator_name",
+                 "operator", "value", "children", "match")
+
+    def __init__(self, kind, children, match, element=None, operator_name=None, value=None):
+        """
+        The constructor for the condition class. Use the predicate(), both(), either() and negation() constructors.
+        """
+        self.kind = kind
+        self.children = children
+        self.match = match
+        self.element = element
+        self.operator_name = operator_name
+        self.operator = OPERATORS[operator_name] if operator_name else None
+        self.value = value
+
+    @classmethod
+    def predicate(cls, element, operator_name, value):
+        """
+        The method compiles a predicate comparing the key or the value of an entry to a value.
+        Its match function raises the comparison's errors.
+
+        Parameters:
+            element (String): The compared element, "key" or "value".
+            operator_name (String): The operator, "<", ">", "=", "<=", ">=" or "contains".
+            value: The value the element is compared to.
+        """
+        compare = OPERATORS[operator_name]
+        if element == "key":
+            def match(key, entry_value):
+                return compare(key, value)
+        else:
+            def match(key, entry_value):
+                return compare(entry_value, value)
+        return cls("predicate", [], match, element, operator_name, value)
+
+    @classmethod
+    def both(cls, children):
+        """
+        The method compiles the "and" of conditions, which stops at the first false one.
+        """
+        match = _safe(children[0])
+        for child in children[1:]:
+            match = _both(match, _safe(child))
+        return cls("and", children, match)
+
+    @classmethod
+    def either(cls, children):
+        """
+        The method compiles the "or" of conditions, which stops at the first true one.
+        """
+        match = _safe(children[0])
+        for child in children[1:]:
+            match = _either(match, _safe(child))
+        return cls("or", children, match)
+
+    @classmethod
+    def negation(cls, child):
+        """
+        The method compiles the "not" of a condition.
+        """
+        match = _safe(child)
+        return cls("not", [child], lambda key, value: not match(key, value))
+
+    def __repr__(self):
+        if self.kind == "predicate":
+            return f"{self.element} {self.operator_name} {self.value!r}"
+        if self.kind == "not":
+            return f"not {self.children[0]!r}"
+        return "(" + f" {self.kind} ".join(repr(child) for child in self.children) + ")"
+
+
+def _safe(condition):
+    """
+    The function returns the match function of a condition, returning False instead of raising if it is a predicate.
+    """
+    if condition.kind != "predicate":
+        return condition.match
+    match = condition.match
+
+    def safe(key, value):
+        try:
+            return match(key, value)
+        except:
+            return False
+    return safe
+
+
+def _both(first, second):
+    """
+    The function returns a match function true when both the given match functions are.
+    """
+    return lambda key, value: first(key, value) and second(key, value)
+
+
+def _either(first, second):
+    """
+    The function returns a match function true when any of the given match functions is.
+    """
+    return lambda key, value: first(key, value) or second(key, value)
+
+
+class QueryPlan():
+    """
+    This is a class for a compiled query: the parsed query string with its values casted and its operators resolved.
+    A query with a single predicate keeps it in the element, operator and value attributes, used by the key and value executors.
+    A compound query ("and", "or", "not") has the "compound" element and is executed by its match function. Its "and" predicates,
+    the 'drivers', can be answered from an index, the candidate entries they return are then checked with the whole condition.
+
+    Attributes:
+        action (String): The query action, "read" or "delete". A projection reads.
+        projection (String): The projection of the matching entries, "count", "min", "max", "sum" or "keys", or None to return the entries.
+        condition (Condition): The compiled condition.
+        element (String): The queried element, "key", "value" or "compound". It selects the executor of the query.
+        operator_name (String): The query operator, "<", ">", "=", "<=", ">=" or "contains", or None for a compound query.
+        operator (Function): The function comparing an element to the value, or None for a compound query.
+        value: The value on which the query is done, casted to its data type, or None for a compound query.
+        match (Function): The function called with the key and the value of an entry, returning whether the entry matches.
+        drivers (List): The predicates every matching entry satisfies, whose candidates can be read from an index.
+        limit (int): The maximum number of matching entries, or None if there is no limit.
+        reverse (bool): Whether the matching entries are returned in reverse order.
+    """
+    __slots__ = ("action", "projection", "condition", "element", "operator_name",
+                 "operator", "value", "match", "drivers", "limit", "reverse")
+
+    def __init__(self, action, condition, limit=None, reverse=False, projection=None):
+        """
+        The constructor for the query plan class.
+
+        Parameters:
+            action (String): The query action.
+            condition (Condition): The compiled condition.
+            limit (int): The maximum number of matching entries, or None if there is no limit.
+            reverse (bool): Whether the matching entries are returned in reverse order.
+            projection (String): The projection of the matching entries, or None to return the entries.
+        """
+        self.action = action
+        self.projection = projection
+        self.condition = condition
+        self.match = condition.match
+        if condition.kind == "predicate":
+            self.element = condition.element
+            self.drivers = [condition]
+        else:
+            self.element = "compound"
+            self.drivers = [child for child in condition.children
+                            if child.kind == "predicate"] if condition.kind == "and" else []
+        self.operator_name = condition.operator_name
+        self.operator = condition.operator
+        self.value = condition.value
+        self.limit = limit
+        self.reverse = reverse
+
+    def __repr__(self):
+        if self.element == "compound" or self.projection:
+            return (f"QueryPlan(action={self.action}, projection={self.projection}, condition={self.condition!r}, "
+                    f"limit={self.limit}, reverse={self.reverse})")
+        return (f"QueryPlan(action={self.action}, element={self.element}, operator={self.operator_name}, "
+                f"value={self.value!r}, limit={self.limit}, reverse={self.reverse})")
+
+
+def compile_query(query):
+    """
+    The function checks the format of the given query and compiles it to a query plan.
+
+    Parameters:
+        query (String): The query string.
+                        Accepted formats: "[ACTION] [CONDITION]" followed by the optional clauses "limit [COUNT]" and "reverse"
+                        [CONDITION] is a predicate, "[ELEMENT] [OPERATOR] [VALUE]" or "[ELEMENT] [OPERATOR] [DATATYPE] ( [VALUE] )",
+                                    or predicates combined with "and", "or", "not" (in increasing order of precedence) and parentheses.
+                                    A predicate of a combination is false for the entries whose element cannot be compared to its value.
+                        [ACTION] can be "read" or "delete", or a projection of the matching entries:
+                                 "count" (their number), "min", "max" or "sum" (of their values, None for min and max if none matches)
+                                 or "keys" (their keys)
+                        [ELEMENT] can be "value" or "key"
+                        [OPERATOR] can be "<", ">", "=", "<=", ">=", "contains"
+                        [DATATYPE] can be "int", "float", "complex", "str".
+                        [VALUE] is the value on which the query will be done. The words "and", "or", "not", "limit" and "reverse" are values too
+                                where a value is expected. A value can be written between double quotes (with \\" for a quote),
+                                so it can contain spaces and parentheses and is not read as a clause, e.g. "read value = \\"limit\\" limit 5".
+                        [COUNT] is the maximum number of matching entries that are read, deleted or projected.
+                        "reverse" returns the matching entries in reverse order. Key range queries return the entries ordered by key.
+                        Examples: "read key > 1234"
+                                  "read value < int ( 4 )"
+                                  "delete key >= int ( 10 ) limit 100 reverse"
+                                  "count key >= int ( 10 ) and not ( value = a or value = b )"
+                                  "sum value > int ( 0 ) limit 1000"
+                        Note: If no datatype is provided, the value will have the String data type by default.
+
+    Returns:
+        QueryPlan: The compiled query.
+
+    Raises:
+        ParseException: If the query does not match the syntax.
+        KeyError: If the data type does not exist.
+        ValueError: If the value cannot be casted to the data type.
+
+    Tests:
+        >>> compile_query("read key > int ( 5 )")
+        QueryPlan(action=read, element=key, operator=>, value=5, limit=None, reverse=False)
+        >>> compile_query("delete value contains Mihai limit 10 reverse")
+        QueryPlan(action=delete, element=value, operator=contains, value='Mihai', limit=10, reverse=True)
+        >>> compile_query("count key > int ( 1 ) AND ( value = a or not value < int ( 5 ) )")
+        QueryPlan(action=read, projection=count, condition=(key > 1 and (value = 'a' or not value < 5)), limit=None, reverse=False)
+        >>> compile_query("keys key >= 7 limit 2").drivers
+        [key >= '7']
+        >>> compile_query("count value = not or value = and limit 5")
+        QueryPlan(action=read, projection=count, condition=(value = 'not' or value = 'and'), limit=5, reverse=False)
+        >>> compile_query('read value = "limit" limit 5 reverse')
+        QueryPlan(action=read, element=value, operator==, value='limit', limit=5, reverse=True)
+        >>> compile_query('read value contains str ( "a (b) \\\\"c\\\\"" )')
+        QueryPlan(action=read, element=value, operator=contains, value='a (b) "c"', limit=None, reverse=False)
+    """
+    parsed = SYNTAX.parseString(query, parseAll=True)
+    limit = int(parsed["limit"]) if "limit" in parsed else None
+    if "projection" in parsed:
+        return QueryPlan("read", _compile_condition(parsed["condition"]), limit, "reverse" in parsed,
+                         parsed["projection"])
+    return QueryPlan(parsed["action"], _compile_condition(parsed["condition"]), limit, "reverse" in parsed)
+
+
+def _compile_condition(parsed):
+    """
+    The function compiles a parsed condition: a predicate's group, or a group of conditions
+    separated by "and" or "or" operators, or a "not" operator followed by a condition.
+
+    Parameters:
+        parsed (ParseResults): The parsed condition.
+
+    Returns:
+        Condition: The compiled condition.
+
+    Raises:
+        KeyError: If a data type does not exist.
+        ValueError: If a value cannot be casted to its data type.
+    """
+    if "element" in parsed:
+        value = parsed["value"]
+        if "value_type" in parsed:
+            value = TYPES[parsed["value_type"]](value)
+        return Condition.predicate(parsed["element"], parsed["operator"], value)
+    if len(parsed) == 1:
+        return _compile_condition(parsed[0])
+    if isinstance(parsed[0], str) and parsed[0].lower() == "not":
+        return Condition.negation(_compile_condition(parsed[1]))
+    children = [_compile_condition(operand) for operand in parsed[::2]]
+    if parsed[1].lower() == "and":
+        return Condition.both(children)
+    return Condition.either(children)
+
+
+def aggregate(projection, entries):
+    """
+    The function projects the entries matching a query, in one pass.
+
+    Parameters:
+        projection (String): "count", "min", "max", "sum" or "keys".
+        entries (Iterable): The (key, value) tuples of the matching entries.
+
+    Returns:
+        The number of entries, the smallest or largest value (None if there is no entry), the sum of the values or the list of the keys.
+
+    Raises:
+        TypeError: If the values cannot be compared or added.
+
+    Tests:
+        >>> entries = [(1, 5), (2, 3), (3, 4)]
+        >>> [aggregate(projection, entries) for projection in ("count", "min", "max", "sum", "keys")]
+        [3, 3, 5, 12, [1, 2, 3]]
+        >>> aggregate("max", [])
+        >>> aggregate("sum", [(1, "a")])
+        Traceback (most recent call last):
+        ...
+        TypeError: unsupported operand type(s) for +: 'int' and 'str'
+    """
+    if projection == "count":
+        return sum(1 for _ in entries)
+    if projection == "keys":
+        return [key for key, _ in entries]
+    values = (value for _, value in entries)
+    if projection == "sum":
+        return sum(values)
+    return (min if projection == "min" else max)(values, default=None)
+
+
+def combine(projection, results):
+    """
+    The function combines the projections of disjoint sets of entries, e.g. computed by different shards.
+
+    Parameters:
+        projection (String): "count", "min", "max", "sum" or "keys".
+        results (List): The projections of every set of entries.
+
+    Returns:
+        The projection of all the entries. The keys are concatenated.
+
+    Raises:
+        TypeError: If the values cannot be compared or added.
+
+    Tests:
+        >>> combine("count", [2, 3]), combine("min", [None, 4, 2]), combine("keys", [[1], [2, 3]])
+        (5, 2, [1, 2, 3])
+    """
+    if projection in ("count", "sum"):
+        return sum(results)
+    if projection == "keys":
+        return [key for keys in results for key in keys]
+    results = [result for result in results if result is not None]
+    return (min if projection == "min" else max)(results, default=None)
+
+
+class QueryCache():
+    """
+    This is a class for a bounded least recently used cache mapping query strings to their compiled query plans.
+    Repeated queries skip parsing altogether.
+
+    Attributes:
+        capacity (int): The maximum number of cached query plans.
+        plans (OrderedDict): The cached query plans, from the least to the most recently used.
+        hits (int): The number of lookups that found a cached query plan.
+        misses (int): The number of lookups that compiled the query.
+
+    Tests:
+        >>> cache = QueryCache(2)
+        >>> cache.get("read key = 1").value
+        '1'
+        >>> cache.get("read key = 2") is cache.get("read key = 2")
+        True
+        >>> _ = cache.get("read key = 3")
+        >>> list(cache.plans)
+        ['read key = 2', 'read key = 3']
+        >>> (cache.hits, cache.misses)
+        (1, 3)
+    """
+
+    def __init__(self, capacity):
+        """
+        The constructor for the query cache class.
+
+        Parameters:
+            capacity (int): The maximum number of cached query plans. If it is 0, nothing is cached.
+        """
+        self.capacity = capacity
+        self.plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        """
+        The method returns the query plan of the given query, compiling and caching it if it is not cached.
+
+        Parameters:
+            query (String): The query string.
+
+        Returns:
+            QueryPlan: The compiled query.
+
+        Raises:
+            The exceptions of compile_query(), if the query is invalid. Invalid queries are not cached.
+        """
+        plan = self.plans.get(query)
+        if plan is not None:
+            self.hits += 1
+            self.plans.move_to_end(query)
+            return plan
+        self.misses += 1
+        plan = compile_query(query)
+        if self.capacity > 0:
+            self.plans[query] = plan
+            if len(self.plans) > self.capacity:
+                self.plans.popitem(last=False)
+        return plan
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
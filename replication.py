@@ -0,0 +1,174 @@
+import os
+import time
+import threading
+from wal import SET, DELETE, EXPIRE
+from codec import encode_value, decode_value
+
+# The messages pushed by a primary to its replicas, besides the mutations (wal.SET, wal.DELETE and wal.EXPIRE).
+SNAPSHOT = 0
+PING = 4
+
+# The largest part of the bootstrap snapshot sent in one message.
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def encode_message(kind, offset, key=None, value=None, timestamp=None):
+    """
+    The function encodes a replication message.
+    Every message holds its kind, the primary's replication offset (the number of mutations applied by the primary)
+    and the primary's time when it was sent:
+        - SNAPSHOT: A part of the pickled (data, expirations) tuple (key) and whether it is the last part (value), at the given offset.
+        - SET, DELETE, EXPIRE: The mutation of an entry (key, value), which moved the primary to the given offset.
+        - PING: Nothing happened on the primary since the given offset. It lets the replica measure its lag when the primary is idle.
+
+    Parameters:
+        kind (int): The kind of the message, SNAPSHOT, SET, DELETE, EXPIRE or PING.
+        offset (int): The primary's replication offset.
+        key: The key of the mutated entry, or a part of the snapshot.
+        value: The value of the mutated entry, its expiration time, or whether the snapshot part is the last one.
+        timestamp (float): The primary's time (epoch seconds), or None for the current time.
+
+    Returns:
+        bytes: The encoded message.
+
+    Tests:
+        >>> decode_message(encode_message(SET, 7, "a", [1], timestamp=1.5))
+        (1, 7, 1.5, 'a', [1])
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return encode_value((kind, offset, timestamp, key, value))
+
+
+def decode_message(payload):
+    """
+    The function decodes a replication message. See encode_message().
+
+    Parameters:
+        payload (bytes): The encoded message.
+
+    Returns:
+        (kind, offset, timestamp, key, value): The message's fields.
+
+    Raises:
+        ValueError: If the payload is not a valid encoded message.
+    """
+    return tuple(decode_value(payload))
+
+
+class Bootstrap():
+    """
+    This is a class for the image of the data a replica is synchronized from.
+    The image is captured by a snapshot engine writing its own file, so it is serialized by a forked process
+    (or, with the "copy" method, by a thread) while the primary keeps serving the requests.
+    Once written, the file is read back and sent in SNAPSHOT messages of at most CHUNK_SIZE bytes, one at a time as the replica's connection drains.
+    The messages pushed to the replica meanwhile are held and sent after the last part.
+
+    Attributes:
+        engine (SnapshotEngine): The engine writing the image.
+        offset (int): The primary's replication offset the image was captured at.
+        timestamp (float): The primary's time (epoch seconds) the image was captured at.
+        held (bytearray): The frames pushed to the replica since the capture, sent after the image.
+        ready (threading.Event): Set once the image is written, or could not be.
+        failed (bool): Whether the image could not be written.
+        closed (bool): Whether the bootstrap is finished or abandoned. The image file is then removed.
+        handle: The image file, while it is being sent, else None.
+
+    Tests:
+        >>> import io, tempfile
+        >>> from snapshot import SnapshotEngine, load_snapshot
+        >>> engine = SnapshotEngine(os.path.join(tempfile.mkdtemp(), "image"), "copy")
+        >>> bootstrap = Bootstrap(engine, engine.capture({"a": "x" * 100}, {}), 7)
+        >>> bootstrap.ready.wait(10), bootstrap.failed
+        (True, False)
+        >>> parts = [bootstrap.next_message(chunk_size=100) for _ in range(2)]
+        >>> [decode_message(message)[:2] + (decode_message(message)[4], last) for message, last in parts]
+        [(0, 7, False, False), (0, 7, True, True)]
+        >>> load_snapshot(io.BytesIO(b"".join(decode_message(message)[3] for message, _ in parts)))
+        ({'a': 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'}, {})
+        >>> bootstrap.closed, os.path.exists(engine.filename)
+        (True, False)
+    """
+
+    def __init__(self, engine, capture, offset):
+        """
+        The constructor for the bootstrap class. A thread waits until the captured image is written.
+
+        Parameters:
+            engine (SnapshotEngine): The engine writing the image.
+            capture (tuple): The value returned by the engine's capture().
+            offset (int): The primary's replication offset the image was captured at.
+        """
+        self.engine = engine
+        self.offset = offset
+        self.timestamp = time.time()
+        self.held = bytearray()
+        self.ready = threading.Event()
+        self.failed = False
+        self.closed = False
+        self.handle = None
+        threading.Thread(target=self._complete, args=(capture,), daemon=True).start()
+
+    def _complete(self, capture):
+        """
+        The method waits until the captured image is written. If the bootstrap was abandoned meanwhile, the image is removed.
+
+        Parameters:
+            capture (tuple): The value returned by the engine's capture().
+        """
+        try:
+            self.engine.complete(capture)
+        except:
+            self.failed = True
+        self.ready.set()
+        if self.closed:
+            self._remove()
+
+    def next_message(self, chunk_size=CHUNK_SIZE):
+        """
+        The method reads the next part of the written image. After the last one, the bootstrap is closed.
+
+        Parameters:
+            chunk_size (int): The largest part read.
+
+        Returns:
+            (bytes, bool): The encoded SNAPSHOT message and whether its part is the last one.
+
+        Raises:
+            OSError: If the image could not be written or read.
+        """
+        if self.failed:
+            raise OSError("The image could not be written.")
+        if self.handle is None:
+            self.handle = open(self.engine.filename, "rb")
+        part = self.handle.read(chunk_size)
+        last = self.handle.tell() >= os.fstat(self.handle.fileno()).st_size
+        message = encode_message(SNAPSHOT, self.offset, part, last, self.timestamp)
+        if last:
+            self.close()
+        return message, last
+
+    def close(self):
+        """
+        The method finishes or abandons the bootstrap. The image file is removed once it is written.
+        """
+        self.closed = True
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        if self.ready.is_set():
+            self._remove()
+
+    def _remove(self):
+        """
+        The method removes the image file.
+        """
+        try:
+            os.remove(self.engine.filename)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
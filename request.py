@@ -1,6 +1,9 @@
 class Request():
-    def __init__(self, request_type, key, value, query):
+    __slots__ = ("request_type", "key", "value", "query", "options")
+
+    def __init__(self, request_type, key, value, query, options=None):
         self.request_type = request_type
         self.key = key
         self.value = value
         self.query = query
+        self.options = options
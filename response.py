@@ -1,11 +1,16 @@
 class Response():
-    def __init__(self, success, message, data):
+    __slots__ = ("success", "message", "data", "cursor")
+
+    def __init__(self, success, message, data, cursor=None):
         self.success = success
         self.message = message
         self.data = data
+        self.cursor = cursor
 
     def __str__(self):
-        return f"Response(success={self.success}, message={self.message}, data={self.data})"
+        return self.__repr__()
 
     def __repr__(self):
+        if self.cursor is not None:
+            return f"Response(success={self.success}, message={self.message}, data={self.data}, cursor={self.cursor})"
         return f"Response(success={self.success}, message={self.message}, data={self.data})"
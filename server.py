@@ -1,33 +1,164 @@
 import socket
-import pickle
-import operator
+import selectors
+import threading
+import time
+import heapq
+import io
+import wal
+import replication
+import compression
+from snapshot import SnapshotEngine, load_snapshot
+from query import QueryCache, aggregate
+from index import KeyIndex, VALUE_INDEXES
+from memory import BoundedData, SpillStore
+from storage import SegmentStore, STORAGE_ENGINES, VALUE_CACHE_SIZE
+from metrics import Metrics, render_prometheus, resident_memory
+from subscription import SubscriptionRegistry, SUBSCRIBER_POLICIES, SUBSCRIBER_BUFFER_LIMIT
+from itertools import islice, count
+from collections import deque
+from concurrent.futures import Future
 from request import Request
 from response import Response
+from protocol import FrameReader, pack_frame
+from codec import decode_request, encode_request, encode_response
 from apscheduler.schedulers.background import BackgroundScheduler
 from configparser import ConfigParser
-from pyparsing import Keyword, Word, Literal, printables
+
+# The value indexes able to answer a value query, by query operator, in order of preference.
+VALUE_INDEXES_BY_OPERATOR = {
+    "=": ("hash", "sorted"),
+    "<": ("sorted",),
+    ">": ("sorted",),
+    "<=": ("sorted",),
+    ">=": ("sorted",),
+    "contains": ("ngram",),
+}
+
+# The longest time, in seconds, the event loop waits for a ready socket before doing its periodic work.
+TICK_INTERVAL = 0.1
+
+# The request types a replica refuses, since they change the data.
+WRITE_REQUEST_TYPES = (1, 2, 5, 6, 13, 15, 19, 20, 21, 22)
+
+# The number of bytes a replica may fall behind (unsent mutations) before the primary drops it. It then synchronizes again.
+REPLICA_BUFFER_LIMIT = 64 * 1024 * 1024
+
+# The number of seconds a replica waits before connecting again to its primary.
+SYNC_RETRY_INTERVAL = 1
 
 
 class Server():
     """
     This is a class for using and initializing a key-value pair database that can be accesed over the network.
     It communicates with the client using Request and Response objects sent and received via TCP Sockets.
-    It supports only one connection at a time.
+    Every message is sent as a frame holding its length and its request id, so the clients can pipeline requests.
+    The messages are encoded with the binary codec. Values of other types than the codec's are rejected; unpickling them can run arbitrary code, so it is opt-in with 'allow_pickle'.
+    It serves many connections at once by multiplexing non-blocking sockets over a selector based event loop.
 
     Functionalities:
         - Initializes a key-value pair database based on the given filename in the config file. (default filename: data)
         - Initializes a TCP Socket Server bound to the given host and port in the config file. (default hostname and port: 127.0.0.1:65535)
+        - Accepts up to 'backlog' pending connections (default: 128) and serves all the connected clients concurrently.
         - On initialization it reads the database file if it exists, else if there is no backup of the database, it will create a new one.
         - Read, add, delete, query for the database.
+        - Queries combine predicates with "and", "or", "not" and can project the matching entries ("count", "min", "max", "sum", "keys"),
+          computed in one pass over the data or an index so that only the result is sent back.
+        - Read, add, delete many entries at once, with a single request.
+        - Atomic read-modify-write operations, done by the server in one request: increment (or decrement) a number, append to a string or a list,
+          add an entry only if it does not exist, and replace a value only if it is equal to an expected one (compare and set).
+          They keep the entry's time to live.
+        - Entries can expire: a time to live can be given when adding them, or set, read and removed afterwards (expire, ttl, persist).
+          The expired entries are deleted before any request is handled and by the event loop, using a heap ordered by expiration time,
+          so the cost depends on the number of expiring entries, not on the size of the database. The expiration times are saved in the snapshots.
+        - Read queries can be streamed in pages through server-side cursors, which expire after 'timeout' seconds without a fetch.
+        - Optional value indexes (hash, sorted, n-gram), maintained on every mutation, answer the "=", range and "contains" value queries without a scan.
         - Creates a snapshot of the data (the key-value pair dictionary) at a given time based on the interval value from the config file. (default: every 60 mins)
+          The snapshot is written from a point-in-time view of the data (by a forked process), without blocking the requests, and atomically replaces the previous one.
+        - Records every mutation in a write-ahead log, replayed on startup after loading the snapshot.
+          The responses to mutations are sent only after the log is committed, once per event loop iteration (group commit).
+          Every snapshot rotates the log and discards the rotated records once the snapshot is written.
+        - Replication: a server whose config file names a 'primary' (host:port) is a read-only replica of it.
+          The replica receives an image of the primary's data, written off the event loop, then every mutation is pushed to it as it happens.
+          It serves the read requests and read queries, and reports its replication lag. It neither writes snapshots nor a write-ahead log.
+        - Storage engines: the "snapshot" engine (default) keeps the data in a dictionary, saved by the snapshots and the write-ahead log.
+          The "segment" engine keeps it in append-only segment files mapped in memory, with an index of the entries' locations (see storage.SegmentStore).
+          Its startup only loads the index, the values are decoded on their first access, and the compactor runs instead of the snapshots.
+          Its records are synced like the write-ahead log's, which it replaces. A replica always uses the "snapshot" engine's dictionary.
+        - Memory-bounded mode: with a memory 'limit' (bytes), the approximate memory used by every entry is tracked, and once the limit is exceeded
+          the victims of the eviction policy ("lru", "lfu" or "random") are evicted. They are deleted (like a cache) or, with 'spill' on, moved to a spill file,
+          from which they can still be read, queried and changed, and which a read request moves back to memory. The evictions are reported by the memory status.
+          A replica only spills: the deletions of its primary's evictions are replicated to it. The "segment" engine ignores the memory limit.
+        - Runtime metrics: the requests are counted by type, with their errors and a latency histogram of their handling (the wait for the write-ahead log commit excluded),
+          along with the traffic, the connections, the keys, the memory, the last snapshot and how the queries were answered. They are read with the stats request,
+          or, if a metrics 'port' is set, over HTTP in the Prometheus text format. The queries lasting at least 'slow_query_ms' are appended to the slow-query log.
+        - Compression: a client may negotiate the compression ("zlib" or "lzma") of its connection. The message fields (request fields, response data)
+          whose encoding reaches the compression 'threshold' are then compressed at the compression 'level', unless compression does not shrink them.
+          The snapshots can be compressed as a whole, and the "segment" engine's large values one by one ('storage' compression).
+          The compression ratio and the CPU time spent compressing and decompressing are reported by the stats request.
+        - Subscriptions: a connection can watch exact keys or the entries matching a read query, instead of polling.
+          Every change of a watched entry (added, changed, deleted, expired or evicted) is pushed to it after the write-ahead log commit,
+          as is the change of an entry that no longer matches a watched query ("unmatched"),
+          in frames carrying the subscribe request's id. A subscriber whose unsent bytes exceed the 'buffer_limit' is a slow consumer:
+          with the "drop" policy its new notifications are dropped, and it is told how many once it catches up,
+          with the "disconnect" policy its connection is closed. So a stuck subscriber never makes the server buffer without bound.
 
     Attributes:
         data (dict): The dictionary object that acts a database.
+        expires (dict): The expiration times (epoch seconds) of the expiring entries, by key.
+        expiry_heap (List): The heap of (expiration time, sequence number, key) tuples. Tuples whose time no longer matches 'expires' are skipped.
+        expiry_sequence (Iterator): The counter ordering the entries of the heap expiring at the same time.
         host (String): The host on which the server is bound.
         port (Int): The port on which the server is bound.
+        backlog (Int): The number of unaccepted connections the server socket allows before refusing new ones.
         filename (String): The database file name.
         snapshot_interval (Int): The interval on which the snapshot is created.
+        snapshot_method (String): How a point-in-time view of the data is taken, "fork" or "copy". (default: fork)
+        snapshot_engine (SnapshotEngine): The engine writing the snapshots and reporting their duration and size.
+        storage_engine (String): The storage engine, "snapshot" or "segment". (default: snapshot)
+        segment_size (Int): The capacity, in bytes, of a segment of the "segment" engine. (default: 64 MiB)
+        value_cache_size (Int): The maximum number of decoded values the "segment" engine keeps in memory. (default: 4096)
+        storage (SegmentStore): The segment store of the "segment" engine, or None.
+        allow_pickle (bool): Whether the clients may send pickled values. Only turn it on for trusted clients. (default: False)
+        wal_enabled (bool): Whether the mutations are recorded in the write-ahead log.
+        wal_filename (String): The write-ahead log file name. (default: the database file name followed by '.wal')
+        wal_fsync (String): The write-ahead log's fsync policy, "always", "interval" or "os". (default: interval)
+        wal_fsync_interval (Int): The interval, in milliseconds, of the "interval" fsync policy. (default: 100)
+        wal (WriteAheadLog): The write-ahead log, or None if it is disabled.
+        key_index (KeyIndex): The ordered index over the keys, used by the key range queries.
+        value_index_kinds (List): The value indexes built on startup, among "hash", "sorted" and "ngram". (default: none)
+        value_indexes (Dict): The value indexes, by kind, used by the value queries. They can be created and dropped at runtime.
+        query_cache_size (Int): The maximum number of compiled queries kept in the query cache. (default: 1024)
+        query_cache (QueryCache): The cache of compiled queries, counting its hits and misses.
+        cursor_timeout (Int): The default number of seconds a cursor is kept without being fetched. (default: 60)
+        cursors (Dict): The open cursors, by id.
+        last_cursor_id (Int): The id of the last opened cursor.
         server_socket: The server's TCP Socket.
+        selector: The selector used to multiplex the server's and the clients' sockets.
+        lock (RLock): The lock guarding the data against the background snapshot thread.
+        pending (Set): The connections with responses waiting for the next write-ahead log commit.
+        replication_primary (String): The primary's "host:port" if the server is a replica, else an empty string. (default: empty)
+        replicas (List): The connections of the replicas synchronized with this server.
+        replication_offset (Int): The number of mutations applied, counted since the primary started.
+        replication_link (Connection): A replica's connection to its primary, or None while it is disconnected.
+        replication_synchronized (bool): Whether the replica received a snapshot of the primary's data. Always True on a primary.
+        replication_timestamp (float): The primary's time (epoch seconds) of the last replication message received by the replica.
+        memory_limit (Int): The approximate number of bytes the entries may use in memory, or 0 for no limit. (default: 0)
+        memory_policy (String): The eviction policy, "lru", "lfu" or "random". (default: lru)
+        memory_spill (bool): Whether the evicted entries are spilled to disk instead of being deleted. (default: False)
+        spill_filename (String): The spill file name. (default: the database file name followed by '.spill')
+        spill_store (SpillStore): The store of the spilled entries, or None.
+        metrics (Metrics): The counters of the requests, the connections, the traffic and the queries.
+        metrics_port (Int): The port of the Prometheus text endpoint, bound to the server's host, or 0 to disable it. (default: 0)
+        slow_query_ms (float): The number of milliseconds from which a query is logged as slow, or 0 to log none. (default: 100)
+        slow_log_filename (String): The slow-query log file name, or an empty string to only keep the last slow queries in memory.
+                                    (default: the database file name followed by '.slow.log')
+        storage_compression (String): The compression of the snapshots and of the "segment" engine's values, "none", "zlib" or "lzma". (default: none)
+        wire_compression (bool): Whether the clients may negotiate the compression of their connection. (default: True)
+        compression_level (Int): The compression level, from 0 (fastest) to 9 (smallest). (default: 6)
+        compression_threshold (Int): The number of bytes from which an encoded value is compressed. (default: 1024)
+        subscriptions (SubscriptionRegistry): The connections' subscriptions.
+        subscriber_buffer_limit (Int): The number of unsent bytes from which a subscriber is a slow consumer. (default: 1 MiB)
+        subscriber_policy (String): The slow consumers' policy, "drop" or "disconnect". (default: drop)
 
     Tests:
     >>> Server()
@@ -37,13 +168,26 @@ class Server():
 
     """
 
-    def __init__(self):
+    def __init__(self, **settings):
         """
         The constructor for the database's server class.
+
+        Parameters:
+            settings: The attributes overriding the config file's values, e.g. port=65534.
         """
+        self.lock = threading.RLock()
+        self.loop_calls = deque()
         self._read_config()
+        for name, value in settings.items():
+            setattr(self, name, value)
         self._init_db()
-        self._schedule_snapshot()
+        self._init_query()
+        self._init_metrics()
+        self._init_subscriptions()
+        self._init_replication()
+        self._init_memory()
+        if not self.replication_primary:
+            self._schedule_snapshot()
         self._start_server()
         self._listen()
 
@@ -51,16 +195,145 @@ class Server():
         """
         The method tries to open the file with the given name and to add the containing data to the database.
         If there is no file or the data is corrupted it will initilize a new data object.
+        If the write-ahead log is enabled, the mutations recorded after the last snapshot are replayed.
+        With the "segment" engine, the segments are mapped and their index is loaded instead, without a write-ahead log.
+        With a memory limit, the entries exceeding it are evicted while they are loaded, so the data never needs more memory than the limit.
+        Then the ordered key index, the configured value indexes and the expiration heap are built over the loaded entries.
+        A replica starts empty, without a write-ahead log: its data is sent by its primary.
+
+        Raises:
+            ValueError: The storage engine does not exist.
         """
-        try:
-            with open(self.filename, 'rb') as handle:
-                self.data = pickle.loads(handle.read())
-        except IOError:
+        if self.storage_engine not in STORAGE_ENGINES:
+            raise ValueError(
+                f"Storage engine {self.storage_engine} does not exist.")
+        self.snapshot_engine = SnapshotEngine(
+            self.filename, self.snapshot_method, self.storage_compression, self.compression_level)
+        self.storage = None
+        if self.storage_engine == "segment" and not self.replication_primary:
+            compressor = None
+            if self.storage_compression != "none":
+                compressor = compression.Compressor(
+                    self.storage_compression, self.compression_level, self.compression_threshold)
+            self.storage = SegmentStore(
+                self.filename, self.segment_size, self.wal_fsync, self.wal_fsync_interval, compressor,
+                self.value_cache_size)
+            self.data, self.expires = self.storage.data, self.storage.expires
+        elif self.replication_primary:
+            self.data, self.expires = {}, {}
+        else:
             self.data = {}
+            self._init_memory()  # the entries exceeding the memory limit are evicted while they are loaded
+            self.data, self.expires = self.snapshot_engine.load(
+                self.data, lambda: self._evict(loading=True))
+
+        self.wal = None
+        if self.wal_enabled and not self.replication_primary and not self.storage:
+            self.wal = wal.WriteAheadLog(
+                self.wal_filename, self.wal_fsync, self.wal_fsync_interval)
+            for operation, key, value in self.wal.replay():
+                if operation == wal.SET:
+                    self.data[key] = value
+                    self.expires.pop(key, None)
+                    self._evict(loading=True)
+                elif operation == wal.DELETE:
+                    self.data.pop(key, None)
+                    self.expires.pop(key, None)
+                elif value is None:
+                    self.expires.pop(key, None)
+                elif key in self.data:
+                    self.expires[key] = value
+        if isinstance(self.data, BoundedData) and self.data.spill is None:  # the evicted entries were deleted
+            self.expires = {key: deadline for key, deadline in self.expires.items() if key in self.data}
+
+        self._init_expiry()
+        self.key_index = KeyIndex(self.data)
+        self.value_indexes = {kind: VALUE_INDEXES[kind](self.data.items())
+                              for kind in self.value_index_kinds}
+
+    def _init_query(self):
+        """
+        The method creates the query cache, the tables dispatching a query plan to its executor and action, and the cursors' table.
+        """
+        self.query_cache = QueryCache(self.query_cache_size)
+        self.query_elements = {
+            "key": self._execute_query_by_key,
+            "value": self._execute_query_by_value,
+            "compound": self._execute_compound_query,
+        }
+        self.query_actions = {
+            "read": None,
+            "delete": self._delete_from_query
+        }
+        self.cursors = {}
+        self.last_cursor_id = 0
+
+    def _init_metrics(self):
+        """
+        The method creates the metrics counting the requests, the connections, the traffic and the queries.
+        """
+        self.metrics = Metrics(self.slow_query_ms / 1000, self.slow_log_filename)
+
+    def _init_subscriptions(self):
+        """
+        The method creates the registry of the connections' subscriptions.
+
+        Raises:
+            ValueError: The slow consumers' policy does not exist.
+        """
+        if self.subscriber_policy not in SUBSCRIBER_POLICIES:
+            raise ValueError(
+                f"Subscriber policy {self.subscriber_policy} does not exist.")
+        self.subscriptions = SubscriptionRegistry()
+
+    def _init_expiry(self):
+        """
+        The method builds the expiration heap over the expiration times of the entries.
+        """
+        self.expiry_sequence = count()
+        self.expiry_heap = [(deadline, next(self.expiry_sequence), key)
+                            for key, deadline in self.expires.items()]
+        heapq.heapify(self.expiry_heap)
+
+    def _init_memory(self):
+        """
+        The method bounds the memory used by the data, if a memory limit is set, and evicts the entries exceeding it.
+        The spill file, if any, is emptied: the spilled entries are evicted again from the loaded data.
+        A data already bounded while it was loaded is kept.
+        """
+        self.spill_store = getattr(self, "spill_store", None)
+        if not self.memory_limit or self.storage:
+            return
+        if isinstance(self.data, BoundedData):
+            self._evict()
+            return
+        if self.spill_store is not None:
+            self.spill_store.close()
+            self.spill_store = None
+        if self.memory_spill:
+            self.spill_store = SpillStore(self.spill_filename)
+        self.data = BoundedData(
+            self.data, self.memory_limit, self.memory_policy, self.spill_store)
+        self._evict()
+
+    def _init_replication(self):
+        """
+        The method initializes the replication state, of a primary and of a replica.
+        """
+        self.replicas = []
+        self.replication_offset = 0
+        self.replication_link = None
+        self.replication_synchronized = not self.replication_primary
+        self.replication_timestamp = None
+        self.replication_snapshot = bytearray()
+        self.bootstrap_ids = count(1)
+        self.last_ping = 0
+        self.next_sync = 0
 
     def _start_server(self):
         """
         The method creates a socket bounded to the given host and port and listens for an incoming client connection.
+        It registers the socket in the selector multiplexing the server's and the clients' sockets.
 
         Raises:
             ConnectionError: Server could not be started.
@@ -68,43 +341,518 @@ class Server():
         try:
             self.server_socket = socket.socket(
                 socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(1)
+            self.server_socket.listen(self.backlog)
+            self.server_socket.setblocking(False)
             print(f"Started server on {self.host}:{self.port}")
         except:
             raise ConnectionError("Server could not be started.")
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(
+            self.server_socket, selectors.EVENT_READ, self._accept)
+        if self.metrics_port:
+            self._start_metrics_endpoint()
+
+    def _start_metrics_endpoint(self):
+        """
+        The method creates a socket bound to the host and the metrics port, serving the statistics in the Prometheus text format over HTTP.
+        It is registered in the same selector as the clients' sockets.
+
+        Raises:
+            ConnectionError: Metrics endpoint could not be started.
+        """
+        try:
+            self.metrics_socket = socket.socket(
+                socket.AF_INET, socket.SOCK_STREAM)
+            self.metrics_socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.metrics_socket.bind((self.host, self.metrics_port))
+            self.metrics_socket.listen(self.backlog)
+            self.metrics_socket.setblocking(False)
+            print(f"Serving metrics on http://{self.host}:{self.metrics_port}/metrics")
+        except:
+            raise ConnectionError("Metrics endpoint could not be started.")
+        self.selector.register(
+            self.metrics_socket, selectors.EVENT_READ, self._accept_metrics)
 
     def _listen(self):
         """
-        The method accepts the incoming client connection and permanently listens for any incoming request from the client.
-        When a request is received, it checks its type, calls the corresponding action and then sends back the response to the client.
-        When the client disconnects, it waits for other incoming client connections.
+        The method runs the server's event loop.
+        It waits until the server socket or any of the client sockets is ready and calls the callback registered for it.
         """
+        self.pending = set()
+
         while True:
-            # Starting the connection
-            client_socket, address = self.server_socket.accept()
-
-            while True:
-                request = client_socket.recv(1024)
-
-                if request:
-                    request = pickle.loads(request)
-
-                    request_types = {
-                        0: lambda: self._read(request.key),
-                        1: lambda: self._add(request.key, request.value),
-                        2: lambda: self._delete(request.key),
-                        3: lambda: self._query(request.query),
-                        4: lambda: self._send_error("Request type does not exist.")}
-                    response = request_types.get(request.request_type, 4)()
-                    response = pickle.dumps(response)
-                    client_socket.send(response)
-                else:  # client disconnected
-                    break
+            for key, mask in self.selector.select(TICK_INTERVAL):
+                key.data(key.fileobj, mask)
+            self._tick()
+
+    def _tick(self):
+        """
+        The method does the event loop's periodic work, after every wait for ready sockets.
+        It deletes the expired entries, commits the write-ahead log and then sends the responses and the replicated mutations that were waiting for the commit.
+        It also pings the replicas, sends the next part of their bootstrap images, connects a replica to its primary and closes the expired cursors.
+        First, it runs the calls other threads queued to be run by the event loop, see _call_on_loop().
+        """
+        while self.loop_calls:
+            function, future = self.loop_calls.popleft()
+            try:
+                future.set_result(function())
+            except BaseException as error:
+                future.set_exception(error)
+        now = time.monotonic()
+        if self.expiry_heap and self.expiry_heap[0][0] <= time.time():
+            with self.lock:
+                self._reap()
+        if self.wal:
+            with self.lock:
+                self.wal.commit()
+        if self.storage:
+            with self.lock:
+                self.storage.commit()
+        if self.replicas and now - self.last_ping >= TICK_INTERVAL:
+            self.last_ping = now
+            message = replication.encode_message(
+                replication.PING, self.replication_offset, timestamp=self.replication_timestamp)
+            for connection in list(self.replicas):
+                self._push(connection, message)
+        for connection in [connection for connection in self.replicas if connection.bootstrap is not None]:
+            self._send_bootstrap(connection)
+        pending, self.pending = self.pending, set()
+        for connection in pending:
+            self._flush(connection)
+
+        if self.replication_primary and self.replication_link is None and now >= self.next_sync:
+            self._connect_to_primary()
+        for cursor_id in [cursor_id for cursor_id, cursor in self.cursors.items() if cursor.deadline <= now]:
+            del self.cursors[cursor_id]
+
+    def _accept(self, server_socket, mask):
+        """
+        The method accepts an incoming client connection and registers it in the selector.
+
+        Parameters:
+            server_socket: The server's TCP Socket.
+            mask (Int): The events the socket is ready for.
+        """
+        try:
+            client_socket, address = server_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        client_socket.setblocking(False)
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = Connection(client_socket)
+        connection.client = True
+        self.metrics.connections += 1
+        self.metrics.connections_total += 1
+        self.selector.register(client_socket, selectors.EVENT_READ,
+                               lambda sock, mask: self._serve(connection, mask))
+
+    def _accept_metrics(self, metrics_socket, mask):
+        """
+        The method accepts an incoming connection to the metrics endpoint and registers it in the selector.
+
+        Parameters:
+            metrics_socket: The metrics endpoint's TCP Socket.
+            mask (Int): The events the socket is ready for.
+        """
+        try:
+            http_socket, address = metrics_socket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        http_socket.setblocking(False)
+        connection = Connection(http_socket)
+        received = bytearray()
+        self.selector.register(http_socket, selectors.EVENT_READ,
+                               lambda sock, mask: self._serve_metrics(connection, mask, received))
+
+    def _serve_metrics(self, connection, mask, received):
+        """
+        The method handles a ready connection to the metrics endpoint.
+        Once the HTTP request's header is received, it answers a GET request with the statistics in the Prometheus text format,
+        and any other request with an error. The connection is closed once the response is sent.
+
+        Parameters:
+            connection (Connection): The ready HTTP connection.
+            mask (Int): The events the socket is ready for.
+            received (bytearray): The bytes of the HTTP request received so far.
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                chunk = connection.socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                chunk = b""
+            if not chunk or len(received) + len(chunk) > 65536:
+                self._close(connection)
+                return
+            received += chunk
+            if b"\r\n\r\n" not in received and b"\n\n" not in received:
+                return
+
+            def respond(response):
+                if connection.closed:
+                    return
+                if received.startswith(b"GET "):
+                    body = render_prometheus(response.data).encode()
+                    status = "200 OK"
+                else:
+                    body = b"Only GET requests are served.\n"
+                    status = "405 Method Not Allowed"
+                connection.outgoing += (f"HTTP/1.0 {status}\r\n"
+                                        "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                                        f"Content-Length: {len(body)}\r\n"
+                                        "Connection: close\r\n\r\n").encode() + body
+                connection.events = selectors.EVENT_WRITE
+                self.selector.modify(connection.socket, selectors.EVENT_WRITE,
+                                     self.selector.get_key(connection.socket).data)
+
+            self._collect_stats(respond)
+            return
+
+        try:
+            sent = connection.socket.send(connection.outgoing)
+            del connection.outgoing[:sent]
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            connection.outgoing.clear()
+        if not connection.outgoing:
+            self._close(connection)
+
+    def _serve(self, connection, mask):
+        """
+        The method handles a ready client connection.
+        When requests are received, it dispatches them and queues the responses to be sent back after the next write-ahead log commit.
+        The responses are compressed as negotiated by the connection. Once the connection is closed, the rest of the received requests are dropped.
+        A request whose handling raises an error is answered with an error response.
+        When the queued responses can be written, it sends as much of them as the socket accepts.
+
+        Parameters:
+            connection (Connection): The ready client connection.
+            mask (Int): The events the socket is ready for.
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                received = connection.socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                received = None
+            except OSError:
+                received = b""
+
+            if received == b"":  # client disconnected
+                self._close(connection)
+                return
+            if received:
+                self.metrics.bytes_in += len(received)
+                try:
+                    frames = connection.reader.feed(received)
+                except ConnectionError:
+                    self._close(connection)
+                    return
+                for request_id, request in frames:
+                    if connection.closed:  # closed by a request of the batch, e.g. as a slow subscriber
+                        return
+                    try:
+                        request = decode_request(request, self.allow_pickle, connection.decompress)
+                    except:
+                        self.metrics.invalid_requests += 1
+                        response = self._send_error("Invalid request.")
+                    else:
+                        started = time.perf_counter()
+                        try:
+                            if request.request_type == 11:
+                                self._sync(connection, request_id)
+                                continue
+                            if request.request_type == 18:
+                                response = self._negotiate(connection, request.key, request.options)
+                            elif request.request_type == 23:
+                                response = self._subscribe(connection, request_id, request.key, request.query)
+                            elif request.request_type == 24:
+                                response = self._unsubscribe(connection, request.key)
+                            else:
+                                response = self._dispatch(request)
+                        except Exception:  # a failed request must not stop the event loop
+                            response = self._send_error("Request could not be handled.")
+                        self.metrics.record(request.request_type, time.perf_counter() - started,
+                                            response.success)
+                    connection.outgoing += pack_frame(
+                        request_id, encode_response(response, compressor=connection.compressor))
+                self.pending.add(connection)
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(connection)
+
+    def _flush(self, connection):
+        """
+        The method sends as much of the queued responses as the socket accepts.
+        If some of them are left, it waits for the socket to become writable.
+
+        Parameters:
+            connection (Connection): The client connection.
+        """
+        if connection.closed:
+            return
+        if connection.outgoing:
+            try:
+                sent = connection.socket.send(connection.outgoing)
+                del connection.outgoing[:sent]
+                if connection.client:
+                    self.metrics.bytes_out += sent
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError:
+                self._close(connection)
+                return
+
+        events = selectors.EVENT_READ
+        if connection.outgoing:
+            events |= selectors.EVENT_WRITE
+        if events != connection.events:
+            connection.events = events
+            self.selector.modify(connection.socket, events,
+                                 self.selector.get_key(connection.socket).data)
+
+    def _close(self, connection):
+        """
+        The method unregisters and closes a client connection.
+
+        Parameters:
+            connection (Connection): The client connection.
+        """
+        self.selector.unregister(connection.socket)
+        connection.socket.close()
+        connection.closed = True
+        if connection.client:
+            self.metrics.connections -= 1
+        self.pending.discard(connection)
+        if self.subscriptions:
+            self._drop_subscriptions(connection)
+        if connection in self.replicas:
+            self.replicas.remove(connection)
+        if connection.bootstrap is not None:
+            connection.bootstrap.close()
+        if connection is self.replication_link:
+            if not connection.outgoing:  # the sync request was sent, the connection was established
+                print("Disconnected from the primary")
+            self.replication_link = None
+            self.replication_snapshot = bytearray()
+            self.next_sync = time.monotonic() + SYNC_RETRY_INTERVAL
+
+    def _dispatch(self, request):
+        """
+        The method checks the request's type and calls the corresponding action.
+        The action is called while holding the lock, so it never interleaves with a snapshot.
+        A replica refuses the requests changing the data, and every request but the replication status until it is synchronized.
+        The expired entries are deleted first, so no request sees them.
+
+        Parameters:
+            request (Request): The received request.
+
+        Returns:
+            Response: The response of the called action.
+        """
+        request_types = {
+            0: lambda: self._read(request.key),
+            1: lambda: self._add(request.key, request.value, request.options),
+            2: lambda: self._delete(request.key),
+            3: lambda: self._query(request.query, request.options),
+            4: lambda: self._read_many(request.key),
+            5: lambda: self._add_many(request.value, request.options),
+            6: lambda: self._delete_many(request.key),
+            7: lambda: self._create_index(request.key),
+            8: lambda: self._drop_index(request.key),
+            9: lambda: self._fetch(request.key, request.options),
+            10: lambda: self._close_cursor(request.key),
+            12: lambda: self._replication_status(),
+            13: lambda: self._expire(request.key, request.value),
+            14: lambda: self._ttl(request.key),
+            15: lambda: self._persist(request.key),
+            16: lambda: self._memory_status(),
+            17: lambda: self._stats(),
+            19: lambda: self._incr(request.key, request.value),
+            20: lambda: self._append(request.key, request.value),
+            21: lambda: self._setnx(request.key, request.value, request.options),
+            22: lambda: self._compare_and_set(request.key, request.value, request.options),
+            25: lambda: Response(True, None, [])}  # a single server has no shards, it serves every key
+        action = request_types.get(
+            request.request_type, lambda: self._send_error("Request type does not exist."))
+        if self.replication_primary and request.request_type in WRITE_REQUEST_TYPES:
+            return self._send_error("Server is a read-only replica.")
+        if not self.replication_synchronized and request.request_type not in (12, 16, 17):
+            return self._send_error("Replica is not synchronized.")
+        with self.lock:
+            if self.expiry_heap and self.expiry_heap[0][0] <= time.time():
+                self._reap()
+            return action()
+
+    def _negotiate(self, connection, algorithm, options=None):
+        """
+        The method sets the compression of a client connection's messages. The following responses are compressed,
+        and the compressed fields of the following requests are accepted: before, they are rejected as invalid.
+
+        Parameters:
+            connection (Connection): The client connection.
+            algorithm (String): The compression algorithm, "zlib" or "lzma", or None to stop compressing.
+            options (dict): The options of the compression, or None:
+                "responses": Whether the responses are compressed, else only the requests are. (default: True)
+
+        Returns:
+            Response(success=True, message=None, data={...}): The compression, holding:
+                "compression": The algorithm, or None if the messages are not compressed.
+                "level": The compression level.
+                "threshold": The number of bytes from which an encoded value is compressed.
+            or
+            Response(success=False, message="Compression is disabled.", data=None): If the server does not compress its connections.
+            Response(success=False, message="Compression algorithm does not exist.", data=None): If the algorithm does not exist.
+            Response(success=False, message="Compression could not be set.", data=None): If the algorithm is not a string or the options not a dict.
+        """
+        if not (algorithm is None or isinstance(algorithm, str)) or not (options is None or isinstance(options, dict)):
+            return self._send_error("Compression could not be set.")
+        if algorithm is None:
+            connection.compressor = None
+            connection.decompress = False
+            return Response(True, None, {"compression": None, "level": None, "threshold": None})
+        if not self.wire_compression:
+            return self._send_error("Compression is disabled.")
+        if algorithm not in compression.ALGORITHMS:
+            return self._send_error("Compression algorithm does not exist.")
+        try:
+            compressor = compression.Compressor(
+                algorithm, self.compression_level, self.compression_threshold)
+        except:
+            return self._send_error("Compression could not be set.")
+        connection.compressor = compressor if (options or {}).get("responses", True) else None
+        connection.decompress = True
+        return Response(True, None, {"compression": algorithm, "level": self.compression_level,
+                                     "threshold": self.compression_threshold})
+
+    def _subscribe(self, connection, request_id, keys, query):
+        """
+        The method subscribes a connection to the changes of exact keys, or of the entries matching a read query.
+        The limit and the order of the query are ignored.
+
+        Parameters:
+            connection (Connection): The client connection.
+            request_id (Int): The id of the subscribe request, carried by the notifications' frames.
+            keys (List): The watched keys, or None if a query is watched.
+            query (String): The read query whose matching entries are watched, or None if keys are watched.
+
+        Returns:
+            Response(success=True, message=None, data=id): The subscription's id. It is followed by the notifications:
+                Response(success=True, message="set" or "delete", data=[(key, value)]): The entry's new value, or its value before it was deleted.
+                Response(success=False, message="Notifications were dropped.", data=count): The number of notifications dropped while the subscriber was too slow.
+            or
+            Response(success=False, message=Subscription needs keys or a query., data=[]): If neither or both were given.
+            Response(success=False, message=Invalid query syntax., data=[]): If the query is invalid, or is not a read query without projection.
+            Response(success=False, message=Connection is closed., data=[]): If the connection was closed, its subscriptions are never removed.
+        """
+        if connection.closed:
+            return self._send_error("Connection is closed.")
+        if (keys is None) == (query is None):
+            return self._send_error("Subscription needs keys or a query.")
+        try:
+            plan = None
+            if query is not None:
+                plan = self.query_cache.get(query)
+                if plan.action != "read" or plan.projection:
+                    raise ValueError(query)
+            subscription = self.subscriptions.add(connection, request_id, keys, plan)
+        except:
+            if query is None:
+                return self._send_error("Keys could not be watched.")
+            return self._send_error("Invalid query syntax.")
+        return Response(True, None, subscription.subscription_id)
+
+    def _unsubscribe(self, connection, subscription_id):
+        """
+        The method removes one of the connection's subscriptions. No notification of it is sent after the response.
+
+        Parameters:
+            connection (Connection): The client connection.
+            subscription_id (Int): The subscription's id.
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the subscription was removed.
+            Response(success=False, message=Subscription does not exist., data=[]): If the connection has no such subscription.
+        """
+        try:
+            if self.subscriptions.subscriptions[subscription_id].connection is not connection:
+                raise KeyError(subscription_id)
+        except:
+            return self._send_error("Subscription does not exist.")
+        self.subscriptions.remove(subscription_id)
+        return Response(True, None, [])
+
+    def _drop_subscriptions(self, connection):
+        """
+        The method removes the subscriptions of a closed connection.
+
+        Parameters:
+            connection (Connection): The closed connection.
+        """
+        self.subscriptions.remove_connection(connection)
+
+    def _notify(self, event, key, value, replaced=False, old_value=None):
+        """
+        The method pushes a change of an entry to the subscriptions watching it.
+        The query subscriptions whose query matched the replaced value, but not the new one, are pushed an "unmatched" change.
+
+        Parameters:
+            event (String): The change, "set" or "delete".
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The new value of the entry, or its value before it was deleted.
+            replaced (bool): Whether a set replaced the entry's value.
+            old_value (Any data type): The replaced value, if any.
+        """
+        for subscription in self.subscriptions.matching(key, value):
+            connection = subscription.connection
+            if not connection.closed:
+                self._deliver(subscription, encode_response(
+                    Response(True, event, [(key, value)]), compressor=connection.compressor))
+        if replaced:
+            for subscription in self.subscriptions.unmatched(key, old_value, value):
+                connection = subscription.connection
+                if not connection.closed:
+                    self._deliver(subscription, encode_response(
+                        Response(True, "unmatched", [(key, value)]), compressor=connection.compressor))
+
+    def _deliver(self, subscription, payload):
+        """
+        The method queues a notification to be sent to a subscriber after the next write-ahead log commit.
+        A slow consumer, whose unsent bytes exceed the buffer limit, gets the slow consumers' policy instead:
+        the notification is dropped and counted, or the connection is closed.
+        The count of the dropped notifications is sent before the next notification that fits.
+
+        Parameters:
+            subscription (Subscription): The subscription.
+            payload (bytes): The encoded notification.
+        """
+        connection = subscription.connection
+        if len(connection.outgoing) > self.subscriber_buffer_limit:
+            if self.subscriber_policy == "disconnect":
+                self.subscriptions.disconnected += 1
+                print("Disconnected a subscriber that fell too far behind")
+                self._close(connection)
+            else:
+                subscription.dropped += 1
+                self.subscriptions.dropped += 1
+            return
+        if subscription.dropped:
+            connection.outgoing += pack_frame(subscription.request_id, encode_response(
+                Response(False, "Notifications were dropped.", subscription.dropped)))
+            subscription.dropped = 0
+        connection.outgoing += pack_frame(subscription.request_id, payload)
+        self.subscriptions.notifications += 1
+        self.pending.add(connection)
 
     def _read(self, key):
         """
         The method reads an entry (Key-Value pair), from the database, based on the given key.
+        A spilled entry is moved back to memory.
 
         Parameters:
             key (Any hashable data type): The key of the entry.
@@ -114,25 +862,37 @@ class Server():
             Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
         """
         try:
-            return Response(True, None, [(key, self.data[key])])
+            if isinstance(self.data, BoundedData) and self.data.spill is not None:
+                value = self.data.load(key)
+                self._evict()
+            else:
+                value = self.data[key]
+            return Response(True, None, [(key, value)])
         except:
             return self._send_error("Entry does not exist.")
 
-    def _add(self, key, value):
+    def _add(self, key, value, options=None):
         """
         The method adds an entry (Key-Value pair) to the database.
+        Adding an entry removes its previous expiration time.
 
         Parameters:
             key (Any hashable data type): The key of the entry.
             value (Any data type): The value of the entry.
+            options (Dict): The optional "ttl" (number of seconds) after which the entry expires.
 
         Returns:
             Response(success=True, message=None, data=[(...)]): If the add action was succesful. Note: The data list will contain the added entry.
             Response(success=False, message=Entry could not be added., data=[]): If the add action was not succesful.
         """
         try:
-            self.data[key] = value
-            return Response(True, None, [(key, self.data[key])])
+            ttl = (options or {}).get("ttl")
+            if ttl is not None:
+                deadline = time.time() + ttl
+            self._set_entry(key, value)
+            if ttl is not None:
+                self._set_expiry(key, deadline)
+            return Response(True, None, [(key, value)])
         except:
             return self._send_error("Entry could not be added.")
 
@@ -148,219 +908,1320 @@ class Server():
             Response(success=False, message=Entry could not be deleted., data=[]): If the delete action was not succesful.
         """
         try:
-            del self.data[key]
+            self._remove_entry(key)
             return Response(True, None, [])
         except:
             return self._send_error("Entry could not be deleted.")
 
-    def _query(self, query):
+    def _read_many(self, keys):
         """
-        The method queries the database based on the given query.
+        The method reads the entries (Key-Value pairs), from the database, based on the given keys.
 
         Parameters:
-            query (String): The query string.
+            keys (List): The keys of the entries.
 
         Returns:
-            Response(success=True, message=None, data=[(...)]): If the query action was succesful. Note: The data list will contain the entries matching the query.
-            Response(success=False, message=Invalid query syntax., data=[]): If the query action was not succesful.
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the read action was succesful. Note: The data list will contain, for every key, a list with the read entry or an empty list if the entry does not exist.
+            Response(success=False, message=Entries could not be read., data=[]): If the keys are not a list.
         """
         try:
-            query = self._parse_query_string(query)
-
-            operators = {
-                ">": operator.gt,
-                "<": operator.lt,
-                "=": operator.eq,
-                "<=": operator.le,
-                ">=": operator.ge,
-                "contains": operator.contains,
-            }
-
-            query_elements = {
-                "key": self._execute_query_by_key,
-                "value": self._execute_query_by_value,
-            }
-
-            query_actions = {
-                "read": None,
-                "delete": self._delete_from_query
-            }
-
-            query_action = query_actions[query["action"]]
-            matches = query_elements[query["element"]](
-                query_action, query, operators)
-
-            return Response(True, None, matches)
+            results = []
+            for key in keys:
+                try:
+                    results.append([(key, self.data[key])])
+                except:
+                    results.append([])
+            return Response(True, None, results)
         except:
-            return self._send_error("Invalid query syntax.")
+            return self._send_error("Entries could not be read.")
 
-    def _parse_query_string(self, query):
+    def _add_many(self, entries, options=None):
         """
-        The method checks the format and parses the given query.
+        The method adds the entries (Key-Value pairs) to the database in one pass.
 
         Parameters:
-            query (String): The query string.
-                            Accepted formats: "[ACTION] [ELEMENT] [OPERATOR] [VALUE]" or "[ACTION] [ELEMENT] [OPERATOR] [DATATYPE] ( [VALUE] )"
-                            [ACTION] can be "read" or "delete"
-                            [ELEMENT] can be "value" or "key"
-                            [OPERATOR] can be "<", ">", "=", "<=", ">=", "contains"
-                            [DATATYPE] can be "int", "float", "complex", "str".
-                            [VALUE] is the value on which the query will be done.
-                            Examples: "read key > 1234"
-                                      "read value < int ( 4 )"
-                            Note: If no datatype is provided, the value will have the String data type by default.
+            entries (List): The (key, value) tuples of the entries.
+            options (Dict): The optional "ttl" (number of seconds) after which the entries expire.
 
         Returns:
-           query (List): A list containing the parsed query string.
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the add action was succesful. Note: The data list will contain, for every entry, a list with the added entry or an empty list if the entry could not be added.
+            Response(success=False, message=Entries could not be added., data=[]): If the entries are not a list.
         """
-        ACTION = Keyword("read")("action") | Keyword("delete")("action")
+        try:
+            ttl = (options or {}).get("ttl")
+            if ttl is not None:
+                deadline = time.time() + ttl
+            results = []
+            for entry in entries:
+                try:
+                    key, value = entry
+                    self._set_entry(key, value)
+                    if ttl is not None:
+                        self._set_expiry(key, deadline)
+                    results.append([(key, value)])
+                except:
+                    results.append([])
+            return Response(True, None, results)
+        except:
+            return self._send_error("Entries could not be added.")
 
-        ELEMENT = Keyword("key")("element") | Keyword("value")("element")
+    def _delete_many(self, keys):
+        """
+        The method deletes the entries (Key-Value pairs), from the database, based on the given keys in one pass.
 
-        OPERATOR = Keyword("<=")("operator") | Keyword(">=")("operator") | Keyword("<")("operator") | Keyword(">")("operator") | Keyword(
-            "=")("operator") | Keyword("contains")("operator")
+        Parameters:
+            keys (List): The keys of the entries that will be deleted.
 
-        VALUE = (Word(printables)("value_type") +
-                 "(" + Word(printables)("value") + ")") | Word(printables)("value")
+        Returns:
+            Response(success=True, message=None, data=[[(...)], [], ...]): If the delete action was succesful. Note: The data list will contain, for every key, a list with the deleted entry or an empty list if the entry could not be deleted.
+            Response(success=False, message=Entries could not be deleted., data=[]): If the keys are not a list.
+        """
+        try:
+            results = []
+            for key in keys:
+                try:
+                    results.append([(key, self._remove_entry(key))])
+                except:
+                    results.append([])
+            return Response(True, None, results)
+        except:
+            return self._send_error("Entries could not be deleted.")
 
-        SYNTAX = ACTION + ELEMENT + OPERATOR + VALUE
+    def _expire(self, key, seconds):
+        """
+        The method sets the time to live of an entry (Key-Value pair).
 
-        query = SYNTAX.parseString(query)
-        if "value_type" in query:
-            query["value"] = self._parse_value_to_type(
-                query["value"], query["value_type"])
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            seconds (int or float): The number of seconds after which the entry expires. If it is not positive, the entry expires at once.
 
-        return query
+        Returns:
+            Response(success=True, message=None, data=[]): If the time to live was set.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist or the number of seconds is not a number.
+        """
+        try:
+            deadline = time.time() + seconds
+            if key not in self.data:
+                raise KeyError(key)
+            self._set_expiry(key, deadline)
+            return Response(True, None, [])
+        except:
+            return self._send_error("Entry does not exist.")
 
-    def _parse_value_to_type(self, value, value_type):
+    def _ttl(self, key):
         """
-        The method casts the given value to the given type.
+        The method reads the remaining time to live of an entry (Key-Value pair).
 
         Parameters:
-            value (String): The value.
-            value_type (String): The type to which the value will be casted to.
+            key (Any hashable data type): The key of the entry.
 
         Returns:
-           The value casted to the given type.
+            Response(success=True, message=None, data=[(key, seconds)]): If the entry exists. Note: The number of seconds is None if the entry does not expire.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
         """
-        types = {
-            "int": int,
-            "float": float,
-            "complex": complex,
-            "str": str
-        }
-        return types[value_type](value)
+        try:
+            if key not in self.data:
+                raise KeyError(key)
+            deadline = self.expires.get(key)
+            if deadline is None:
+                return Response(True, None, [(key, None)])
+            return Response(True, None, [(key, max(0.0, deadline - time.time()))])
+        except:
+            return self._send_error("Entry does not exist.")
 
-    def _execute_query_by_value(self, query_action, query, operators):
+    def _persist(self, key):
         """
-        The method queries the database by value using the given query.
+        The method removes the time to live of an entry (Key-Value pair), so it no longer expires.
 
         Parameters:
-            query_action (Method): The query action that will be executed. Note: If the query action is "read" the parameter will be None, because the method reads the matching data in any case.
-            query (List): A list containing the parsed query string.
-            operators (Dict): A dictionary containing the operators that will be used.
+            key (Any hashable data type): The key of the entry.
 
         Returns:
-           A list containing all the entries that match the query.
+            Response(success=True, message=None, data=[]): If the entry exists.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
         """
-        matches = []
-        for key, value in self.data.copy().items():
-            try:
-                if operators[query["operator"]](value, query["value"]):
-                    matches.append((key, value))
-                    query_action(key)
-            except:
-                pass
-        return matches
+        try:
+            if key not in self.data:
+                raise KeyError(key)
+            if key in self.expires:
+                self._set_expiry(key, None)
+            return Response(True, None, [])
+        except:
+            return self._send_error("Entry does not exist.")
 
-    def _execute_query_by_key(self, query_action, query, operators):
+    def _incr(self, key, delta):
         """
-        The method queries the database by key using the given query.
-        Note: If the query operator is "=" the method will access the entry, using the key, right away.
+        The method atomically adds a number to the value of an entry (Key-Value pair). A missing entry is created with the number.
+        The entry keeps its time to live.
 
         Parameters:
-            query_action (Method): The query action that will be executed. Note: If the query action is "read" the parameter will be None, because the method reads the matching data in any case.
-            query (List): A list containing the parsed query string.
-            operators (Dict): A dictionary containing the operators that will be used.
+            key (Any hashable data type): The key of the entry.
+            delta (int or float): The number added to the value, negative to decrement it.
 
         Returns:
-           A list containing all the entries that match the query.
+            Response(success=True, message=None, data=[(key, value)]): If the value was changed. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value is not a number., data=[]): If the value or the number is not an int or a float.
         """
-        matches = []
-        if query["operator"] == "=":
-            try:
-                matches.append((query["value"], self.data[query["value"]]))
-                query_action(query["value"])
-            except:
-                pass
-            return matches
-        else:
-            for key, value in self.data.copy().items():
-                try:
-                    if operators[query["operator"]](key, query["value"]):
-                        matches.append((key, value))
-                        query_action(key)
-                except:
-                    pass
-        return matches
+        try:
+            value = self.data[key] if key in self.data else 0
+            if type(value) not in (int, float) or type(delta) not in (int, float):  # bools are not counted
+                return self._send_error("Value is not a number.")
+            value += delta
+            self._update_entry(key, value)
+            return Response(True, None, [(key, value)])
+        except:
+            return self._send_error("Entry could not be changed.")
 
-    def _delete_from_query(self, key):
+    def _append(self, key, value):
         """
-        The method deletes an entry from the database using the given key.
+        The method atomically appends to the value of an entry (Key-Value pair).
+        A string (or bytes) is appended to a string (or bytes) value, any other value is appended as an item to a list value.
+        A missing entry is created with the string, or with a list holding the item. The entry keeps its time to live.
+        The stored value is replaced by a new object, never changed in place, since a snapshot may still be reading it.
 
         Parameters:
-            key: The key of the database entry.
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The string or item that is appended.
+
+        Returns:
+            Response(success=True, message=None, data=[(key, value)]): If the value was changed. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value cannot be appended to., data=[]): If the value is not a list, or a string of the appended type.
         """
-        del self.data[key]
+        try:
+            if key not in self.data:
+                current = value if isinstance(value, (str, bytes)) else [value]
+            else:
+                current = self.data[key]
+                if isinstance(current, list):
+                    current = current + [value]
+                elif isinstance(current, (str, bytes)) and type(current) is type(value):
+                    current = current + value
+                else:
+                    return self._send_error("Value cannot be appended to.")
+            self._update_entry(key, current)
+            return Response(True, None, [(key, current)])
+        except:
+            return self._send_error("Entry could not be changed.")
 
-    def _send_error(self, description):
+    def _setnx(self, key, value, options=None):
         """
-        The method creates an error Response object based on the given description.
+        The method adds an entry (Key-Value pair) to the database only if it does not exist.
 
         Parameters:
-            description (String): The error's description.
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+            options (Dict): The optional "ttl" (number of seconds) after which the entry expires.
 
         Returns:
-            Response(False, "The given description", [])
+            Response(success=True, message=None, data=[(...)]): If the entry was added. Note: The data list will contain the added entry.
+            Response(success=False, message=Entry already exists., data=[]): If the entry exists.
+            Response(success=False, message=Entry could not be added., data=[]): If the add action was not succesful.
         """
-        return Response(False, description, [])
+        try:
+            if key in self.data:
+                return self._send_error("Entry already exists.")
+        except:
+            return self._send_error("Entry could not be added.")
+        return self._add(key, value, options)
 
-    def _create_snapshot(self):
+    def _compare_and_set(self, key, value, options):
         """
-        The method creates a snapshot (a backup) of the database.
+        The method atomically replaces the value of an entry (Key-Value pair) if it is equal to, and of the same type as, the expected value.
+        The entry keeps its time to live.
 
-        Raises:
-            PermissionError: Permission denied to write to file.
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The new value of the entry.
+            options (Dict): The "expected" value.
+
+        Returns:
+            Response(success=True, message=None, data=[(key, value)]): If the value was replaced. Note: The data list will contain the changed entry.
+            Response(success=False, message=Value does not match., data=[(key, current value)]): If the value is not the expected one.
+            Response(success=False, message=Entry does not exist., data=[]): If the entry does not exist.
         """
         try:
-            with open(self.filename, 'wb') as handle:
-                pickle.dump(self.data, handle)
+            if key not in self.data:
+                return self._send_error("Entry does not exist.")
+            current = self.data[key]
+            if type(current) is not type(options["expected"]) or current != options["expected"]:
+                return Response(False, "Value does not match.", [(key, current)])
+            self._update_entry(key, value)
+            return Response(True, None, [(key, value)])
         except:
-            raise PermissionError("Permission denied to write to file.")
+            return self._send_error("Entry could not be changed.")
 
-    def _schedule_snapshot(self):
-        """
-        The method creates a background thread that will call the _create_snapshot() method at a given time interval.
+    def _query(self, query, options=None):
         """
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(self._create_snapshot, 'interval',
-                          minutes=self.snapshot_interval)
-        scheduler.start()
+        The method queries the database based on the given query.
+        The query plan is looked up in the query cache, so a repeated query is not parsed again.
+        If a page size is given for a read query, only the first page of the matching entries is read and a cursor is opened for the next ones.
+        A projection ("count", "min", "max", "sum", "keys") is computed in one pass over the matching entries, and only its result is sent back.
+        The queries lasting at least 'slow_query_ms' milliseconds are recorded in the slow-query log.
 
-    def _read_config(self):
-        """
-        The method reads the data from the config file.
-        If there is no 'config.ini' file or it is corrupted, it will assign the default values.
+        Parameters:
+            query (String): The query string.
+            options (Dict): The optional "page_size" (Int) and "timeout" (Int, seconds) of the cursor.
+
+        Returns:
+            Response(success=True, message=None, data=[(...)]): If the query action was succesful. Note: The data list will contain the entries matching the query.
+            Response(success=True, message=None, data=[(...)], cursor=...): If a page size was given and more entries may match. Note: The cursor is the id used to fetch the next page.
+            Response(success=True, message=None, data=...): If the projection was succesful. Note: The data will be the projection's result.
+            Response(success=False, message=Invalid query syntax., data=[]): If the query action was not succesful.
+            Response(success=False, message=Projections are not paged., data=[]): If a page size was given for a projection.
+            Response(success=False, message=Values cannot be aggregated., data=[]): If the values of the matching entries cannot be compared or added.
         """
+        started = time.perf_counter()
         try:
-            config = ConfigParser()
+            plan = self.query_cache.get(query)
+            if plan.action == "delete" and self.replication_primary:
+                return self._send_error("Server is a read-only replica.")
+            if plan.projection:
+                if options and options.get("page_size"):
+                    return self._send_error("Projections are not paged.")
+                response = self._aggregate(plan)
+            elif options and options.get("page_size") and plan.action == "read":
+                response = self._open_cursor(plan, options["page_size"], options.get("timeout"))
+            else:
+                query_action = self.query_actions[plan.action]
+                matches = self.query_elements[plan.element](query_action, plan)
+                response = Response(True, None, matches)
+        except:
+            return self._send_error("Invalid query syntax.")
+        self.metrics.record_query(query, time.perf_counter() - started,
+                                  len(response.data) if isinstance(response.data, list) else None)
+        return response
+
+    def _aggregate(self, plan):
+        """
+        The method projects the entries matching the query plan, streamed without building their list. See query.aggregate().
+
+        Parameters:
+            plan (QueryPlan): The compiled query, with a projection.
+
+        Returns:
+            Response(success=True, message=None, data=...): The projection's result.
+            Response(success=False, message=Values cannot be aggregated., data=[]): If the values cannot be compared or added.
+        """
+        try:
+            return Response(True, None, aggregate(plan.projection, islice(self._stream(plan), plan.limit)))
+        except TypeError:
+            return self._send_error("Values cannot be aggregated.")
+
+    def _open_cursor(self, plan, page_size, timeout):
+        """
+        The method opens a cursor over the entries matching the query plan and reads its first page.
+
+        Parameters:
+            plan (QueryPlan): The compiled read query.
+            page_size (Int): The number of entries of a page.
+            timeout (Int): The number of seconds the cursor is kept without being fetched, or None for the default timeout.
+
+        Returns:
+            Response(success=True, message=None, data=[(...)], cursor=...): The first page and the cursor's id, or no cursor if there are no more pages.
+        """
+        self.last_cursor_id += 1
+        cursor = Cursor(islice(self._stream(plan), plan.limit),
+                        page_size, timeout or self.cursor_timeout)
+        self.cursors[self.last_cursor_id] = cursor
+        return self._fetch(self.last_cursor_id)
+
+    def _fetch(self, cursor_id, options=None):
+        """
+        The method reads the next page of a cursor.
+        When the cursor has no more entries, it is closed.
+
+        Parameters:
+            cursor_id (Int): The cursor's id.
+            options (Dict): The optional "page_size" (Int) of this page.
+
+        Returns:
+            Response(success=True, message=None, data=[(...)], cursor=...): The page and the cursor's id, or no cursor if there are no more pages.
+            Response(success=False, message=Cursor does not exist., data=[]): If the cursor does not exist or has expired.
+        """
+        try:
+            cursor = self.cursors[cursor_id]
+            page_size = (options or {}).get("page_size") or cursor.page_size
+            page = list(islice(cursor.entries, page_size))
+        except:
+            return self._send_error("Cursor does not exist.")
+        if len(page) < page_size:
+            del self.cursors[cursor_id]
+            return Response(True, None, page)
+        cursor.deadline = time.monotonic() + cursor.timeout
+        return Response(True, None, page, cursor_id)
+
+    def _close_cursor(self, cursor_id):
+        """
+        The method closes a cursor before all its pages are read.
+
+        Parameters:
+            cursor_id (Int): The cursor's id.
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the cursor was closed.
+            Response(success=False, message=Cursor does not exist., data=[]): If the cursor does not exist or has expired.
+        """
+        try:
+            del self.cursors[cursor_id]
+            return Response(True, None, [])
+        except:
+            return self._send_error("Cursor does not exist.")
+
+    def _peek(self, key):
+        """
+        The method reads the value of an entry for a query, without counting it as an access to the entry:
+        a query scanning many entries must not change which ones the eviction policy keeps in memory.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        if isinstance(self.data, BoundedData):
+            return self.data.peek(key)
+        return self.data[key]
+
+    def _stream(self, plan):
+        """
+        The method lazily iterates over the entries matching the query plan, reading the keys from the indexes.
+        The entries are read when they are reached, so the database can be changed while the iteration is suspended.
+        Note: Without an index able to answer the query, the keys are iterated by the key index, ordered by key within every data type.
+              The entries compared by such a scan are counted in the metrics as they are reached.
+
+        Parameters:
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+            Generator: The (key, value) tuples of the matching entries.
+        """
+        keys = self._candidates(plan)
+        scanning = keys is None
+        if scanning:
+            self.metrics.scans += 1
+            keys = self.key_index.keys(plan.reverse)
+        else:
+            self.metrics.indexed_queries += 1
+
+        match = plan.match
+        metrics = self.metrics
+        for key in keys:
+            if scanning:
+                metrics.scanned_entries += 1
+            try:
+                value = self._peek(key)
+                matched = match(key, value)
+            except:
+                continue
+            if matched:
+                yield (key, value)
+
+    def _candidates(self, plan):
+        """
+        The method reads the candidate keys of the query plan from the indexes, using the first of its driving predicates an index can answer.
+        A key "=" predicate is answered by its key, a key range by the key index and a value predicate by a value index.
+        The candidates are a superset of the matching keys, every one of them must still be checked.
+
+        Parameters:
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+            Iterable: The candidate keys, or None if the database must be scanned.
+        """
+        for predicate in plan.drivers:
+            if predicate.element == "key":
+                if predicate.operator_name == "=":
+                    return [predicate.value]
+                keys = self.key_index.range(
+                    predicate.operator_name, predicate.value, plan.reverse)
+                if keys is not None:
+                    return keys
+            else:
+                for kind in VALUE_INDEXES_BY_OPERATOR[predicate.operator_name]:
+                    index = self.value_indexes.get(kind)
+                    if index is not None:
+                        keys = index.candidates(
+                            predicate.operator_name, predicate.value, plan.reverse)
+                        if keys is not None:
+                            return keys
+        return None
+
+    def _execute_query_by_value(self, query_action, plan):
+        """
+        The method queries the database by value using the given query plan.
+        Note: If a value index able to answer the query operator exists, the method reads the matching keys from the index, else it scans the database.
+
+        Parameters:
+            query_action (Method): The query action that will be executed. Note: If the query action is "read" the parameter will be None, because the method reads the matching data in any case.
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+           A list containing all the entries that match the query.
+        """
+        keys = None
+        for kind in VALUE_INDEXES_BY_OPERATOR[plan.operator_name]:
+            index = self.value_indexes.get(kind)
+            if index is not None:
+                keys = index.candidates(
+                    plan.operator_name, plan.value, plan.reverse)
+                if keys is not None:
+                    break
+
+        if keys is None:
+            matches = self._scan(plan)
+        else:
+            self.metrics.indexed_queries += 1
+            matches = []
+            for key in keys:
+                if len(matches) == plan.limit:
+                    break
+                try:
+                    value = self._peek(key)
+                except KeyError:  # an indexed key that is no longer stored is skipped
+                    continue
+                try:
+                    if index.exact or plan.operator(value, plan.value):
+                        matches.append((key, value))
+                except:
+                    pass
+        if query_action:
+            for key, value in matches:
+                query_action(key)
+        return matches
+
+    def _execute_query_by_key(self, query_action, plan):
+        """
+        The method queries the database by key using the given query plan.
+        Note: If the query operator is "=" the method will access the entry, using the key, right away.
+              If the query operator is "<", ">", "<=" or ">=", the method reads the matching keys, in order, from the key index.
+
+        Parameters:
+            query_action (Method): The query action that will be executed. Note: If the query action is "read" the parameter will be None, because the method reads the matching data in any case.
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+           A list containing all the entries that match the query.
+        """
+        matches = []
+        keys = self.key_index.range(plan.operator_name, plan.value, plan.reverse)
+        if plan.operator_name == "=":
+            self.metrics.indexed_queries += 1
+            try:
+                if plan.limit != 0:
+                    matches.append((plan.value, self._peek(plan.value)))
+            except:
+                pass
+        elif keys is not None:
+            self.metrics.indexed_queries += 1
+            for key in keys:
+                if len(matches) == plan.limit:
+                    break
+                try:
+                    matches.append((key, self._peek(key)))
+                except KeyError:  # an indexed key that is no longer stored is skipped
+                    continue
+        else:
+            matches = self._scan(plan)
+        if query_action:
+            for key, value in matches:
+                query_action(key)
+        return matches
+
+    def _execute_compound_query(self, query_action, plan):
+        """
+        The method queries the database using the given compound query plan ("and", "or", "not").
+        Note: If an index can answer one of the predicates every matching entry satisfies, the method checks only its candidates, else it scans the database.
+
+        Parameters:
+            query_action (Method): The query action that will be executed. Note: If the query action is "read" the parameter will be None, because the method reads the matching data in any case.
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+           A list containing all the entries that match the query.
+        """
+        keys = self._candidates(plan)
+        if keys is None:
+            matches = self._scan(plan)
+        else:
+            self.metrics.indexed_queries += 1
+            matches = []
+            match = plan.match
+            for key in keys:
+                if len(matches) == plan.limit:
+                    break
+                try:
+                    value = self._peek(key)
+                except:
+                    continue
+                if match(key, value):
+                    matches.append((key, value))
+        if query_action:
+            for key, value in matches:
+                query_action(key)
+        return matches
+
+    def _scan(self, plan):
+        """
+        The method scans the whole database for the entries matching the query plan. The scan and the compared entries are counted in the metrics.
+        Note: Without "reverse", the entries are scanned in insertion order, else in reverse insertion order.
+
+        Parameters:
+            plan (QueryPlan): The compiled query.
+
+        Returns:
+           A list containing at most 'limit' entries that match the query.
+        """
+        matches = []
+        if plan.limit == 0:
+            return matches
+        match = plan.match
+        items = reversed(self.data.items()) if plan.reverse else self.data.items()
+        scanned = 0
+        for key, value in items:
+            scanned += 1
+            try:
+                if match(key, value):
+                    matches.append((key, value))
+                    if len(matches) == plan.limit:
+                        break
+            except:
+                pass
+        self.metrics.scans += 1
+        self.metrics.scanned_entries += scanned
+        return matches
+
+    def _create_index(self, kind):
+        """
+        The method creates a value index and builds it over the whole database.
+
+        Parameters:
+            kind (String): The kind of the index, "hash", "sorted" or "ngram".
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the index was created or already exists.
+            Response(success=False, message=Index kind does not exist., data=[]): If the index kind does not exist.
+        """
+        try:
+            if kind not in self.value_indexes:
+                self.value_indexes[kind] = VALUE_INDEXES[kind](
+                    self.data.items())
+            return Response(True, None, [])
+        except:
+            return self._send_error("Index kind does not exist.")
+
+    def _drop_index(self, kind):
+        """
+        The method drops a value index.
+
+        Parameters:
+            kind (String): The kind of the index, "hash", "sorted" or "ngram".
+
+        Returns:
+            Response(success=True, message=None, data=[]): If the index was dropped.
+            Response(success=False, message=Index does not exist., data=[]): If there is no index of the given kind.
+        """
+        try:
+            del self.value_indexes[kind]
+            return Response(True, None, [])
+        except:
+            return self._send_error("Index does not exist.")
+
+    def _delete_from_query(self, key):
+        """
+        The method deletes an entry from the database using the given key.
+
+        Parameters:
+            key: The key of the database entry.
+        """
+        self._remove_entry(key)
+
+    def _set_entry(self, key, value):
+        """
+        The method stores an entry in the database, records the mutation in the write-ahead log and pushes it to the replicas.
+        Every mutation of the data goes through this method or _remove_entry(). The entry's expiration time is removed.
+        If the memory limit is exceeded, entries are evicted.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        exists = key in self.data
+        replaced = exists and bool(self.subscriptions.queries)
+        old_value = None
+        if exists and (self.value_indexes or replaced):  # the previous value is only read if it must be unindexed or matched
+            old_value = self.data[key]
+        self.data[key] = value  # stored before it is indexed, so a failing store leaves the indexes unchanged
+        if exists:
+            for index in self.value_indexes.values():
+                index.discard(key, old_value)
+            self.expires.pop(key, None)
+        else:
+            self.key_index.add(key)
+        for index in self.value_indexes.values():
+            index.add(key, value)
+        if self.wal:
+            self.wal.append(wal.SET, key, value)
+        self._replicate(wal.SET, key, value)
+        if self.subscriptions:
+            self._notify("set", key, value, replaced, old_value)
+        if isinstance(self.data, BoundedData) and self.data.used > self.data.limit:
+            self._evict()
+
+    def _update_entry(self, key, value):
+        """
+        The method stores a new value of an entry, keeping its expiration time. See _set_entry().
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+        """
+        deadline = self.expires.get(key)
+        self._set_entry(key, value)
+        if deadline is not None:
+            self._set_expiry(key, deadline)
+
+    def _remove_entry(self, key):
+        """
+        The method removes an entry from the database, records the mutation in the write-ahead log and pushes it to the replicas.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+
+        Returns:
+            The value of the removed entry.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        value = self.data.pop(key)
+        self.expires.pop(key, None)
+        self.key_index.discard(key)
+        for index in self.value_indexes.values():
+            index.discard(key, value)
+        if self.wal:
+            self.wal.append(wal.DELETE, key)
+        self._replicate(wal.DELETE, key)
+        if self.subscriptions:
+            self._notify("delete", key, value)
+        return value
+
+    def _set_expiry(self, key, deadline):
+        """
+        The method sets or removes the expiration time of an existing entry, records it in the write-ahead log and pushes it to the replicas.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            deadline (float): The expiration time (epoch seconds), or None if the entry no longer expires.
+        """
+        if deadline is None:
+            del self.expires[key]
+        else:
+            self.expires[key] = deadline
+            heapq.heappush(self.expiry_heap,
+                           (deadline, next(self.expiry_sequence), key))
+            if len(self.expiry_heap) > 2 * len(self.expires) + 1024:  # drops the outdated tuples
+                self._init_expiry()
+        if self.storage:
+            self.storage.expire(key, deadline)
+        if self.wal:
+            self.wal.append(wal.EXPIRE, key, deadline)
+        self._replicate(wal.EXPIRE, key, deadline)
+
+    def _reap(self):
+        """
+        The method deletes the expired entries, popping the expiration heap up to the first entry that has not expired.
+        A replica does not delete its expired entries itself: the primary's deletions are replicated to it.
+        """
+        if self.replication_primary:
+            return
+        now = time.time()
+        heap = self.expiry_heap
+        while heap and heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(heap)
+            if self.expires.get(key) == deadline:
+                self._remove_entry(key)
+
+    def _evict(self, loading=False):
+        """
+        The method evicts the victims of the eviction policy until the entries kept in memory no longer exceed the memory limit.
+        They are spilled to disk or, without a spill store, deleted like by a delete request.
+        A replica does not delete entries itself: the primary's evictions are replicated to it.
+
+        Parameters:
+            loading (bool): Whether the data is being loaded, before the indexes are built and the write-ahead log is open:
+                            the deleted entries are then only removed from the data. Nothing is evicted if the data is not bounded.
+        """
+        data = self.data
+        if not isinstance(data, BoundedData) or data.spill is None and self.replication_primary:
+            return
+        while data.used > data.limit and data.entries:
+            key = data.policy.victim()
+            if data.spill is not None:
+                data.spill_entry(key)
+            elif loading:
+                data.pop(key)
+            else:
+                self._remove_entry(key)
+            data.evictions += 1
+
+    def _memory_status(self):
+        """
+        The method reports the memory used by the entries and the evictions.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The status, holding:
+                "limit": The memory limit, in bytes, or 0 if there is none (or the "segment" engine ignores it).
+                "used": The approximate number of bytes used by the entries kept in memory, or None if there is no limit.
+                "policy": The eviction policy, or None if there is no limit.
+                "entries": The number of entries kept in memory.
+                "spilled": The number of entries spilled to disk.
+                "evictions": The number of evicted entries, deleted or spilled.
+                "loads": The number of spilled entries moved back to memory.
+        """
+        if not isinstance(self.data, BoundedData):
+            return Response(True, None, {
+                "limit": 0, "used": None, "policy": None, "entries": len(self.data),
+                "spilled": 0, "evictions": 0, "loads": 0})
+        return Response(True, None, {
+            "limit": self.memory_limit,
+            "used": self.data.used,
+            "policy": self.data.policy_name,
+            "entries": len(self.data.entries),
+            "spilled": len(self.data.spill) if self.data.spill is not None else 0,
+            "evictions": self.data.evictions,
+            "loads": self.data.loads,
+        })
+
+    def _stats(self):
+        """
+        The method reports the server's runtime statistics, to find its hot spots.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The statistics, holding:
+                "uptime", "requests", "invalid_requests", "connections", "traffic", "memory" and "slow_queries": See _process_stats().
+                "keys": The number of entries.
+                "expiring": The number of entries with a time to live.
+                "cursors": The number of open cursors.
+                "memory": Also holds "entries", the approximate number of bytes used by the entries kept in memory, or None if there is no memory limit.
+                "snapshot": The "last_duration" (seconds), "last_size" and "last_raw_size" (bytes, before compression)
+                            and "last_time" (epoch seconds) of the last snapshot, None before the first one.
+                "queries": The number of full "scans", of "scanned_entries", of "indexed" queries answered from an index,
+                           of query cache "cache_hits" and "cache_misses", and of "slow" queries.
+        """
+        stats = self._process_stats()
+        stats["memory"]["entries"] = self.data.used if isinstance(
+            self.data, BoundedData) else None
+        stats.update({
+            "keys": len(self.data),
+            "expiring": len(self.expires),
+            "cursors": len(self.cursors),
+            "snapshot": {
+                "last_duration": self.snapshot_engine.last_duration,
+                "last_size": self.snapshot_engine.last_size,
+                "last_raw_size": self.snapshot_engine.last_raw_size,
+                "last_time": self.snapshot_engine.last_time,
+            },
+            "queries": {
+                "scans": self.metrics.scans,
+                "scanned_entries": self.metrics.scanned_entries,
+                "indexed": self.metrics.indexed_queries,
+                "cache_hits": self.query_cache.hits,
+                "cache_misses": self.query_cache.misses,
+                "slow": self.metrics.slow_query_count,
+            },
+        })
+        return Response(True, None, stats)
+
+    def _process_stats(self):
+        """
+        The method reports the statistics of the server's process, which do not depend on its data.
+
+        Returns:
+            dict: The statistics, holding:
+                "uptime": The number of seconds since the server started.
+                "requests": The "count", "errors", "latency_sum", "p50", "p99", "max" and "buckets" of every handled request type, by name.
+                            The latencies (seconds) are estimated from histograms. See metrics.Metrics.report_requests().
+                "invalid_requests": The number of requests that could not be decoded.
+                "connections": The number of "active" client connections and of "accepted" ones.
+                "traffic": The number of bytes received from ("bytes_in") and sent to ("bytes_out") the clients.
+                "memory": The resident memory of the process ("rss", bytes), or None where it cannot be read.
+                "slow_queries": The last slow queries, with their "time", "duration" (seconds), "query" and "matches".
+                "compression": The number of compressed "values", their "raw_bytes" and "compressed_bytes", their "ratio",
+                               the number of "incompressible" values, the "compress_seconds" (CPU time), the number of
+                               "decompressed_values" and the "decompress_seconds". See compression.CompressionStats.
+                "subscriptions": The number of "subscriptions", of sent "notifications", of "dropped" ones and of "disconnected" slow consumers.
+        """
+        return {
+            "uptime": time.time() - self.metrics.started,
+            "requests": self.metrics.report_requests(),
+            "invalid_requests": self.metrics.invalid_requests,
+            "connections": {
+                "active": self.metrics.connections,
+                "accepted": self.metrics.connections_total,
+            },
+            "traffic": {
+                "bytes_in": self.metrics.bytes_in,
+                "bytes_out": self.metrics.bytes_out,
+            },
+            "memory": {"rss": resident_memory()},
+            "slow_queries": list(self.metrics.slow_queries),
+            "compression": compression.STATS.report(),
+            "subscriptions": self.subscriptions.report(),
+        }
+
+    def _collect_stats(self, reply):
+        """
+        The method reads the statistics for the metrics endpoint.
+
+        Parameters:
+            reply (Function): The function called with the statistics' Response.
+        """
+        with self.lock:
+            reply(self._stats())
+
+    def _replicate(self, operation, key, value=None):
+        """
+        The method counts a mutation in the replication offset and pushes it to the replicas.
+        The mutation is sent after the next write-ahead log commit, with the responses.
+
+        Parameters:
+            operation (int): The mutation, wal.SET, wal.DELETE or wal.EXPIRE.
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry, for a wal.SET mutation, or its expiration time, for a wal.EXPIRE mutation.
+        """
+        self.replication_offset += 1
+        if self.replicas:
+            message = replication.encode_message(
+                operation, self.replication_offset, key, value, self.replication_timestamp)
+            for connection in list(self.replicas):
+                self._push(connection, message)
+
+    def _push(self, connection, message):
+        """
+        The method queues a replication message to be sent to a replica, or holds it until the replica's bootstrap image is sent.
+        A replica too far behind is disconnected, it will synchronize again.
+
+        Parameters:
+            connection (Connection): The replica's connection.
+            message (bytes): The encoded replication message.
+        """
+        frame = pack_frame(connection.replication_id, message)
+        if connection.bootstrap is not None:
+            connection.bootstrap.held += frame
+            unsent = len(connection.bootstrap.held)
+        else:
+            connection.outgoing += frame
+            unsent = len(connection.outgoing)
+        if unsent > connection.buffer_limit:
+            print("Disconnected a replica that fell too far behind")
+            self._close(connection)
+        elif connection.bootstrap is None:
+            self.pending.add(connection)
+
+    def _sync(self, connection, request_id):
+        """
+        The method turns a client connection into a replica's: it sends it an image of the data, then every mutation is pushed to it.
+        The image is captured by a snapshot engine at the current replication offset, so it is written off the event loop (see replication.Bootstrap),
+        and it is sent in parts by _send_bootstrap(). The mutations pushed meanwhile are held until it is sent.
+        The replication messages are sent as responses to the sync request.
+
+        Parameters:
+            connection (Connection): The replica's connection.
+            request_id (Int): The id of the sync request.
+        """
+        engine = SnapshotEngine(
+            f"{self.filename}.sync.{next(self.bootstrap_ids)}", self.snapshot_method)
+        with self.lock:
+            capture = engine.capture(self.data, self.expires)
+            connection.bootstrap = replication.Bootstrap(
+                engine, capture, self.replication_offset)
+        connection.replication_id = request_id
+        connection.buffer_limit = REPLICA_BUFFER_LIMIT
+        self.replicas.append(connection)
+        print("Synchronizing a replica")
+
+    def _send_bootstrap(self, connection):
+        """
+        The method queues the next part of a replica's bootstrap image, once the image is written and the previous part is mostly sent.
+        After the last part, the held messages are queued and the replica is pushed the mutations like the synchronized ones.
+        A replica whose image could not be written or read is disconnected, it will synchronize again.
+
+        Parameters:
+            connection (Connection): The replica's connection.
+        """
+        bootstrap = connection.bootstrap
+        if not bootstrap.ready.is_set() or len(connection.outgoing) >= replication.CHUNK_SIZE:
+            return
+        try:
+            message, last = bootstrap.next_message()
+        except OSError:
+            print("Could not send the data to a replica")
+            self._close(connection)
+            return
+        connection.outgoing += pack_frame(connection.replication_id, message)
+        if last:
+            connection.outgoing += bootstrap.held
+            connection.bootstrap = None
+            connection.buffer_limit = len(
+                connection.outgoing) + REPLICA_BUFFER_LIMIT
+            print(f"Sent the data to a replica at offset {bootstrap.offset}")
+        self.pending.add(connection)
+
+    def _connect_to_primary(self):
+        """
+        The method starts connecting a replica to its primary and queues the sync request.
+        If the connection fails, it is retried after SYNC_RETRY_INTERVAL seconds.
+        """
+        self.next_sync = time.monotonic() + SYNC_RETRY_INTERVAL
+        try:
+            host, port = self.replication_primary.rsplit(":", 1)
+            link_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            link_socket.setblocking(False)
+            link_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            link_socket.connect_ex((host, int(port)))
+        except:
+            return
+        link = Connection(link_socket)
+        link.outgoing += pack_frame(1, encode_request(
+            Request(11, None, None, None)))
+        link.events = selectors.EVENT_WRITE
+        self.replication_link = link
+        self.selector.register(link_socket, selectors.EVENT_WRITE,
+                               lambda sock, mask: self._serve_primary(link, mask))
+
+    def _serve_primary(self, link, mask):
+        """
+        The method handles a replica's ready connection to its primary.
+        It sends the sync request once connected, then applies the received replication messages.
+
+        Parameters:
+            link (Connection): The connection to the primary.
+            mask (Int): The events the socket is ready for.
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                received = link.socket.recv(1048576)
+            except (BlockingIOError, InterruptedError):
+                received = None
+            except OSError:
+                received = b""
+
+            if received == b"":  # primary disconnected
+                self._close(link)
+                return
+            if received:
+                try:
+                    for _, message in link.reader.feed(received):
+                        self._apply(replication.decode_message(message))
+                except:
+                    self._close(link)
+                    return
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(link)
+
+    def _apply(self, message):
+        """
+        The method applies a replication message received by a replica.
+        The last part of a snapshot replaces the data, a mutation goes through _set_entry() or _remove_entry(), so the indexes
+        are maintained and the mutation is pushed to this replica's own replicas.
+
+        Parameters:
+            message (tuple): The decoded message, see replication.encode_message().
+        """
+        kind, offset, timestamp, key, value = message
+        with self.lock:
+            self.replication_timestamp = timestamp
+            if kind == replication.SNAPSHOT:
+                self.replication_snapshot += key
+                if value:
+                    self.data, self.expires = load_snapshot(
+                        io.BytesIO(self.replication_snapshot))
+                    self.replication_snapshot = bytearray()
+                    self._init_expiry()
+                    self.key_index = KeyIndex(self.data)
+                    self.value_indexes = {index_kind: VALUE_INDEXES[index_kind](self.data.items())
+                                          for index_kind in self.value_indexes}
+                    self._init_memory()
+                    self.cursors.clear()
+                    for connection in list(self.replicas):  # they synchronize again with the new data
+                        self._close(connection)
+                    self.replication_synchronized = True
+                    print(f"Synchronized with the primary at offset {offset}")
+            elif kind == wal.SET:
+                self.replication_offset = offset - 1
+                self._set_entry(key, value)
+            elif kind == wal.DELETE:
+                self.replication_offset = offset - 1
+                try:
+                    self._remove_entry(key)
+                except KeyError:
+                    pass
+            elif kind == wal.EXPIRE:
+                self.replication_offset = offset - 1
+                if key in self.data and (value is not None or key in self.expires):
+                    self._set_expiry(key, value)
+            self.replication_offset = offset
+
+    def _replication_status(self):
+        """
+        The method reports the server's replication role, offset and lag.
+
+        Returns:
+            Response(success=True, message=None, data={...}): The status, holding:
+                "role": "primary" or "replica".
+                "offset": The number of mutations applied, counted since the primary started.
+                "lag": The number of seconds the replica's data is behind the primary (0 on a primary), or None before the first synchronization.
+                       An idle primary pings its replicas every TICK_INTERVAL seconds, so an up-to-date replica reports about that much.
+                "synchronized": Whether the replica received a snapshot of the primary's data.
+                "connected": Whether the replica is connected to its primary.
+                "replicas": The number of replicas connected to the server.
+        """
+        lag = 0.0
+        if self.replication_primary:
+            lag = None
+            if self.replication_timestamp is not None:
+                lag = max(0.0, time.time() - self.replication_timestamp)
+        return Response(True, None, {
+            "role": "replica" if self.replication_primary else "primary",
+            "offset": self.replication_offset,
+            "lag": lag,
+            "synchronized": self.replication_synchronized,
+            "connected": self.replication_link is not None,
+            "replicas": len(self.replicas),
+        })
+
+    def _send_error(self, description):
+        """
+        The method creates an error Response object based on the given description.
+
+        Parameters:
+            description (String): The error's description.
+
+        Returns:
+            Response(False, "The given description", [])
+        """
+        return Response(False, description, [])
+
+    def _create_snapshot(self):
+        """
+        The method creates a snapshot (a backup) of the database. It is called by the scheduler's thread.
+        The lock is only held while the snapshot engine captures a point-in-time view of the data and the write-ahead log is rotated.
+        The view is captured by the event loop, so the engine can fork (see SnapshotEngine), and written by the calling thread
+        while the requests keep being handled. Once it is written, the rotated write-ahead log is discarded.
+
+        Raises:
+            PermissionError: Permission denied to write to file.
+        """
+        capture = self._call_on_loop(self._capture_snapshot)
+        self.snapshot_engine.complete(capture)
+        if self.wal:
+            with self.lock:
+                self.wal.discard_rotated()
+        print(f"Created snapshot in {self.snapshot_engine.last_duration:.3f}s "
+              f"({self.snapshot_engine.last_size} bytes)")
+
+    def _capture_snapshot(self):
+        """
+        The method rotates the write-ahead log and captures a point-in-time view of the data for a snapshot, while holding the lock.
+
+        Returns:
+            capture (tuple): The value returned by the snapshot engine's capture().
+        """
+        with self.lock:
+            if self.wal:
+                self.wal.rotate()
+            return self.snapshot_engine.capture(self.data, self.expires)
+
+    def _call_on_loop(self, function):
+        """
+        The method has a function called by the event loop, at its next tick, and waits for its result.
+        It must not be called by the event loop itself.
+
+        Parameters:
+            function (Function): The function, called without arguments.
+
+        Returns:
+            The function's result.
+
+        Raises:
+            The exception raised by the function.
+        """
+        future = Future()
+        self.loop_calls.append((function, future))
+        return future.result()
+
+    def _compact_storage(self):
+        """
+        The method compacts the segments of the "segment" engine and checkpoints their index. See storage.SegmentStore.compact().
+        """
+        started = time.monotonic()
+        compacted = self.storage.compact(self.lock)
+        print(f"Compacted {compacted} segments and checkpointed the index in "
+              f"{time.monotonic() - started:.3f}s")
+
+    def _schedule_snapshot(self):
+        """
+        The method creates a background thread that will call the _create_snapshot() method at a given time interval.
+        With the "segment" engine, it calls the _compact_storage() method instead.
+        """
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(self._compact_storage if self.storage else self._create_snapshot, 'interval',
+                          minutes=self.snapshot_interval)
+        scheduler.start()
+
+    def _read_config(self):
+        """
+        The method reads the data from the config file.
+        If there is no 'config.ini' file or it is corrupted, it will assign the default values.
+        """
+        try:
+            config = ConfigParser()
             config.read('config.ini')
             self.host = config.get("database", "host")
             self.port = int(config.get("database", "port"))
+            self.backlog = config.getint("database", "backlog", fallback=128)
             self.filename = config.get("database", "filename")
             self.snapshot_interval = int(config.get("snapshot", "interval"))
+            self.snapshot_method = config.get(
+                "snapshot", "method", fallback="fork")
+            self.allow_pickle = config.getboolean(
+                "protocol", "allow_pickle", fallback=False)
+            self.wal_enabled = config.getboolean(
+                "wal", "enabled", fallback=True)
+            self.wal_filename = config.get(
+                "wal", "filename", fallback=f"{self.filename}.wal")
+            self.wal_fsync = config.get("wal", "fsync", fallback="interval")
+            self.wal_fsync_interval = config.getint(
+                "wal", "fsync_interval", fallback=100)
+            self.query_cache_size = config.getint(
+                "query", "cache_size", fallback=1024)
+            self.cursor_timeout = config.getint(
+                "cursor", "timeout", fallback=60)
+            self.value_index_kinds = [kind.strip() for kind in config.get(
+                "index", "value", fallback="").split(",") if kind.strip()]
+            self.replication_primary = config.get(
+                "replication", "primary", fallback="").strip()
+            self.memory_limit = config.getint("memory", "limit", fallback=0)
+            self.memory_policy = config.get(
+                "memory", "policy", fallback="lru")
+            self.memory_spill = config.getboolean(
+                "memory", "spill", fallback=False)
+            self.spill_filename = config.get(
+                "memory", "spill_filename", fallback=f"{self.filename}.spill")
+            self.storage_engine = config.get(
+                "storage", "engine", fallback="snapshot")
+            self.segment_size = config.getint(
+                "storage", "segment_size", fallback=64 * 1024 * 1024)
+            self.value_cache_size = config.getint(
+                "storage", "value_cache_size", fallback=VALUE_CACHE_SIZE)
+            self.metrics_port = config.getint("metrics", "port", fallback=0)
+            self.slow_query_ms = config.getfloat(
+                "metrics", "slow_query_ms", fallback=100)
+            self.slow_log_filename = config.get(
+                "metrics", "slow_log", fallback=f"{self.filename}.slow.log")
+            self.storage_compression = config.get(
+                "compression", "storage", fallback="none")
+            self.wire_compression = config.getboolean(
+                "compression", "wire", fallback=True)
+            self.compression_level = config.getint(
+                "compression", "level", fallback=6)
+            self.compression_threshold = config.getint(
+                "compression", "threshold", fallback=1024)
+            self.subscriber_buffer_limit = config.getint(
+                "subscription", "buffer_limit", fallback=SUBSCRIBER_BUFFER_LIMIT)
+            self.subscriber_policy = config.get(
+                "subscription", "policy", fallback="drop")
         except:
             self.host = "127.0.0.1"
             self.port = 65535
+            self.backlog = 128
             self.filename = "data"
             self.snapshot_interval = 60
+            self.snapshot_method = "fork"
+            self.allow_pickle = False
+            self.wal_enabled = True
+            self.wal_filename = "data.wal"
+            self.wal_fsync = "interval"
+            self.wal_fsync_interval = 100
+            self.query_cache_size = 1024
+            self.cursor_timeout = 60
+            self.value_index_kinds = []
+            self.replication_primary = ""
+            self.memory_limit = 0
+            self.memory_policy = "lru"
+            self.memory_spill = False
+            self.spill_filename = "data.spill"
+            self.storage_engine = "snapshot"
+            self.segment_size = 64 * 1024 * 1024
+            self.value_cache_size = VALUE_CACHE_SIZE
+            self.metrics_port = 0
+            self.slow_query_ms = 100
+            self.slow_log_filename = "data.slow.log"
+            self.storage_compression = "none"
+            self.wire_compression = True
+            self.compression_level = 6
+            self.compression_threshold = 1024
+            self.subscriber_buffer_limit = SUBSCRIBER_BUFFER_LIMIT
+            self.subscriber_policy = "drop"
+
+
+class Connection():
+    """
+    This is a class for keeping the state of a client connection served by the event loop.
+
+    Attributes:
+        socket: The client's non-blocking TCP Socket.
+        reader (FrameReader): The reader splitting the received bytes into request frames.
+        outgoing (bytearray): The responses that were not yet sent to the client.
+        events (Int): The selector events the socket is registered for.
+        closed (bool): Whether the connection was closed.
+        replication_id (Int): The id of the sync request, if the connection is a replica's, else None.
+        buffer_limit (Int): The number of unsent bytes at which a replica's connection is dropped, else None.
+        bootstrap (Bootstrap): The image of the data being sent to a replica, or None.
+        client (bool): Whether the connection was accepted from a client, and is counted by the metrics.
+        compressor (Compressor): The compressor of the responses, as negotiated by the client, or None.
+        decompress (bool): Whether the compressed fields of the client's requests are accepted, once it negotiated compression.
+    """
+
+    def __init__(self, client_socket):
+        """
+        The constructor for the client connection class.
+
+        Parameters:
+            client_socket: The client's non-blocking TCP Socket.
+        """
+        self.socket = client_socket
+        self.reader = FrameReader()
+        self.outgoing = bytearray()
+        self.events = selectors.EVENT_READ
+        self.closed = False
+        self.replication_id = None
+        self.buffer_limit = None
+        self.bootstrap = None
+        self.client = False
+        self.compressor = None
+        self.decompress = False
+
+
+class Cursor():
+    """
+    This is a class for keeping the state of a query's results streamed in pages.
+
+    Attributes:
+        entries (Iterator): The matching entries that were not read yet.
+        page_size (Int): The default number of entries of a page.
+        timeout (Int): The number of seconds the cursor is kept without being fetched.
+        deadline (float): The time (monotonic clock) the cursor expires at.
+    """
+
+    def __init__(self, entries, page_size, timeout):
+        """
+        The constructor for the cursor class.
+
+        Parameters:
+            entries (Iterator): The matching entries.
+            page_size (Int): The default number of entries of a page.
+            timeout (Int): The number of seconds the cursor is kept without being fetched.
+        """
+        self.entries = entries
+        self.page_size = page_size
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
@@ -0,0 +1,983 @@
+import os
+import heapq
+import time
+import socket
+import selectors
+import threading
+import multiprocessing
+from collections import deque
+from itertools import chain
+from operator import itemgetter
+from configparser import ConfigParser
+from server import Server, Connection
+from query import QueryCache, aggregate, combine
+from request import Request
+from response import Response
+from protocol import pack_frame, recv_frame
+from codec import peek_request, decode_request, encode_request, decode_response, encode_response
+from partition import shard_of
+
+# The request types about a single key, forwarded to the shard owning it: read, add, delete, expire, ttl and persist.
+POINT_REQUEST_TYPES = (0, 1, 2, 13, 14, 15, 19, 20, 21, 22)
+
+
+class ShardedServer(Server):
+    """
+    This is a class for serving the database from several worker processes, so it is not limited to one core.
+    The keys are hash-partitioned across 'workers' shards. Every shard is a Server, running in its own process with its own
+    dictionary, snapshot file and write-ahead log, bound to the front-end's host on the port 'shard_port' + its index.
+    The clients route the requests about a single key straight to the shard owning it (see partition.shard_of()),
+    after asking the front-end for the shards' ports, so those requests do not go through the front-end's process.
+    The front-end accepts the clients' connections and speaks the same protocol as the Server:
+        - Read, add, delete, expire, ttl and persist requests, the read-modify-write requests (incr, append, setnx, compare and set),
+          and "=" key queries, are forwarded untouched to the owning shard, which applies them atomically. Only the key is decoded,
+          unless the client did not negotiate compression: the whole request is then checked for compressed fields.
+          This serves the clients that do not route their requests themselves.
+        - Shards requests are answered with the ports of the shards, by shard index.
+        - Read, add and delete many requests are split by shard, sent in parallel and their results put back in order.
+        - Queries, index creation and removal, and memory status requests are sent to all the shards in parallel and their results merged.
+          Key range queries stay ordered by key, "limit" applies to the merged results.
+          The shards' projections are combined, or, with a "limit", computed from the shards' merged and limited entries.
+          A "delete" query with a limit reads the matching entries first and then deletes the first 'limit' of them,
+          so it is not atomic across shards.
+        - Paged queries open a cursor on every shard and merge their pages lazily.
+    Every shard request of an event loop iteration is sent in one write per shard.
+    The memory limit is split evenly between the shards, each with its own spill file.
+    The stats request reports the front-end's requests, connections and traffic, and the statistics of every shard, which are also served by the metrics endpoint.
+    The requests a client routes straight to a shard are only counted in that shard's statistics.
+    Each shard has its own slow-query log.
+    A client's negotiated compression applies to the requests it sends and to the responses merged by the front-end.
+    The responses forwarded untouched from a shard are not compressed. The front-end's connections to the shards accept compressed requests.
+    A subscription is made on every shard, each pushing the changes of its own entries. The front-end relays their notifications
+    to the subscriber, applying the slow consumers' policy to its connection, and removes the shards' subscriptions when it is closed.
+
+    Attributes:
+        workers (Int): The number of shards. (default: the number of cores)
+        shard_port (Int): The port of the first shard. (default: the front-end's port + 1)
+        processes (List): The shards' processes.
+        shards (List): The connections to the shards, by shard index.
+        calls (Dict): The (shard index, callback) of the requests sent to the shards and waiting for a response, by request id.
+        last_call_id (Int): The id of the last request sent to a shard.
+        cursors (Dict): The open merged cursors (ShardCursor), by id.
+        relays (Dict): The front-end's subscription whose notifications a shard pushes, by the id of the shard's subscribe request.
+        shard_subscriptions (Dict): The (shard subscribe request ids, shard subscription ids) dictionaries, by shard index,
+                                    of every front-end subscription, by its id.
+        See Server for the other attributes, read from the same config file.
+    """
+
+    def __init__(self, **settings):
+        """
+        The constructor for the sharded server class. It starts the shards, then serves the clients.
+
+        Parameters:
+            settings: The attributes overriding the config file's values, e.g. workers=4.
+        """
+        self._read_config()
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.query_cache = QueryCache(self.query_cache_size)
+        self._init_metrics()
+        self._init_subscriptions()
+        self.relays = {}
+        self.shard_subscriptions = {}
+        self.cursors = {}
+        self.last_cursor_id = 0
+        self.calls = {}
+        self.last_call_id = 0
+        self._init_replication()
+        self._start_shards()
+        self._start_server()
+        self._listen()
+
+    def _read_config(self):
+        """
+        The method reads the data from the config file, the shards' section included.
+        If there is no 'config.ini' file or it is corrupted, it will assign the default values.
+        """
+        super()._read_config()
+        try:
+            config = ConfigParser()
+            config.read('config.ini')
+            self.workers = config.getint(
+                "shard", "workers", fallback=os.cpu_count() or 1)
+            self.shard_port = config.getint(
+                "shard", "port", fallback=self.port + 1)
+        except:
+            self.workers = os.cpu_count() or 1
+            self.shard_port = self.port + 1
+
+    def _start_shards(self):
+        """
+        The method starts the shards' processes and connects to them, once each has loaded its data.
+
+        Raises:
+            ConnectionError: Shard could not be started.
+        """
+        self.processes = []
+        for index in range(self.workers):
+            settings = {
+                "host": self.host,
+                "port": self.shard_port + index,
+                "filename": f"{self.filename}.{index}",
+                "wal_filename": f"{self.wal_filename}.{index}",
+                "memory_limit": self.memory_limit // self.workers,
+                "memory_policy": self.memory_policy,
+                "memory_spill": self.memory_spill,
+                "spill_filename": f"{self.spill_filename}.{index}",
+                "metrics_port": 0,
+                "slow_query_ms": self.slow_query_ms,
+                "slow_log_filename": self.slow_log_filename and f"{self.slow_log_filename}.{index}",
+                "storage_compression": self.storage_compression,
+                "compression_level": self.compression_level,
+                "compression_threshold": self.compression_threshold,
+                "subscriber_buffer_limit": self.subscriber_buffer_limit,
+                "subscriber_policy": "drop",  # the front-end's connection is never closed
+                "allow_pickle": self.allow_pickle,
+                "wire_compression": self.wire_compression,
+            }
+            process = multiprocessing.Process(
+                target=_run_shard, args=(settings,), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        self.shards = []
+        for index, process in enumerate(self.processes):
+            while True:
+                try:
+                    shard_socket = socket.create_connection(
+                        (self.host, self.shard_port + index))
+                    break
+                except OSError:
+                    if not process.is_alive():
+                        raise ConnectionError("Shard could not be started.")
+                    time.sleep(0.05)
+            shard_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.wire_compression:
+                # accepts the compressed requests forwarded from the clients, without compressing the responses
+                shard_socket.sendall(pack_frame(0, encode_request(
+                    Request(18, "zlib", None, None, {"responses": False}))))
+                recv_frame(shard_socket)
+            shard_socket.setblocking(False)
+            self.shards.append(Connection(shard_socket))
+
+    def _start_server(self):
+        """
+        The method creates the front-end's socket and registers the connections to the shards in the selector.
+
+        Raises:
+            ConnectionError: Server could not be started.
+        """
+        super()._start_server()
+        for shard in self.shards:
+            self.selector.register(shard.socket, selectors.EVENT_READ,
+                                   lambda sock, mask, shard=shard: self._serve_shard(shard, mask))
+
+    def _tick(self):
+        """
+        The method does the event loop's periodic work, after every wait for ready sockets.
+        It sends the queued requests to the shards and the queued responses to the clients, and closes the expired cursors.
+        """
+        pending, self.pending = self.pending, set()
+        for connection in pending:
+            self._flush(connection)
+
+        now = time.monotonic()
+        for cursor_id in [cursor_id for cursor_id, cursor in self.cursors.items()
+                          if cursor.deadline <= now and not cursor.busy]:
+            self._discard_cursor(cursor_id)
+
+    def _serve(self, connection, mask):
+        """
+        The method handles a ready client connection.
+        When requests are received, it routes them to the shards. The responses are queued when the shards answer.
+        A request whose routing raises an error is answered with an error response.
+
+        Parameters:
+            connection (Connection): The ready client connection.
+            mask (Int): The events the socket is ready for.
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                received = connection.socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                received = None
+            except OSError:
+                received = b""
+
+            if received == b"":  # client disconnected
+                self._close(connection)
+                return
+            if received:
+                self.metrics.bytes_in += len(received)
+                try:
+                    frames = connection.reader.feed(received)
+                except ConnectionError:
+                    self._close(connection)
+                    return
+                for request_id, request in frames:
+                    if connection.closed:  # closed by a request of the batch, e.g. as a slow subscriber
+                        return
+                    try:
+                        self._route(request, lambda payload, request_id=request_id:
+                                    self._respond(connection, request_id, payload), connection, request_id)
+                    except Exception:  # a failed request must not stop the event loop
+                        self._respond(connection, request_id, encode_response(
+                            self._send_error("Request could not be handled.")))
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(connection)
+
+    def _serve_shard(self, shard, mask):
+        """
+        The method handles a ready shard connection. The received responses are passed to the callbacks of their requests,
+        and the notifications of the shard's subscriptions are relayed to the subscribers.
+
+        Parameters:
+            shard (Connection): The ready shard connection.
+            mask (Int): The events the socket is ready for.
+        """
+        if mask & selectors.EVENT_READ:
+            try:
+                received = shard.socket.recv(1048576)
+            except (BlockingIOError, InterruptedError):
+                received = None
+            except OSError:
+                received = b""
+
+            if received == b"":  # shard stopped
+                self._close(shard)
+                return
+            if received:
+                for call_id, payload in shard.reader.feed(received):
+                    call = self.calls.pop(call_id, None)
+                    if call is not None:
+                        call[1](payload)
+                    elif call_id in self.relays:
+                        subscription = self.relays[call_id]
+                        if not subscription.connection.closed:
+                            self._deliver(subscription, payload)
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(shard)
+
+    def _close(self, connection):
+        """
+        The method unregisters and closes a client or shard connection.
+        If a shard connection is closed, the requests waiting for its responses fail.
+
+        Parameters:
+            connection (Connection): The client or shard connection.
+        """
+        super()._close(connection)
+        if connection in self.shards:
+            shard = self.shards.index(connection)
+            print(f"Shard {shard} is not available")
+            failed = [call_id for call_id, (index, _) in self.calls.items()
+                      if index == shard]
+            for call_id in failed:
+                _, callback = self.calls.pop(call_id)
+                callback(encode_response(
+                    self._send_error("Shard is not available.")))
+
+    def _respond(self, connection, request_id, payload):
+        """
+        The method queues a response to be sent to a client.
+
+        Parameters:
+            connection (Connection): The client connection.
+            request_id (Int): The id of the client's request.
+            payload (bytes): The encoded response.
+        """
+        if not connection.closed:
+            connection.outgoing += pack_frame(request_id, payload)
+            self.pending.add(connection)
+
+    def _call(self, shard, payload, callback):
+        """
+        The method queues a request to be sent to a shard.
+
+        Parameters:
+            shard (Int): The index of the shard.
+            payload (bytes): The encoded request.
+            callback (Function): The function called with the encoded response.
+
+        Returns:
+            Int: The id of the request sent to the shard, or None if the shard is not available.
+        """
+        connection = self.shards[shard]
+        if connection.closed:
+            callback(encode_response(
+                self._send_error("Shard is not available.")))
+            return None
+        self.last_call_id += 1
+        self.calls[self.last_call_id] = (shard, callback)
+        connection.outgoing += pack_frame(self.last_call_id, payload)
+        self.pending.add(connection)
+        return self.last_call_id
+
+    def _gather(self, calls, callback):
+        """
+        The method sends requests to several shards in parallel and waits for all their responses.
+
+        Parameters:
+            calls (List): The (shard index, encoded request) tuples.
+            callback (Function): The function called with the decoded responses, in the order of the calls.
+        """
+        responses = [None] * len(calls)
+        remaining = [len(calls)]
+
+        def collect(position, payload):
+            try:
+                responses[position] = decode_response(payload)
+            except:
+                responses[position] = self._send_error(
+                    "Shard is not available.")
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                callback(responses)
+
+        if not calls:
+            callback(responses)
+        for position, (shard, payload) in enumerate(calls):
+            self._call(shard, payload, lambda payload,
+                       position=position: collect(position, payload))
+
+    def _route(self, payload, respond, connection, request_id):
+        """
+        The method checks the request's type and routes it to the shards, or handles the connection's compression and subscriptions
+        and the shards request.
+        The request is counted in the metrics when it is responded to, with its latency including the shards' round trip.
+
+        Parameters:
+            payload (bytes): The encoded request.
+            respond (Function): The function called with the encoded response.
+            connection (Connection): The client connection.
+            request_id (Int): The id of the client's request.
+        """
+        started = time.perf_counter()
+        try:
+            request_type, key = peek_request(payload, self.allow_pickle, connection.decompress)
+            if request_type in POINT_REQUEST_TYPES:
+                shard = self._shard_of(key)
+                if not connection.decompress:  # the shards accept the compressed fields the front-end forwards
+                    decode_request(payload, self.allow_pickle)
+            else:
+                request = decode_request(payload, self.allow_pickle, connection.decompress)
+        except:
+            self.metrics.invalid_requests += 1
+            respond(encode_response(self._send_error("Invalid request.")))
+            return
+
+        def respond(response, respond=respond):
+            self.metrics.record(request_type, time.perf_counter() - started,
+                                response[1:2] == b"\x01")  # the encoded response's success flag
+            respond(response)
+
+        if request_type in POINT_REQUEST_TYPES:
+            self._call(shard, payload, respond)
+            return
+        if request_type == 18:
+            respond(encode_response(self._negotiate(connection, request.key, request.options)))
+            return
+        if request_type == 23:
+            self._subscribe_shards(connection, request_id, payload, lambda response: respond(
+                encode_response(response)))
+            return
+        if request_type == 24:
+            respond(encode_response(self._unsubscribe(connection, request.key)))
+            return
+        if request_type == 25:
+            respond(encode_response(Response(True, None, [self.shard_port + index
+                                                          for index in range(len(self.shards))])))
+            return
+
+        request_types = {
+            3: self._query,
+            4: self._many,
+            5: self._many,
+            6: self._many,
+            7: self._broadcast,
+            8: self._broadcast,
+            9: self._fetch,
+            10: self._close_cursor,
+            16: self._memory_status,
+            17: self._stats}
+        action = request_types.get(request_type)
+        if action is None:
+            respond(encode_response(
+                self._send_error("Request type does not exist.")))
+            return
+        action(request, payload, lambda response: respond(
+            encode_response(response, compressor=connection.compressor)))
+
+    def _subscribe_shards(self, connection, request_id, payload, reply):
+        """
+        The method subscribes a connection on every shard. See Server._subscribe().
+        The front-end's subscription watches nothing itself: the shards' notifications are relayed to it.
+        If a shard refuses the subscription, the other shards' subscriptions are removed.
+
+        Parameters:
+            connection (Connection): The client connection.
+            request_id (Int): The id of the subscribe request, carried by the relayed notifications' frames.
+            payload (bytes): The encoded subscribe request.
+            reply (Function): The function called with the Response, holding the front-end's subscription id, or with the first failed Response.
+        """
+        if connection.closed:  # its subscriptions would never be removed
+            reply(self._send_error("Connection is closed."))
+            return
+        subscription = self.subscriptions.add(connection, request_id, keys=())
+        subscription_id = subscription.subscription_id
+        call_ids, shard_ids = {}, {}
+        self.shard_subscriptions[subscription_id] = (call_ids, shard_ids)
+        failed = []
+        remaining = [len(self.shards)]
+
+        def subscribed(shard, payload):
+            try:
+                response = decode_response(payload)
+            except:
+                response = self._send_error("Shard is not available.")
+            if response.success:
+                shard_ids[shard] = response.data
+            else:
+                failed.append(response)
+            remaining[0] -= 1
+            if subscription_id not in self.shard_subscriptions:  # released before this shard answered
+                self._unsubscribe_shard(shard, call_ids, shard_ids)
+                return
+            if remaining[0] == 0:
+                if failed:
+                    self.subscriptions.remove(subscription_id)
+                    self._release_shards(subscription_id)
+                    reply(failed[0])
+                else:
+                    reply(Response(True, None, subscription_id))
+
+        for shard in range(len(self.shards)):
+            call_id = self._call(shard, payload, lambda payload,
+                                 shard=shard: subscribed(shard, payload))
+            if call_id is not None:
+                call_ids[shard] = call_id
+                self.relays[call_id] = subscription
+
+    def _unsubscribe(self, connection, subscription_id):
+        """
+        The method removes one of the connection's subscriptions, and the shards' subscriptions it relays. See Server._unsubscribe().
+        """
+        response = super()._unsubscribe(connection, subscription_id)
+        if response.success:
+            self._release_shards(subscription_id)
+        return response
+
+    def _drop_subscriptions(self, connection):
+        """
+        The method removes the subscriptions of a closed connection, and the shards' subscriptions they relay.
+
+        Parameters:
+            connection (Connection): The closed connection.
+        """
+        for subscription_id in [subscription_id for subscription_id, subscription in self.subscriptions.subscriptions.items()
+                                if subscription.connection is connection]:
+            self._release_shards(subscription_id)
+        super()._drop_subscriptions(connection)
+
+    def _release_shards(self, subscription_id):
+        """
+        The method stops relaying the notifications of a front-end subscription and removes the shards' subscriptions.
+
+        Parameters:
+            subscription_id (Int): The front-end subscription's id.
+        """
+        call_ids, shard_ids = self.shard_subscriptions.pop(subscription_id, ({}, {}))
+        for shard in list(call_ids):
+            self._unsubscribe_shard(shard, call_ids, shard_ids)
+
+    def _unsubscribe_shard(self, shard, call_ids, shard_ids):
+        """
+        The method stops relaying the notifications of a shard's subscription and removes it, if the shard made it.
+
+        Parameters:
+            shard (Int): The index of the shard.
+            call_ids (Dict): The ids of the subscribe requests sent to the shards, by shard index.
+            shard_ids (Dict): The ids of the shards' subscriptions, by shard index.
+        """
+        call_id = call_ids.pop(shard, None)
+        self.relays.pop(call_id, None)
+        if shard in shard_ids:
+            self._call(shard, encode_request(Request(24, shard_ids.pop(shard), None, None)),
+                       lambda payload: None)
+
+    def _shard_of(self, key):
+        """
+        The method returns the index of the shard owning a key. See shard_of().
+        """
+        return shard_of(key, len(self.shards))
+
+    def _many(self, request, payload, reply):
+        """
+        The method splits a read, add or delete many request by shard and puts the shards' results back in order.
+
+        Parameters:
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        messages = {4: "Entries could not be read.",
+                    5: "Entries could not be added.",
+                    6: "Entries could not be deleted."}
+        try:
+            items = list(request.value if request.request_type ==
+                         5 else request.key)
+            results = [[] for _ in items]
+            positions = [[] for _ in self.shards]
+            parts = [[] for _ in self.shards]
+            for position, item in enumerate(items):
+                try:
+                    if request.request_type == 5:
+                        key, value = item
+                    else:
+                        key = item
+                    shard = self._shard_of(key)
+                except:
+                    continue
+                positions[shard].append(position)
+                parts[shard].append(item)
+        except:
+            reply(self._send_error(messages[request.request_type]))
+            return
+
+        shards = [shard for shard, part in enumerate(parts) if part]
+        calls = []
+        for shard in shards:
+            if request.request_type == 5:
+                part = Request(5, None, parts[shard], None, request.options)
+            else:
+                part = Request(request.request_type, parts[shard], None, None)
+            calls.append((shard, encode_request(part)))
+
+        def merge(responses):
+            for shard, response in zip(shards, responses):
+                if not response.success:
+                    reply(response)
+                    return
+                for position, result in zip(positions[shard], response.data):
+                    results[position] = result
+            reply(Response(True, None, results))
+
+        self._gather(calls, merge)
+
+    def _broadcast(self, request, payload, reply):
+        """
+        The method sends a request to all the shards, e.g. to create or drop a value index on each of them.
+
+        Parameters:
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the first failed Response, or with the first Response if all succeeded.
+        """
+        def merge(responses):
+            failed = [response for response in responses if not response.success]
+            reply((failed or responses)[0])
+
+        self._gather([(shard, payload)
+                     for shard in range(len(self.shards))], merge)
+
+    def _memory_status(self, request, payload, reply):
+        """
+        The method reads the memory status of all the shards and adds it up. See Server._memory_status().
+
+        Parameters:
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        def merge(responses):
+            failed = [response for response in responses if not response.success]
+            if failed:
+                reply(failed[0])
+                return
+            status = dict(responses[0].data)
+            for response in responses[1:]:
+                for name, value in response.data.items():
+                    if isinstance(value, int) and not isinstance(value, bool):
+                        status[name] += value
+            reply(Response(True, None, status))
+
+        self._gather([(shard, payload)
+                     for shard in range(len(self.shards))], merge)
+
+    def _stats(self, request, payload, reply):
+        """
+        The method reads the statistics of all the shards. See Server._stats().
+
+        Parameters:
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response, holding the front-end's process statistics
+                              (its requests, latencies, connections and traffic), the total number of "keys" and the statistics of every shard in "shards",
+                              or with the first failed Response.
+        """
+        def merge(responses):
+            failed = [response for response in responses if not response.success]
+            if failed:
+                reply(failed[0])
+                return
+            stats = self._process_stats()
+            stats["keys"] = sum(response.data["keys"] for response in responses)
+            stats["shards"] = [response.data for response in responses]
+            reply(Response(True, None, stats))
+
+        self._gather([(shard, encode_request(Request(17, None, None, None)))
+                     for shard in range(len(self.shards))], merge)
+
+    def _collect_stats(self, reply):
+        """
+        The method reads the statistics of the front-end and of the shards for the metrics endpoint.
+
+        Parameters:
+            reply (Function): The function called with the statistics' Response.
+        """
+        self._stats(None, None, reply)
+
+    def _query(self, request, payload, reply):
+        """
+        The method sends a query to the shards and merges their results.
+
+        Parameters:
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        try:
+            plan = self.query_cache.get(request.query)
+        except:
+            reply(self._send_error("Invalid query syntax."))
+            return
+        options = request.options
+        if plan.projection and options and options.get("page_size"):
+            reply(self._send_error("Projections are not paged."))
+            return
+        if options and options.get("page_size") and plan.action == "read":
+            self._open_cursor(plan, payload, reply)
+            return
+        if plan.element == "key" and plan.operator_name == "=":
+            self._call(self._shard_of(plan.value), payload,
+                       lambda payload: reply(decode_response(payload)))
+            return
+
+        everywhere = range(len(self.shards))
+        if plan.projection:
+            self._project(plan, request, payload, reply)
+            return
+        if plan.action == "delete" and plan.limit is not None:
+            read = encode_request(Request(
+                3, None, None, "read" + request.query.lstrip()[len("delete"):]))
+
+            def delete(responses):
+                failed = [response for response in responses if not response.success]
+                if failed:
+                    reply(failed[0])
+                    return
+                matches = self._merge(plan, [response.data for response in responses])
+                keys = [[] for _ in everywhere]
+                for key, value in matches:
+                    keys[self._shard_of(key)].append(key)
+                self._gather([(shard, encode_request(Request(6, keys[shard], None, None)))
+                              for shard in everywhere if keys[shard]],
+                             lambda responses: reply(Response(True, None, matches)))
+
+            self._gather([(shard, read) for shard in everywhere], delete)
+            return
+
+        def merge(responses):
+            failed = [response for response in responses if not response.success]
+            if failed:
+                reply(failed[0])
+                return
+            reply(Response(True, None, self._merge(
+                plan, [response.data for response in responses])))
+
+        self._gather([(shard, payload) for shard in everywhere], merge)
+
+    def _project(self, plan, request, payload, reply):
+        """
+        The method computes a projection on the shards and combines their results. See query.combine().
+        With a limit, the shards read their matching entries instead, which are merged and limited before being projected,
+        so the first 'limit' entries are the same as a read query's.
+
+        Parameters:
+            plan (QueryPlan): The compiled query, with a projection.
+            request (Request): The received request.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        if plan.limit is not None:
+            payload = encode_request(Request(
+                3, None, None, "read" + request.query.lstrip()[len(plan.projection):]))
+
+        def merge(responses):
+            failed = [response for response in responses if not response.success]
+            if failed:
+                reply(failed[0])
+                return
+            results = [response.data for response in responses]
+            try:
+                if plan.limit is not None:
+                    result = aggregate(plan.projection, self._merge(plan, results))
+                elif plan.projection == "keys":
+                    result = [key for key, _ in self._merge(
+                        plan, [[(key, None) for key in keys] for keys in results])]
+                else:
+                    result = combine(plan.projection, results)
+            except TypeError:
+                reply(self._send_error("Values cannot be aggregated."))
+                return
+            reply(Response(True, None, result))
+
+        self._gather([(shard, payload) for shard in range(len(self.shards))], merge)
+
+    def _merge(self, plan, results):
+        """
+        The method merges the shards' results of a query.
+        The results of a key range query are merged by key, the others are concatenated.
+
+        Parameters:
+            plan (QueryPlan): The compiled query.
+            results (List): The lists of (key, value) tuples returned by the shards.
+
+        Returns:
+            A list containing at most 'limit' entries that match the query.
+        """
+        merged = None
+        if plan.element == "key":
+            try:
+                merged = list(heapq.merge(
+                    *results, key=itemgetter(0), reverse=plan.reverse))
+            except TypeError:  # keys of different data types
+                pass
+        if merged is None:
+            merged = list(chain.from_iterable(results))
+        return merged[:plan.limit]
+
+    def _open_cursor(self, plan, payload, reply):
+        """
+        The method opens a cursor on every shard and reads the first page of their merged entries.
+
+        Parameters:
+            plan (QueryPlan): The compiled read query.
+            payload (bytes): The encoded request, holding the page size and the cursor's timeout.
+            reply (Function): The function called with the Response.
+        """
+        options = decode_request(payload, self.allow_pickle, True).options  # checked by _route()
+        page_size = options["page_size"]
+        timeout = options.get("timeout") or self.cursor_timeout
+
+        def opened(responses):
+            cursor = ShardCursor(plan, page_size, timeout, len(responses))
+            self.last_cursor_id += 1
+            self.cursors[self.last_cursor_id] = cursor
+            for shard, response in enumerate(responses):
+                if response.success:
+                    cursor.cursors[shard] = response.cursor
+                    cursor.entries[shard].extend(response.data)
+            failed = [response for response in responses if not response.success]
+            if failed:
+                self._discard_cursor(self.last_cursor_id)
+                reply(failed[0])
+                return
+            self._fill(self.last_cursor_id, page_size, reply, [])
+
+        self._gather([(shard, payload)
+                     for shard in range(len(self.shards))], opened)
+
+    def _fetch(self, request, payload, reply):
+        """
+        The method reads the next page of a merged cursor.
+
+        Parameters:
+            request (Request): The received request. Its key is the cursor's id, its options the optional "page_size".
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        cursor = self.cursors.get(request.key) if isinstance(
+            request.key, int) else None
+        if cursor is None or cursor.busy:
+            reply(self._send_error("Cursor does not exist."))
+            return
+        page_size = (request.options or {}).get(
+            "page_size") or cursor.page_size
+        self._fill(request.key, page_size, reply, [])
+
+    def _fill(self, cursor_id, page_size, reply, page):
+        """
+        The method fills a page of a merged cursor from the shards' buffered entries, fetching the shards' next pages when needed.
+        Before an entry of a key range query is taken, every open shard must have buffered entries, so the smallest (or largest) key is known.
+        The shards whose cursors were not fetched for half their timeout are fetched too, so they do not expire.
+
+        Parameters:
+            cursor_id (Int): The cursor's id.
+            page_size (Int): The number of entries of the page.
+            reply (Function): The function called with the Response.
+            page (List): The entries already taken for the page.
+        """
+        cursor = self.cursors[cursor_id]
+        ordered = cursor.plan.element == "key"
+        while len(page) < page_size and cursor.remaining != 0:
+            now = time.monotonic()
+            empty = [shard for shard, entries in enumerate(cursor.entries)
+                     if not entries and cursor.cursors[shard] is not None]
+            if not ordered and any(cursor.entries):
+                empty = []
+            stale = [shard for shard, refreshed in enumerate(cursor.refreshed)
+                     if cursor.cursors[shard] is not None and now - refreshed > cursor.timeout / 2]
+            refill = sorted(set(empty + stale))
+            if refill:
+                self._refill(cursor_id, refill, lambda: self._fill(
+                    cursor_id, page_size, reply, page), reply)
+                return
+
+            heads = [shard for shard, entries in enumerate(
+                cursor.entries) if entries]
+            if not heads:
+                break
+            shard = heads[0]
+            if ordered and len(heads) > 1:
+                pick = max if cursor.plan.reverse else min
+                try:
+                    shard = pick(
+                        heads, key=lambda shard: cursor.entries[shard][0][0])
+                except TypeError:  # keys of different data types
+                    pass
+            page.append(cursor.entries[shard].popleft())
+            if cursor.remaining is not None:
+                cursor.remaining -= 1
+
+        if cursor.remaining == 0 or not any(cursor.entries) and all(
+                shard_cursor is None for shard_cursor in cursor.cursors):
+            self._discard_cursor(cursor_id)
+            reply(Response(True, None, page))
+            return
+        cursor.deadline = time.monotonic() + cursor.timeout
+        reply(Response(True, None, page, cursor_id))
+
+    def _refill(self, cursor_id, shards, resume, reply):
+        """
+        The method fetches the next page of the given shards' cursors into a merged cursor's buffers.
+
+        Parameters:
+            cursor_id (Int): The merged cursor's id.
+            shards (List): The indexes of the shards whose cursors are fetched.
+            resume (Function): The function called once the pages are buffered.
+            reply (Function): The function called with the Response, if a shard's cursor expired.
+        """
+        cursor = self.cursors[cursor_id]
+        cursor.busy = True
+        options = {"page_size": cursor.page_size}
+
+        def refilled(responses):
+            cursor.busy = False
+            now = time.monotonic()
+            for shard, response in zip(shards, responses):
+                if not response.success:
+                    cursor.cursors[shard] = None
+                    self._discard_cursor(cursor_id)
+                    reply(response)
+                    return
+                cursor.cursors[shard] = response.cursor
+                cursor.refreshed[shard] = now
+                cursor.entries[shard].extend(response.data)
+            resume()
+
+        self._gather([(shard, encode_request(Request(9, cursor.cursors[shard], None, None, options)))
+                      for shard in shards], refilled)
+
+    def _close_cursor(self, request, payload, reply):
+        """
+        The method closes a merged cursor before all its pages are read.
+
+        Parameters:
+            request (Request): The received request. Its key is the cursor's id.
+            payload (bytes): The encoded request.
+            reply (Function): The function called with the Response.
+        """
+        cursor = self.cursors.get(request.key) if isinstance(
+            request.key, int) else None
+        if cursor is None or cursor.busy:
+            reply(self._send_error("Cursor does not exist."))
+            return
+        self._discard_cursor(request.key)
+        reply(Response(True, None, []))
+
+    def _discard_cursor(self, cursor_id):
+        """
+        The method removes a merged cursor and closes the shards' cursors that still have pages.
+
+        Parameters:
+            cursor_id (Int): The cursor's id.
+        """
+        cursor = self.cursors.pop(cursor_id)
+        for shard, shard_cursor in enumerate(cursor.cursors):
+            if shard_cursor is not None:
+                self._call(shard, encode_request(
+                    Request(10, shard_cursor, None, None)), lambda payload: None)
+
+
+class ShardCursor():
+    """
+    This is a class for keeping the state of a query's results merged from the shards' cursors.
+
+    Attributes:
+        plan (QueryPlan): The compiled read query.
+        page_size (Int): The default number of entries of a page, also fetched at once from a shard.
+        timeout (Int): The number of seconds the cursor is kept without being fetched.
+        deadline (float): The time (monotonic clock) the cursor expires at.
+        remaining (Int): The number of entries left before the query's limit, or None if there is no limit.
+        cursors (List): The shards' cursor ids, by shard index, or None for the shards without more pages.
+        entries (List): The shards' fetched entries that were not taken yet (deque), by shard index.
+        refreshed (List): The time (monotonic clock) every shard's cursor was last fetched.
+        busy (bool): Whether pages are being fetched from the shards.
+    """
+
+    def __init__(self, plan, page_size, timeout, count):
+        """
+        The constructor for the merged cursor class.
+
+        Parameters:
+            plan (QueryPlan): The compiled read query.
+            page_size (Int): The default number of entries of a page.
+            timeout (Int): The number of seconds the cursor is kept without being fetched.
+            count (Int): The number of shards.
+        """
+        self.plan = plan
+        self.page_size = page_size
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.remaining = plan.limit
+        self.cursors = [None] * count
+        self.entries = [deque() for _ in range(count)]
+        self.refreshed = [time.monotonic()] * count
+        self.busy = False
+
+
+def _run_shard(settings):
+    """
+    The function runs a shard's Server in a worker process.
+    The worker exits when the front-end's process exits, even if it was killed.
+
+    Parameters:
+        settings (Dict): The attributes overriding the config file's values (host, port and file names).
+    """
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+    Server(**settings)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
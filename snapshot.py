@@ -0,0 +1,312 @@
+import os
+import time
+import gzip
+import lzma
+import pickle
+import struct
+import threading
+from itertools import islice
+from compression import COMPRESSION_LEVEL
+
+SNAPSHOT_METHODS = ("fork", "copy")
+
+SNAPSHOT_COMPRESSIONS = ("none", "zlib", "lzma")
+
+# The first bytes of a gzip and of an xz stream. A pickle never starts with them, so the compression of a snapshot is detected when it is read.
+GZIP_MAGIC = b"\x1f\x8b"
+XZ_MAGIC = b"\xfd7zXZ\x00"
+
+# The size of the uncompressed snapshot, sent by the forked process to its parent.
+RAW_SIZE = struct.Struct("!Q")
+
+# The first pickle of a snapshot written in batches. The previous snapshots are a single pickle of a tuple or a dictionary.
+SNAPSHOT_HEADER = ("snapshot", 2)
+
+# The number of entries pickled together in a snapshot.
+SNAPSHOT_BATCH = 1000
+
+
+class SnapshotEngine():
+    """
+    This is a class for writing snapshots of the database without stalling the requests' handling.
+    The snapshot is taken in two steps:
+        - capture(): Called while holding the server's lock, it takes a point-in-time view of the data in constant time or in one C level copy.
+          With the "fork" method, a child process is forked and serializes its copy-on-write view of the memory.
+          The child only has the forking thread: a lock held by another thread stays locked in the child forever.
+          So the engine only forks from the thread that created it, the server's event loop, between the requests' handling.
+          The child then only pickles the data and writes a new file, which takes no lock shared with the other threads.
+          With the "copy" method (used where fork() does not exist, or when capture() is called from another thread),
+          the dictionary is shallow copied and serialized by the calling thread. A bounded or segment data is not copied:
+          its snapshot() view reads the spilled or stored values while it is serialized, not while the lock is held.
+        - complete(): Called without holding the lock, it waits for the view to be written.
+    The snapshot is written to a temporary file, synced and renamed over the previous snapshot, so a crash never leaves a truncated snapshot.
+    It holds the data and the entries' expiration times: a header, the entries in pickled batches ended by an empty batch, then the expiration times.
+    So it is written without pickling the whole data at once, and loaded one batch at a time, e.g. into a bounded data evicting as it is filled.
+    The previous snapshots, a pickled (data, expirations) tuple or the pickled data alone, are still read.
+    The pickled snapshot can be streamed through a compressor, as a gzip ("zlib") or xz ("lzma") file. Every snapshot is read, whatever its compression.
+
+    Attributes:
+        filename (String): The snapshot file name.
+        method (String): The snapshot method, "fork" or "copy".
+        thread (Thread): The thread that created the engine, the only one forking.
+        compression (String): The compression of the snapshots, "none", "zlib" or "lzma".
+        level (int): The compression level, from 0 (fastest) to 9 (smallest).
+        last_duration (float): The duration, in seconds, of the last snapshot, or None if none was taken.
+        last_size (int): The size, in bytes, of the last snapshot, or None if none was taken.
+        last_raw_size (int): The size, in bytes, of the last snapshot before compression, or None if none was taken.
+        last_time (float): The time (epoch seconds) the last snapshot completed, or None if none was taken.
+
+    Tests:
+        >>> import tempfile
+        >>> engine = SnapshotEngine(os.path.join(tempfile.mkdtemp(), "data"), "copy")
+        >>> engine.load()
+        ({}, {})
+        >>> engine.complete(engine.capture({1: "a", "b": [2]}, {1: 1700000000.0}))
+        >>> engine.load()
+        ({1: 'a', 'b': [2]}, {1: 1700000000.0})
+        >>> engine.last_size > 0
+        True
+        >>> with open(engine.filename, "wb") as handle:  # a snapshot written before the expiration times were saved
+        ...     _ = handle.write(pickle.dumps({"c": 3}))
+        >>> engine.load()
+        ({'c': 3}, {})
+        >>> data, batches = {}, []
+        >>> engine.complete(engine.capture({key: key for key in range(2500)}, {}))
+        >>> _ = engine.load(data, lambda: batches.append(len(data)))
+        >>> len(data), batches
+        (2500, [1000, 2000, 2500])
+        >>> compressed = SnapshotEngine(engine.filename, "fork", "lzma")
+        >>> compressed.complete(compressed.capture({"text": "abc" * 1000}, {}))
+        >>> compressed.load()[0] == {"text": "abc" * 1000}, compressed.last_size < 200 < compressed.last_raw_size
+        (True, True)
+        >>> captures = []
+        >>> thread = threading.Thread(target=lambda: captures.append(compressed.capture({"d": 4}, {})))
+        >>> thread.start(), thread.join()
+        (None, None)
+        >>> captures[0][0]  # another thread than the engine's copies the data instead of forking
+        'copy'
+        >>> compressed.complete(captures[0])
+        >>> compressed.load()
+        ({'d': 4}, {})
+    """
+
+    def __init__(self, filename, method, compression="none", level=COMPRESSION_LEVEL):
+        """
+        The constructor for the snapshot engine class.
+
+        Parameters:
+            filename (String): The snapshot file name.
+            method (String): The snapshot method, "fork" or "copy". If fork() does not exist, "copy" is always used.
+            compression (String): The compression of the snapshots, "none", "zlib" or "lzma".
+            level (int): The compression level, from 0 (fastest) to 9 (smallest).
+
+        Raises:
+            ValueError: The snapshot method or compression does not exist.
+        """
+        if method not in SNAPSHOT_METHODS:
+            raise ValueError(f"Snapshot method {method} does not exist.")
+        if compression not in SNAPSHOT_COMPRESSIONS:
+            raise ValueError(f"Snapshot compression {compression} does not exist.")
+        self.filename = filename
+        self.method = method if hasattr(os, "fork") else "copy"
+        self.thread = threading.current_thread()
+        self.compression = compression
+        self.level = level
+        self.last_duration = None
+        self.last_size = None
+        self.last_raw_size = None
+        self.last_time = None
+
+    def load(self, data=None, loaded=None):
+        """
+        The method reads the last snapshot, streaming it from the file. See load_snapshot().
+
+        Parameters:
+            data (MutableMapping): The mapping the entries are stored in, e.g. a BoundedData, or None for a new dictionary.
+            loaded (Function): The function called after every stored batch, e.g. to evict the entries exceeding a memory limit, or None.
+
+        Returns:
+            (data, expirations): The snapshot's data and the expiration times (epoch seconds) of its expiring entries, by key.
+                                 Both are empty if there is no snapshot.
+        """
+        try:
+            handle = open(self.filename, 'rb')
+        except IOError:
+            return {} if data is None else data, {}
+        with handle:
+            return load_snapshot(handle, data, loaded)
+
+    def capture(self, data, expirations):
+        """
+        The method takes a point-in-time view of the data. It must be called while no mutation can happen.
+        It forks only if it is called from the engine's thread, else it copies the data.
+
+        Parameters:
+            data (dict): The database's data.
+            expirations (dict): The expiration times of the expiring entries, by key.
+
+        Returns:
+            capture (tuple): The method used, the view (the child's pid and the pipe it reports the snapshot's size through, or the copied data)
+                             and the start time, to be passed to complete().
+        """
+        started = time.monotonic()
+        if self.method == "fork" and threading.current_thread() is self.thread:
+            reader, writer = os.pipe()
+            pid = os.fork()
+            if pid == 0:  # the child process writes its view, reports its uncompressed size and exits
+                status = 1
+                try:
+                    os.close(reader)
+                    os.write(writer, RAW_SIZE.pack(self._write(data, expirations)))
+                    status = 0
+                finally:
+                    os._exit(status)
+            os.close(writer)
+            return ("fork", (pid, reader), started)
+        return ("copy", (data.copy() if isinstance(data, dict) else data.snapshot(), expirations.copy()), started)
+
+    def complete(self, capture):
+        """
+        The method waits until the captured view is written to the snapshot file and records the snapshot's duration and sizes.
+
+        Parameters:
+            capture (tuple): The value returned by capture().
+
+        Raises:
+            PermissionError: Permission denied to write to file.
+        """
+        method, view, started = capture
+        if method == "fork":
+            pid, reader = view
+            try:
+                _, status = os.waitpid(pid, 0)
+                report = os.read(reader, RAW_SIZE.size)
+            finally:
+                os.close(reader)
+            if status != 0 or len(report) != RAW_SIZE.size:
+                raise PermissionError("Permission denied to write to file.")
+            self.last_raw_size = RAW_SIZE.unpack(report)[0]
+        else:
+            try:
+                self.last_raw_size = self._write(*view)
+            except OSError:
+                raise PermissionError("Permission denied to write to file.")
+            finally:
+                if not isinstance(view[0], dict):
+                    view[0].close()
+        self.last_duration = time.monotonic() - started
+        self.last_size = os.path.getsize(self.filename)
+        self.last_time = time.time()
+
+    def _write(self, data, expirations):
+        """
+        The method writes the data and the expiration times, compressed if the engine compresses its snapshots, to a temporary file,
+        syncs it and atomically renames it over the snapshot file. The entries are pickled in batches, see SnapshotEngine.
+
+        Parameters:
+            data: The data that will be written, a dictionary or a view with an items() method.
+            expirations (dict): The expiration times of the expiring entries, by key.
+
+        Returns:
+            int: The size, in bytes, of the pickled data before compression.
+        """
+        temporary = f"{self.filename}.tmp"
+        with open(temporary, 'wb') as handle:
+            if self.compression == "zlib":
+                stream = gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=self.level, mtime=0)
+            elif self.compression == "lzma":
+                stream = lzma.LZMAFile(handle, "wb", preset=self.level)
+            else:
+                stream = handle
+            counter = _CountingWriter(stream)
+            pickle.dump(SNAPSHOT_HEADER, counter, pickle.HIGHEST_PROTOCOL)
+            entries = iter(data.items())
+            while True:
+                batch = list(islice(entries, SNAPSHOT_BATCH))
+                pickle.dump(batch, counter, pickle.HIGHEST_PROTOCOL)
+                if not batch:
+                    break
+            pickle.dump(expirations, counter, pickle.HIGHEST_PROTOCOL)
+            if stream is not handle:
+                stream.close()  # writes the end of the compressed stream, the file stays open
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.filename)
+        try:  # makes the rename durable, directories cannot be opened on every platform
+            directory = os.open(os.path.dirname(
+                os.path.abspath(self.filename)), os.O_RDONLY)
+        except OSError:
+            return counter.size
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        return counter.size
+
+
+def load_snapshot(handle, data=None, loaded=None):
+    """
+    The function reads a snapshot written by a SnapshotEngine, whatever its compression, storing its entries one batch at a time.
+
+    Parameters:
+        handle: The seekable binary file object the snapshot is read from, e.g. the snapshot file or the image received by a replica.
+        data (MutableMapping): The mapping the entries are stored in, e.g. a BoundedData, or None for a new dictionary.
+        loaded (Function): The function called after every stored batch, e.g. to evict the entries exceeding a memory limit, or None.
+
+    Returns:
+        (data, expirations): The snapshot's data and the expiration times (epoch seconds) of its expiring entries, by key.
+
+    Tests:
+        >>> import io
+        >>> load_snapshot(io.BytesIO(pickle.dumps(({"a": 1}, {"a": 1700000000.0}))))  # a previous snapshot
+        ({'a': 1}, {'a': 1700000000.0})
+    """
+    magic = handle.read(len(XZ_MAGIC))
+    handle.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        stream = gzip.GzipFile(fileobj=handle, mode="rb")
+    elif magic.startswith(XZ_MAGIC):
+        stream = lzma.LZMAFile(handle, "rb")
+    else:
+        stream = handle
+    unpickler = pickle.Unpickler(stream)
+    snapshot = unpickler.load()
+    if snapshot != SNAPSHOT_HEADER:  # a previous snapshot, a single pickle
+        entries, expirations = (snapshot, {}) if isinstance(snapshot, dict) else snapshot
+        if data is None:
+            return entries, expirations
+        batches = [entries.items()]
+    else:
+        batches = iter(unpickler.load, [])
+    data = {} if data is None else data
+    for batch in batches:
+        for key, value in batch:
+            data[key] = value
+        if loaded is not None:
+            loaded()
+    if snapshot == SNAPSHOT_HEADER:
+        expirations = unpickler.load()
+    return data, expirations
+
+
+class _CountingWriter():
+    """
+    This is a class for counting the bytes written to a file object.
+
+    Attributes:
+        stream: The file object the bytes are written to.
+        size (int): The number of bytes written.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return self.stream.write(data)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,658 @@
+import os
+import glob
+import math
+import mmap
+import time
+import struct
+import zlib
+import pickle
+from itertools import islice
+from collections import OrderedDict
+from collections.abc import MutableMapping, ItemsView
+from codec import encode_value, decode_value
+from wal import SET, DELETE, EXPIRE, FSYNC_POLICIES
+
+# Every record starts with the CRC32 of the rest of the record, its operation, the lengths of its encoded key and value,
+# and the expiration time (epoch seconds) of the entry, NaN if it does not expire. The encoded key and value follow.
+RECORD_HEADER = struct.Struct("!IBIId")
+
+# The storage engines of the server: the in-memory dictionary saved by snapshots, and the segment store.
+STORAGE_ENGINES = ("snapshot", "segment")
+
+# The default capacity of a segment, in bytes. A record larger than that gets a segment of its own size.
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+# The default number of decoded values kept in memory by a segment store.
+VALUE_CACHE_SIZE = 4096
+
+# The number of records the compactor moves at once while holding the lock.
+COMPACTION_BATCH = 1000
+
+
+class Segment():
+    """
+    This is a class for a segment file of records, mapped in memory.
+    The active segment (the last one) is preallocated to its capacity and written through the map.
+    Once full it is sealed: it is cut to the size of its records and never written again.
+
+    Attributes:
+        filename (String): The segment file name.
+        number (int): The segment's number, which orders the segments from the oldest to the newest.
+        handle: The segment file.
+        map (mmap): The map of the segment file.
+        capacity (int): The size of the segment file, in bytes.
+        size (int): The size of the segment's records, in bytes.
+    """
+
+    def __init__(self, filename, number, capacity=1):
+        """
+        The constructor for the segment class. It opens the segment file, creating it if it does not exist, and maps it.
+
+        Parameters:
+            filename (String): The segment file name.
+            number (int): The segment's number.
+            capacity (int): The minimum size of the segment file. A smaller file is extended.
+        """
+        self.filename = filename
+        self.number = number
+        self.handle = open(filename, 'r+b' if os.path.exists(filename) else 'w+b')
+        self.size = 0
+        self.capacity = max(os.path.getsize(filename), capacity)
+        if os.path.getsize(filename) < self.capacity:
+            self.handle.truncate(self.capacity)
+        self.map = mmap.mmap(self.handle.fileno(), self.capacity)
+
+    def records(self, start=0):
+        """
+        The method reads the segment's records, up to the first torn or missing record.
+
+        Parameters:
+            start (int): The offset of the first record.
+
+        Returns:
+            Generator: The (offset, operation, key, key length, value length, deadline, end) tuples of the records.
+                       The deadline is None if the entry does not expire, the end is the offset of the next record.
+        """
+        offset = start
+        while offset + RECORD_HEADER.size <= self.capacity:
+            checksum, operation, key_length, value_length, deadline = RECORD_HEADER.unpack_from(
+                self.map, offset)
+            key_start = offset + RECORD_HEADER.size
+            end = key_start + key_length + value_length
+            if operation not in (SET, DELETE, EXPIRE) or end > self.capacity or \
+                    zlib.crc32(self.map[offset + 4:end]) != checksum:
+                return
+            key = decode_value(self.map[key_start:key_start + key_length])
+            yield (offset, operation, key, key_length, value_length,
+                   None if math.isnan(deadline) else deadline, end)
+            offset = end
+
+    def write(self, record):
+        """
+        The method appends a record through the map.
+
+        Parameters:
+            record (bytes): The record.
+
+        Returns:
+            int: The offset of the record.
+        """
+        offset = self.size
+        self.map[offset:offset + len(record)] = record
+        self.size += len(record)
+        return offset
+
+    def flush(self):
+        """
+        The method syncs the map's changes to the segment file.
+        """
+        self.map.flush()
+
+    def seal(self):
+        """
+        The method syncs the segment and cuts its file to the size of its records.
+        """
+        self.map.flush()
+        self.map.close()
+        self.handle.truncate(max(self.size, 1))
+        self.capacity = max(self.size, 1)
+        self.map = mmap.mmap(self.handle.fileno(), self.capacity)
+
+    def close(self, remove=False):
+        """
+        The method unmaps and closes the segment file.
+
+        Parameters:
+            remove (bool): Whether the segment file is removed.
+        """
+        self.map.close()
+        self.handle.close()
+        if remove:
+            os.remove(self.filename)
+
+
+class SegmentStore():
+    """
+    This is a class for a storage engine keeping the entries in append-only segment files mapped in memory, instead of in one snapshot.
+    Every mutation appends a record to the active segment: the segments are the log, no write-ahead log is needed.
+    An index of the entries' locations (segment, offset and lengths) and of their expiration times is kept in memory
+    and checkpointed to the index file (the segments' file name followed by '.index').
+    On startup the segments are only mapped: the index file is loaded and only the records appended after its checkpoint are read.
+    So the startup time and memory depend on the number of entries, not on the size of their values.
+    The values are decoded lazily on access, and only the most recently read ones are kept decoded. With a compressor, the large values are stored compressed.
+    The compactor moves the live records out of the sealed segments that are mostly unreachable (overwritten or deleted records)
+    and removes them.
+    The changes are synced like a write-ahead log's, see wal.WriteAheadLog.
+
+    Attributes:
+        filename (String): The segments' file name. The segment files are named after it, followed by '.seg.' and their number.
+        index_filename (String): The index file name.
+        segment_size (int): The capacity of a new segment, in bytes.
+        fsync_policy (String): The fsync policy, "always", "interval" or "os".
+        fsync_interval (float): The interval, in seconds, of the "interval" fsync policy.
+        compressor (Compressor): The compressor of the large values, or None to store them uncompressed.
+        value_cache_size (int): The maximum number of decoded values kept in memory.
+        unsynced (bool): Whether records were written since the last sync.
+        last_sync (float): The time of the last sync.
+        segments (dict): The segments, by number.
+        active (Segment): The segment the records are appended to.
+        locations (dict): The (segment number, offset, key length, value length) of every entry's record, by key.
+        expires (dict): The expiration times (epoch seconds) of the expiring entries, by key.
+        values (OrderedDict): The decoded values kept in memory, by key, from the least to the most recently read.
+        garbage (dict): The number of bytes of unreachable records, by segment number.
+        data (SegmentData): The dictionary-like view of the entries.
+
+    Tests:
+        >>> import tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), "data")
+        >>> store = SegmentStore(filename, segment_size=64)
+        >>> store.data["a"] = [1, 2]
+        >>> store.data["b"] = "x" * 40
+        >>> store.data["a"] = "y"
+        >>> store.expire("b", 1700000000.0)
+        >>> del store.data["a"]
+        >>> store.commit()
+        >>> sorted(store.segments), store.data.copy(), store.expires
+        ([1, 2, 3, 4], {'b': 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'}, {'b': 1700000000.0})
+        >>> store.close()
+        >>> store = SegmentStore(filename, segment_size=64)  # no checkpoint, the records are read
+        >>> store.data.copy(), store.expires, dict(store.values)
+        ({'b': 'xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx'}, {'b': 1700000000.0}, {})
+        >>> import threading
+        >>> store.compact(threading.Lock())
+        2
+        >>> sorted(store.segments), store.data["b"] == "x" * 40, store.garbage
+        ([2, 4], True, {2: 0, 4: 48})
+        >>> store.close()
+        >>> store = SegmentStore(filename, segment_size=64)  # the checkpoint is loaded
+        >>> list(store.data), store.expires, dict(store.values)
+        (['b'], {'b': 1700000000.0}, {})
+        >>> store.close()
+        >>> store = SegmentStore(filename, segment_size=64, value_cache_size=2)
+        >>> for key in range(3):
+        ...     store.data[key] = key
+        >>> store.data[0], store.data[1], store.data[2], store.data[1], list(store.values)  # the least recently read value is dropped
+        (0, 1, 2, 1, [2, 1])
+    """
+
+    def __init__(self, filename, segment_size=SEGMENT_SIZE, fsync_policy="interval", fsync_interval=100, compressor=None,
+                 value_cache_size=VALUE_CACHE_SIZE):
+        """
+        The constructor for the segment store class. It maps the segments and loads the index.
+
+        Parameters:
+            filename (String): The segments' file name.
+            segment_size (int): The capacity of a new segment, in bytes.
+            fsync_policy (String): The fsync policy, "always", "interval" or "os".
+            fsync_interval (int): The interval, in milliseconds, of the "interval" fsync policy.
+            compressor (Compressor): The compressor of the large values, or None to store them uncompressed.
+            value_cache_size (int): The maximum number of decoded values kept in memory. If it is 0, every access decodes the value.
+
+        Raises:
+            ValueError: The fsync policy does not exist.
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Fsync policy {fsync_policy} does not exist.")
+        self.filename = filename
+        self.index_filename = f"{filename}.index"
+        self.segment_size = segment_size
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval / 1000
+        self.compressor = compressor
+        self.value_cache_size = value_cache_size
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+        self.values = OrderedDict()
+        self._load()
+        self.data = SegmentData(self)
+
+    def _load(self):
+        """
+        The method maps the segments, loads the index file and reads the records appended after its checkpoint.
+        Without a valid index file, all the records are read. The last segment becomes the active one.
+        """
+        numbers = sorted(int(name.rsplit(".", 1)[1]) for name in glob.glob(f"{glob.escape(self.filename)}.seg.*")
+                         if name.rsplit(".", 1)[1].isdigit())
+        self.segments = {}
+        for number in numbers:
+            capacity = self.segment_size if number == numbers[-1] else 1
+            self.segments[number] = Segment(
+                self._segment_filename(number), number, capacity)
+        if not self.segments:
+            self.segments[1] = Segment(
+                self._segment_filename(1), 1, self.segment_size)
+        self.active = self.segments[max(self.segments)]
+
+        try:
+            with open(self.index_filename, 'rb') as handle:
+                position, self.locations, self.expires, self.garbage = pickle.load(
+                    handle)
+            if any(location[0] not in self.segments for location in self.locations.values()):
+                raise ValueError("Index refers to a missing segment.")
+        except:
+            position = (0, 0)
+            self.locations, self.expires, self.garbage = {}, {}, {}
+
+        for number, segment in self.segments.items():
+            if number < position[0]:
+                segment.size = segment.capacity
+                # a segment compacted, but not yet removed, when the server stopped is only garbage
+                self.garbage.setdefault(number, segment.size)
+                continue
+            start = position[1] if number == position[0] else 0
+            segment.size = start
+            for offset, operation, key, key_length, value_length, deadline, end in segment.records(start):
+                self._replay(number, offset, operation, key,
+                             key_length, value_length, deadline)
+                segment.size = end
+            self.garbage.setdefault(number, 0)
+
+    def _replay(self, number, offset, operation, key, key_length, value_length, deadline):
+        """
+        The method applies a record read from a segment to the index.
+        """
+        if operation == SET:
+            self._supersede(key)
+            self.locations[key] = (number, offset, key_length, value_length)
+            if deadline is None:
+                self.expires.pop(key, None)
+            else:
+                self.expires[key] = deadline
+            return
+        self.garbage[number] = self.garbage.get(
+            number, 0) + RECORD_HEADER.size + key_length + value_length
+        if operation == DELETE:
+            self._supersede(key)
+            self.locations.pop(key, None)
+            self.expires.pop(key, None)
+        elif key in self.locations:
+            if deadline is None:
+                self.expires.pop(key, None)
+            else:
+                self.expires[key] = deadline
+
+    def get(self, key, keep=True):
+        """
+        The method reads the value of an entry, decoding it unless it is one of the most recently read values.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            keep (bool): Whether the decoded value is kept among the most recently read values.
+
+        Returns:
+            The value of the entry.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        try:
+            value = self.values[key]
+        except KeyError:
+            pass
+        else:
+            self.values.move_to_end(key)
+            return value
+        number, offset, key_length, value_length = self.locations[key]
+        start = offset + RECORD_HEADER.size + key_length
+        value = decode_value(self.segments[number].map[start:start + value_length])
+        if keep and self.value_cache_size > 0:
+            self.values[key] = value
+            if len(self.values) > self.value_cache_size:
+                self.values.popitem(last=False)
+        return value
+
+    def put(self, key, value):
+        """
+        The method appends a record setting an entry. The entry's expiration time is removed.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry.
+
+        Raises:
+            TypeError: If the key or the value cannot be encoded.
+        """
+        key_bytes, value_bytes = encode_value(key), encode_value(value, compressor=self.compressor)
+        number, offset = self._write(
+            self._pack(SET, key_bytes, value_bytes, None))
+        self._supersede(key)
+        self.locations[key] = (number, offset, len(key_bytes), len(value_bytes))
+        self.expires.pop(key, None)
+        self.values.pop(key, None)
+
+    def remove(self, key):
+        """
+        The method appends a record deleting an entry.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+
+        Raises:
+            KeyError: If the entry does not exist.
+        """
+        if key not in self.locations:
+            raise KeyError(key)
+        self._write(self._pack(DELETE, encode_value(key), b"", None), True)
+        self._supersede(key)
+        del self.locations[key]
+        self.expires.pop(key, None)
+        self.values.pop(key, None)
+
+    def expire(self, key, deadline):
+        """
+        The method appends a record setting or removing the expiration time of an existing entry.
+
+        Parameters:
+            key (Any hashable data type): The key of the entry.
+            deadline (float): The expiration time (epoch seconds), or None if the entry no longer expires.
+        """
+        self._write(self._pack(EXPIRE, encode_value(key), b"", deadline), True)
+        if deadline is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = deadline
+
+    def commit(self):
+        """
+        The method syncs the active segment as required by the fsync policy.
+        """
+        if self.unsynced and (self.fsync_policy == "always" or (
+                self.fsync_policy == "interval" and time.monotonic() - self.last_sync >= self.fsync_interval)):
+            self.active.flush()
+            self.unsynced = False
+            self.last_sync = time.monotonic()
+
+    def checkpoint(self, lock):
+        """
+        The method writes the index file. The index is copied while holding the lock and written without holding it.
+        The index file is written to a temporary file, synced and renamed over the previous one.
+
+        Parameters:
+            lock: The lock guarding the store against the mutations.
+        """
+        with lock:
+            self.active.flush()
+            self.unsynced = False
+            state = ((self.active.number, self.active.size), self.locations.copy(),
+                     self.expires.copy(), self.garbage.copy())
+        temporary = f"{self.index_filename}.tmp"
+        with open(temporary, 'wb') as handle:
+            pickle.dump(state, handle, pickle.HIGHEST_PROTOCOL)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.index_filename)
+
+    def compact(self, lock):
+        """
+        The method compacts the sealed segments of which more than half is unreachable, then checkpoints the index.
+        Their live records are appended to the active segment, COMPACTION_BATCH records at a time while holding the lock,
+        so the mutations are only paused briefly. Once the index is checkpointed, the compacted segments are removed.
+        A delete record is kept while an older segment may hold a record of the deleted entry.
+
+        Parameters:
+            lock: The lock guarding the store against the mutations.
+
+        Returns:
+            int: The number of compacted segments.
+        """
+        with lock:
+            numbers = [number for number, segment in sorted(self.segments.items())
+                       if segment is not self.active and self.garbage.get(number, 0) * 2 >= segment.size]
+        for number in numbers:
+            segment = self.segments[number]
+            records = segment.records()
+            while True:
+                with lock:
+                    batch = list(islice(records, COMPACTION_BATCH))
+                    for record in batch:
+                        self._move(segment, *record)
+                if len(batch) < COMPACTION_BATCH:
+                    break
+        self.checkpoint(lock)
+        with lock:
+            for number in numbers:
+                self.segments.pop(number).close(remove=True)
+                del self.garbage[number]
+        return len(numbers)
+
+    def _move(self, segment, offset, operation, key, key_length, value_length, deadline, end):
+        """
+        The method appends a copy of a record of a compacted segment to the active segment, if it is still needed.
+        """
+        if operation == SET:
+            if self.locations.get(key, (None, None))[:2] != (segment.number, offset):
+                return
+            key_start = offset + RECORD_HEADER.size
+            value_bytes = segment.map[key_start + key_length:end]
+            number, new_offset = self._write(self._pack(
+                SET, segment.map[key_start:key_start + key_length], value_bytes, self.expires.get(key)))
+            self.locations[key] = (number, new_offset, key_length, value_length)
+        elif operation == DELETE:
+            if key not in self.locations and min(self.segments) < segment.number:
+                self._write(segment.map[offset:end], True)
+        else:
+            location = self.locations.get(key)
+            if location is not None and location[0] != segment.number and self.expires.get(key) == deadline:
+                self._write(segment.map[offset:end], True)
+
+    def _pack(self, operation, key_bytes, value_bytes, deadline):
+        """
+        The method builds a record.
+
+        Returns:
+            bytearray: The record.
+        """
+        record = bytearray(RECORD_HEADER.pack(0, operation, len(key_bytes), len(value_bytes),
+                                              math.nan if deadline is None else deadline))
+        record += key_bytes
+        record += value_bytes
+        struct.pack_into("!I", record, 0, zlib.crc32(memoryview(record)[4:]))
+        return record
+
+    def _write(self, record, garbage=False):
+        """
+        The method appends a record to the active segment, sealing it and starting a new one if the record does not fit.
+
+        Parameters:
+            record (bytes): The record.
+            garbage (bool): Whether the record is unreachable once written (a delete or expiration record).
+
+        Returns:
+            (segment number, offset): The location of the record.
+        """
+        if self.active.size + len(record) > self.active.capacity:
+            self.active.seal()
+            number = self.active.number + 1
+            self.active = Segment(self._segment_filename(number), number,
+                                  max(self.segment_size, len(record)))
+            self.segments[number] = self.active
+            self.garbage[number] = 0
+        offset = self.active.write(record)
+        if garbage:
+            self.garbage[self.active.number] += len(record)
+        self.unsynced = True
+        return self.active.number, offset
+
+    def _supersede(self, key):
+        """
+        The method counts the current record of an entry, if any, as unreachable.
+        """
+        location = self.locations.get(key)
+        if location is not None:
+            self.garbage[location[0]] = self.garbage.get(location[0], 0) + \
+                RECORD_HEADER.size + location[2] + location[3]
+
+    def _segment_filename(self, number):
+        return f"{self.filename}.seg.{number:06d}"
+
+    def close(self):
+        """
+        The method syncs and closes the segments.
+        """
+        self.active.flush()
+        for segment in self.segments.values():
+            segment.close()
+
+
+class SegmentData(MutableMapping):
+    """
+    This is a class for the dictionary-like view of the entries of a segment store.
+    Reading an entry decodes its value on its first access, setting and deleting an entry append a record.
+    Iterating over the items decodes the values without keeping them.
+    """
+
+    def __init__(self, store):
+        """
+        The constructor for the segment data class.
+
+        Parameters:
+            store (SegmentStore): The segment store.
+        """
+        self.store = store
+
+    def __getitem__(self, key):
+        return self.store.get(key)
+
+    def __setitem__(self, key, value):
+        self.store.put(key, value)
+
+    def __delitem__(self, key):
+        self.store.remove(key)
+
+    def __contains__(self, key):
+        return key in self.store.locations
+
+    def __iter__(self):
+        return iter(self.store.locations)
+
+    def __reversed__(self):
+        return reversed(self.store.locations)
+
+    def __len__(self):
+        return len(self.store.locations)
+
+    def __reduce__(self):
+        return (dict, (), None, None, iter(self.items()))
+
+    def __repr__(self):
+        return repr(self.copy())
+
+    def items(self):
+        """
+        The method returns a view of the entries, which decodes the values without keeping them.
+        """
+        return SegmentItems(self)
+
+    def copy(self):
+        """
+        The method returns a dictionary holding all the entries.
+        """
+        return dict(self.items())
+
+    def snapshot(self):
+        """
+        The method returns a point-in-time view of the entries, without decoding the values. See SegmentSnapshot.
+        """
+        store = self.store
+        numbers = {location[0] for location in store.locations.values()}
+        descriptors = {number: os.open(store.segments[number].filename, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+                       for number in numbers}
+        return SegmentSnapshot(store.locations.copy(), descriptors)
+
+
+class SegmentSnapshot():
+    """
+    This is a class for a point-in-time view of a segment store's entries, taken in one C level copy of their locations.
+    The values are only read and decoded, one at a time, when the view is iterated.
+    The view has its own descriptor of every segment holding a viewed record: the records are never overwritten,
+    and a compacted segment is still read after it is removed. It is pickled as a dictionary and should be closed.
+
+    Attributes:
+        locations (dict): The (segment number, offset, key length, value length) of every entry's record, by key.
+        descriptors (dict): The view's descriptors of the segment files, by segment number.
+
+    Tests:
+        >>> import tempfile
+        >>> store = SegmentStore(os.path.join(tempfile.mkdtemp(), "data"), segment_size=64)
+        >>> store.data["a"], store.data["b"] = 1, "x" * 40
+        >>> view = store.data.snapshot()
+        >>> store.data["a"] = 2
+        >>> import pickle
+        >>> pickle.loads(pickle.dumps(view)) == {"a": 1, "b": "x" * 40}
+        True
+        >>> view.close()
+        >>> store.close()
+    """
+
+    def __init__(self, locations, descriptors):
+        self.locations = locations
+        self.descriptors = descriptors
+
+    def __reduce__(self):
+        return (dict, (), None, None, self.items())
+
+    def items(self):
+        """
+        The method iterates over the viewed entries, in the order of the index, decoding their values.
+
+        Returns:
+            Generator: The (key, value) tuples.
+        """
+        for key, (number, offset, key_length, value_length) in self.locations.items():
+            start = offset + RECORD_HEADER.size + key_length
+            descriptor = self.descriptors[number]
+            if hasattr(os, "pread"):
+                encoded = os.pread(descriptor, value_length, start)
+            else:
+                os.lseek(descriptor, start, os.SEEK_SET)
+                encoded = os.read(descriptor, value_length)
+            yield key, decode_value(encoded)
+
+    def close(self):
+        """
+        The method closes the view's descriptors of the segment files.
+        """
+        for descriptor in self.descriptors.values():
+            os.close(descriptor)
+        self.descriptors = {}
+
+
+class SegmentItems(ItemsView):
+    """
+    This is a class for the view of a segment store's entries, in the order of the index.
+    """
+
+    def __iter__(self):
+        store = self._mapping.store
+        for key in list(store.locations):
+            yield key, store.get(key, keep=False)
+
+    def __reversed__(self):
+        store = self._mapping.store
+        for key in list(reversed(store.locations)):
+            yield key, store.get(key, keep=False)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
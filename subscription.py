@@ -0,0 +1,220 @@
+# The policies applied to a subscriber whose unsent notifications exceed the buffer limit:
+# "drop" discards the new notifications and tells the subscriber how many were dropped once it catches up,
+# "disconnect" closes its connection.
+SUBSCRIBER_POLICIES = ("drop", "disconnect")
+
+# The default number of unsent bytes from which a subscriber is a slow consumer.
+SUBSCRIBER_BUFFER_LIMIT = 1024 * 1024
+
+
+class Subscription():
+    """
+    This is a class for a connection's subscription to the changes of exact keys or of the entries matching a query.
+
+    Attributes:
+        subscription_id (int): The subscription's id.
+        connection: The subscriber's connection.
+        request_id (int): The id of the subscribe request. The notifications are sent in frames carrying it.
+        keys (frozenset): The watched keys, or None if a query is watched.
+        plan (QueryPlan): The compiled query whose matching entries are watched, or None if keys are watched.
+        dropped (int): The number of notifications dropped since the last one sent.
+    """
+
+    def __init__(self, subscription_id, connection, request_id, keys=None, plan=None):
+        """
+        The constructor for the subscription class.
+
+        Parameters:
+            subscription_id (int): The subscription's id.
+            connection: The subscriber's connection.
+            request_id (int): The id of the subscribe request.
+            keys (Iterable): The watched keys, or None if a query is watched.
+            plan (QueryPlan): The compiled query whose matching entries are watched, or None if keys are watched.
+        """
+        self.subscription_id = subscription_id
+        self.connection = connection
+        self.request_id = request_id
+        self.keys = None if keys is None else frozenset(keys)
+        self.plan = plan
+        self.dropped = 0
+
+
+class SubscriptionRegistry():
+    """
+    This is a class for finding the subscriptions concerned by a change.
+    The watched keys are found with a dictionary lookup, so their cost does not depend on the number of subscriptions;
+    only the query subscriptions are matched one by one.
+
+    Attributes:
+        subscriptions (dict): The subscriptions, by id.
+        by_key (dict): The sets of the subscriptions watching a key, by key.
+        queries (dict): The subscriptions watching a query, by id.
+        last_id (int): The id of the last subscription.
+        notifications (int): The number of notifications sent.
+        dropped (int): The number of notifications dropped by the "drop" policy.
+        disconnected (int): The number of subscribers disconnected by the "disconnect" policy.
+
+    Tests:
+        >>> from query import compile_query
+        >>> registry = SubscriptionRegistry()
+        >>> by_key = registry.add("a", 1, keys=[1, 2])
+        >>> by_query = registry.add("b", 2, plan=compile_query("read key > int ( 1 )"))
+        >>> [subscription.subscription_id for subscription in registry.matching(2, "x")]
+        [1, 2]
+        >>> [subscription.subscription_id for subscription in registry.matching("text", "x")]  # keys of other types never match a range
+        []
+        >>> by_value = registry.add("c", 3, plan=compile_query("read value > int ( 10 )"))
+        >>> [subscription.subscription_id for subscription in registry.unmatched(5, 20, 3)], registry.unmatched(5, 20, 30)
+        ([3], [])
+        >>> [subscription.subscription_id for subscription in registry.unmatched(5, 20, "x")]  # not comparable, so no longer matching
+        [3]
+        >>> registry.remove(3).connection
+        'c'
+        >>> registry.remove_connection("a")
+        >>> [subscription.subscription_id for subscription in registry.matching(2, "x")], len(registry)
+        ([2], 1)
+        >>> registry.remove(2).connection, len(registry), registry.remove(2)
+        ('b', 0, None)
+    """
+
+    def __init__(self):
+        """
+        The constructor for the subscription registry class.
+        """
+        self.subscriptions = {}
+        self.by_key = {}
+        self.queries = {}
+        self.last_id = 0
+        self.notifications = 0
+        self.dropped = 0
+        self.disconnected = 0
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def add(self, connection, request_id, keys=None, plan=None):
+        """
+        The method registers a subscription to exact keys or to a query.
+
+        Parameters:
+            connection: The subscriber's connection.
+            request_id (int): The id of the subscribe request.
+            keys (Iterable): The watched keys, or None if a query is watched.
+            plan (QueryPlan): The compiled query whose matching entries are watched, or None if keys are watched.
+
+        Returns:
+            Subscription: The registered subscription.
+
+        Raises:
+            TypeError: If a key is not hashable.
+        """
+        self.last_id += 1
+        subscription = Subscription(self.last_id, connection, request_id, keys, plan)
+        if subscription.keys is None:
+            self.queries[subscription.subscription_id] = subscription
+        else:
+            for key in subscription.keys:
+                self.by_key.setdefault(key, set()).add(subscription)
+        self.subscriptions[subscription.subscription_id] = subscription
+        return subscription
+
+    def remove(self, subscription_id):
+        """
+        The method unregisters a subscription.
+
+        Parameters:
+            subscription_id (int): The subscription's id.
+
+        Returns:
+            Subscription: The unregistered subscription, or None if it does not exist.
+        """
+        subscription = self.subscriptions.pop(subscription_id, None)
+        if subscription is None:
+            return None
+        if subscription.keys is None:
+            del self.queries[subscription_id]
+        else:
+            for key in subscription.keys:
+                watchers = self.by_key[key]
+                watchers.discard(subscription)
+                if not watchers:
+                    del self.by_key[key]
+        return subscription
+
+    def remove_connection(self, connection):
+        """
+        The method unregisters all the subscriptions of a connection.
+
+        Parameters:
+            connection: The subscriber's connection.
+        """
+        for subscription_id in [subscription_id for subscription_id, subscription in self.subscriptions.items()
+                                if subscription.connection is connection]:
+            self.remove(subscription_id)
+
+    def matching(self, key, value):
+        """
+        The method finds the subscriptions concerned by a change of an entry.
+        A query subscription whose predicate cannot compare the entry (e.g. a range over another type) is not concerned.
+
+        Parameters:
+            key (Any hashable data type): The key of the changed entry.
+            value (Any data type): The new value of the entry, or its value before it was deleted.
+
+        Returns:
+            List: The concerned subscriptions, in the order of their ids.
+        """
+        try:
+            matches = list(self.by_key.get(key, ()))
+        except TypeError:
+            matches = []
+        for subscription in self.queries.values():
+            try:
+                if subscription.plan.match(key, value):
+                    matches.append(subscription)
+            except:
+                pass
+        if len(matches) > 1:
+            matches.sort(key=lambda subscription: subscription.subscription_id)
+        return matches
+
+    def unmatched(self, key, old_value, value):
+        """
+        The method finds the query subscriptions an entry leaves when it is changed: its previous value matched their query, its new value does not.
+
+        Parameters:
+            key (Any hashable data type): The key of the changed entry.
+            old_value (Any data type): The previous value of the entry.
+            value (Any data type): The new value of the entry.
+
+        Returns:
+            List: The subscriptions, in the order of their ids.
+        """
+        left = []
+        for subscription in self.queries.values():
+            match = subscription.plan.match
+            try:
+                matched = match(key, old_value)
+            except:
+                continue
+            try:
+                if matched and not match(key, value):
+                    left.append(subscription)
+            except:
+                left.append(subscription)  # the new value cannot be compared, so it does not match
+        return left
+
+    def report(self):
+        """
+        The method reports the number of subscriptions and of notifications.
+
+        Returns:
+            dict: The number of "subscriptions", of sent "notifications", of "dropped" ones and of "disconnected" subscribers.
+        """
+        return {"subscriptions": len(self.subscriptions), "notifications": self.notifications,
+                "dropped": self.dropped, "disconnected": self.disconnected}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,193 @@
+import os
+import time
+import struct
+import zlib
+from codec import encode_value, decode_value
+
+# Every record starts with the payload length and the payload's CRC32.
+RECORD_HEADER = struct.Struct("!II")
+
+# The mutations recorded in the log.
+SET = 1
+DELETE = 2
+EXPIRE = 3
+
+FSYNC_POLICIES = ("always", "interval", "os")
+
+
+class WriteAheadLog():
+    """
+    This is a class for an append-only log of the mutations applied to the database.
+    The mutations are buffered in memory and written by commit() in one write (group commit), so many requests share one write and one fsync.
+    When the file is synced depends on the fsync policy:
+        - "always": On every commit, so no acknowledged mutation is lost.
+        - "interval": At most once every 'fsync_interval' milliseconds, so up to that interval of mutations can be lost.
+        - "os": Never explicitly, the operating system decides when the file reaches the disk.
+    When a snapshot starts, the log is rotated: its records are moved to the rotated file (the log file name followed by '.old').
+    When the snapshot is written, the rotated file is discarded. If the snapshot fails, the rotated file is kept and replayed.
+
+    Attributes:
+        filename (String): The log file name.
+        rotated_filename (String): The file name of the records moved out of the log by the last rotation.
+        fsync_policy (String): The fsync policy.
+        fsync_interval (float): The interval, in seconds, of the "interval" fsync policy.
+        buffer (bytearray): The records that were not written yet.
+        unsynced (bool): Whether records were written since the last fsync.
+        last_sync (float): The time of the last fsync.
+        handle: The log file, opened for appending.
+
+    Tests:
+        >>> import tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), "data.wal")
+        >>> log = WriteAheadLog(filename, "always", 100)
+        >>> list(log.replay())
+        []
+        >>> log.append(SET, "a", 1)
+        >>> log.append(SET, "b", [2])
+        >>> log.append(DELETE, "a")
+        >>> log.append(EXPIRE, "b", 1700000000.0)
+        >>> log.commit()
+        >>> log.close()
+        >>> with open(filename, "ab") as handle:  # a record torn by a crash
+        ...     _ = handle.write(RECORD_HEADER.pack(100, 0) + b"torn")
+        >>> log = WriteAheadLog(filename, "always", 100)
+        >>> list(log.replay())
+        [(1, 'a', 1), (1, 'b', [2]), (2, 'a', None), (3, 'b', 1700000000.0)]
+        >>> log.rotate()
+        >>> log.append(SET, "c", 3)
+        >>> log.commit()
+        >>> [key for operation, key, value in log.replay()]
+        ['a', 'b', 'a', 'b', 'c']
+        >>> log.discard_rotated()
+        >>> list(log.replay())
+        [(1, 'c', 3)]
+    """
+
+    def __init__(self, filename, fsync_policy, fsync_interval):
+        """
+        The constructor for the write-ahead log class.
+
+        Parameters:
+            filename (String): The log file name.
+            fsync_policy (String): The fsync policy, "always", "interval" or "os".
+            fsync_interval (int): The interval, in milliseconds, of the "interval" fsync policy.
+
+        Raises:
+            ValueError: The fsync policy does not exist.
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Fsync policy {fsync_policy} does not exist.")
+        self.filename = filename
+        self.rotated_filename = f"{filename}.old"
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval / 1000
+        self.buffer = bytearray()
+        self.unsynced = False
+        self.last_sync = time.monotonic()
+        self.handle = open(filename, 'ab', buffering=0)
+
+    def append(self, operation, key, value=None):
+        """
+        The method buffers a mutation record. The record is written by the next commit().
+
+        Parameters:
+            operation (int): The mutation, SET, DELETE or EXPIRE.
+            key (Any hashable data type): The key of the entry.
+            value (Any data type): The value of the entry, for a SET mutation.
+                                   The expiration time (epoch seconds) of the entry, or None if it no longer expires, for an EXPIRE mutation.
+        """
+        payload = encode_value((operation, key, value))
+        self.buffer += RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+        self.buffer += payload
+
+    def commit(self):
+        """
+        The method writes the buffered records to the log file and syncs it as required by the fsync policy.
+        """
+        if self.buffer:
+            self.handle.write(self.buffer)
+            self.buffer.clear()
+            self.unsynced = True
+        if self.unsynced and (self.fsync_policy == "always" or (
+                self.fsync_policy == "interval" and time.monotonic() - self.last_sync >= self.fsync_interval)):
+            os.fsync(self.handle.fileno())
+            self.unsynced = False
+            self.last_sync = time.monotonic()
+
+    def replay(self):
+        """
+        The method reads the mutations recorded in the rotated file and in the log file.
+        A record torn by a crash, and everything after it, is cut off the log file.
+
+        Returns:
+            Generator: The (operation, key, value) tuples, in the order they were recorded.
+        """
+        if os.path.exists(self.rotated_filename):
+            with open(self.rotated_filename, 'rb') as handle:
+                yield from self._read_records(handle.read())[0]
+        with open(self.filename, 'rb') as handle:
+            records, end = self._read_records(handle.read())
+        yield from records
+        self.handle.truncate(end)
+
+    def _read_records(self, content):
+        """
+        The method decodes the records of a log file's content, up to the first torn record.
+
+        Parameters:
+            content (bytes): The log file's content.
+
+        Returns:
+            (records, end): The list of (operation, key, value) tuples and the offset where the valid records end.
+        """
+        records = []
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(content):
+            length, checksum = RECORD_HEADER.unpack_from(content, offset)
+            start = offset + RECORD_HEADER.size
+            payload = content[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append(decode_value(payload))
+            offset = start + length
+        return records, offset
+
+    def rotate(self):
+        """
+        The method moves the log's records to the rotated file and starts an empty log.
+        It is called, while no mutation can happen, when a snapshot starts.
+        If the rotated file of a failed snapshot exists, the records are appended to it.
+        """
+        self.commit()
+        self.handle.close()
+        if os.path.exists(self.rotated_filename):
+            with open(self.filename, 'rb') as source, open(self.rotated_filename, 'ab') as target:
+                target.write(source.read())
+                target.flush()
+                os.fsync(target.fileno())
+            os.remove(self.filename)
+        else:
+            os.replace(self.filename, self.rotated_filename)
+        self.handle = open(self.filename, 'ab', buffering=0)
+        self.unsynced = False
+
+    def discard_rotated(self):
+        """
+        The method removes the rotated file. It is called once its mutations are part of a written snapshot.
+        """
+        if os.path.exists(self.rotated_filename):
+            os.remove(self.rotated_filename)
+
+    def close(self):
+        """
+        The method commits the buffered records and closes the log file.
+        """
+        self.commit()
+        if self.unsynced and self.fsync_policy != "os":
+            os.fsync(self.handle.fileno())
+        self.handle.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()